@@ -33,6 +33,5 @@ fi
 
 # Execute VidTerm using the virtual environment's Python interpreter
 # "$@" passes all command-line arguments given to run_vidterm.sh to vidterm.py
-"$VENV_PYTHON" "$VIDTERM_SCRIPT" "$@"
-
-exit 0
+# exec hands over the process, so vidterm.py's exit status reaches the caller
+exec "$VENV_PYTHON" "$VIDTERM_SCRIPT" "$@"
@@ -1,6 +1,12 @@
 import unittest
 from unittest.mock import patch, MagicMock, AsyncMock
 import asyncio
+import json
+import os
+import tempfile
+import io
+import time
+import yt_dlp
 
 # Assuming vidterm.py is in the parent directory or PYTHONPATH is set up
 # For simplicity in subtask, we might need to adjust path or copy vidterm.py
@@ -8,6 +14,9 @@ import asyncio
 # If not, the subtask runner might need to handle this.
 import vidterm
 
+# Some tests below replace vidterm.show_status_message outright; keep the real one for those that need it
+show_status_message = vidterm.show_status_message
+
 # Helper to run async tests
 def async_test(f):
     def wrapper(*args, **kwargs):
@@ -16,11 +25,35 @@ def async_test(f):
 
 class TestVidtermVideoFunctions(unittest.TestCase):
 
+    def setUp(self):
+        # Keep tests off the user's on-disk search cache
+        patcher = patch('vidterm.search_cache', vidterm.SearchResultCache(':memory:'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Fresh pool per test so instances built from one test's mock never leak into another
+        patcher = patch('vidterm.ydl_pool', vidterm.YoutubeDLPool())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('vidterm.search_sessions', vidterm.SearchSessionPool())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('vidterm.stream_prefetcher', vidterm.StreamPrefetcher())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('vidterm.stream_url_cache', vidterm.StreamUrlCache(vidterm.resolve_stream_url_async))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        scheduler = vidterm.JobScheduler()
+        patcher = patch('vidterm.job_scheduler', scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(scheduler.close)
+
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_search_videos_async_success(self, MockYoutubeDL):
-        # Mock the context manager and its extract_info method
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        # Mock the pooled YoutubeDL instance and its extract_info method
+        mock_ydl_instance = MockYoutubeDL.return_value
         mock_ydl_instance.extract_info = MagicMock(return_value={
             'entries': [
                 {'id': '123', 'title': 'Test Video 1', 'uploader': 'User1', 'duration_string': '10:00'},
@@ -37,18 +70,20 @@ class TestVidtermVideoFunctions(unittest.TestCase):
             results = await vidterm.search_videos_async("test query")
 
         self.assertEqual(len(results), 2)
-        self.assertEqual(results[0]['id'], '123')
-        self.assertEqual(results[0]['title'], 'Test Video 1')
-        self.assertEqual(results[1]['id'], '456')
-        self.assertEqual(results[1]['title'], 'Test Video 2')
-        mock_ydl_instance.extract_info.assert_called_once_with("ytsearch10:test query", download=False)
+        self.assertEqual(results[0].id, '123')
+        self.assertEqual(results[0].title, 'Test Video 1')
+        self.assertEqual(results[0].duration, 600)
+        self.assertEqual(results[1].id, '456')
+        self.assertEqual(results[1].title, 'Test Video 2')
+        self.assertEqual(results[1].duration_string, '5:30')
+        mock_ydl_instance.extract_info.assert_called_once_with("ytsearch1000:test query", download=False, process=False)
         vidterm.show_status_message.assert_any_call("Searching for: test query...")
 
 
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_search_videos_async_no_results(self, MockYoutubeDL):
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        mock_ydl_instance = MockYoutubeDL.return_value
         mock_ydl_instance.extract_info = MagicMock(return_value={'entries': []})
 
         with patch('vidterm.application_instance', MagicMock()) as mock_app:
@@ -62,7 +97,7 @@ class TestVidtermVideoFunctions(unittest.TestCase):
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_search_videos_async_download_error(self, MockYoutubeDL):
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        mock_ydl_instance = MockYoutubeDL.return_value
         # Simulate a yt-dlp DownloadError
         # Need to ensure yt_dlp.utils is available or mock DownloadError itself if not
         # For now, assuming yt_dlp is in the environment for the test execution context
@@ -74,13 +109,13 @@ class TestVidtermVideoFunctions(unittest.TestCase):
             results = await vidterm.search_videos_async("error query")
 
         self.assertEqual(len(results), 0)
-        vidterm.show_status_message.assert_any_call("Search Error: Simulated download error", 5)
+        vidterm.show_status_message.assert_any_call("Search Error: Simulated download error", 5, vidterm.STATUS_PRIORITY_ERROR)
 
 
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_get_stream_url_async_success_direct_url(self, MockYoutubeDL):
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        mock_ydl_instance = MockYoutubeDL.return_value
         mock_ydl_instance.extract_info = MagicMock(return_value={'url': 'http://example.com/stream.mp4'})
 
         with patch('vidterm.application_instance', MagicMock()) as mock_app:
@@ -95,7 +130,7 @@ class TestVidtermVideoFunctions(unittest.TestCase):
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_get_stream_url_async_success_from_formats(self, MockYoutubeDL):
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        mock_ydl_instance = MockYoutubeDL.return_value
         mock_ydl_instance.extract_info = MagicMock(return_value={
             'formats': [{'url': 'http://example.com/format_stream.mp4'}]
         })
@@ -110,7 +145,7 @@ class TestVidtermVideoFunctions(unittest.TestCase):
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_get_stream_url_async_no_url(self, MockYoutubeDL):
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        mock_ydl_instance = MockYoutubeDL.return_value
         mock_ydl_instance.extract_info = MagicMock(return_value={'formats': []}) # No url, no formats with url
 
         with patch('vidterm.application_instance', MagicMock()) as mock_app:
@@ -119,12 +154,12 @@ class TestVidtermVideoFunctions(unittest.TestCase):
             url = await vidterm.get_stream_url_async('video789')
 
         self.assertIsNone(url)
-        vidterm.show_status_message.assert_any_call("Could not find direct stream URL.", 3)
+        vidterm.show_status_message.assert_any_call("Could not find direct stream URL.", 3, vidterm.STATUS_PRIORITY_ERROR)
 
     @patch('yt_dlp.YoutubeDL')
     @async_test
     async def test_get_stream_url_async_download_error(self, MockYoutubeDL):
-        mock_ydl_instance = MockYoutubeDL.return_value.__enter__.return_value
+        mock_ydl_instance = MockYoutubeDL.return_value
         mock_ydl_instance.extract_info = MagicMock(side_effect=yt_dlp.utils.DownloadError("Stream fetch error"))
 
         with patch('vidterm.application_instance', MagicMock()) as mock_app:
@@ -133,7 +168,1571 @@ class TestVidtermVideoFunctions(unittest.TestCase):
             url = await vidterm.get_stream_url_async('video_error')
 
         self.assertIsNone(url)
-        vidterm.show_status_message.assert_any_call("Error getting stream URL: Stream fetch error", 5)
+        vidterm.show_status_message.assert_any_call("Error getting stream URL: Stream fetch error", 5, vidterm.STATUS_PRIORITY_ERROR)
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_search_videos_async_served_from_cache(self, MockYoutubeDL):
+        mock_ydl_instance = MockYoutubeDL.return_value
+        mock_ydl_instance.extract_info = MagicMock(return_value={
+            'entries': [{'id': '123', 'title': 'Test Video 1', 'uploader': 'User1', 'duration_string': '10:00'}]
+        })
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            first = await vidterm.search_videos_async("Cached  Query")
+            second = await vidterm.search_videos_async("cached query")
+
+        self.assertEqual(first, second)
+        mock_ydl_instance.extract_info.assert_called_once()
+        self.assertEqual(vidterm.search_cache.hits, 1)
+        self.assertEqual(vidterm.search_cache.misses, 1)
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_search_videos_streaming_async_delivers_each_entry(self, MockYoutubeDL):
+        mock_ydl_instance = MockYoutubeDL.return_value
+        mock_ydl_instance.extract_info = MagicMock(return_value={
+            'entries': iter([
+                {'id': '123', 'title': 'Test Video 1', 'uploader': 'User1', 'duration': 600},
+                None,
+                {'id': '456', 'title': 'Test Video 2', 'uploader': None, 'duration': None},
+            ])
+        })
+        received = []
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            results = await vidterm.search_videos_streaming_async("stream query", received.append, vidterm.threading.Event())
+
+        self.assertEqual(received, results)
+        self.assertEqual([r.id for r in results], ['123', '456'])
+        self.assertEqual(results[0].duration_string, '10:00')
+        self.assertEqual(results[1].uploader, 'N/A')
+        mock_ydl_instance.extract_info.assert_called_once_with("ytsearch1000:stream query", download=False, process=False)
+        self.assertEqual(vidterm.search_cache.get("stream query"), results)
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_search_videos_streaming_async_cancelled(self, MockYoutubeDL):
+        cancel_event = vidterm.threading.Event()
+
+        def entries():
+            yield {'id': '123', 'title': 'Test Video 1'}
+            cancel_event.set() # A newer query was submitted mid-stream
+            yield {'id': '456', 'title': 'Test Video 2'}
+
+        MockYoutubeDL.return_value.extract_info = MagicMock(return_value={'entries': entries()})
+        received = []
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            results = await vidterm.search_videos_streaming_async("stale query", received.append, cancel_event)
+
+        self.assertIsNone(results)
+        self.assertNotIn('456', [r.id for r in received])
+        self.assertIsNone(vidterm.search_cache.get("stale query"))
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_search_videos_async_second_page(self, MockYoutubeDL):
+        entries = [{'id': str(i), 'title': f'Video {i}', 'uploader': 'U', 'duration_string': '1:00'} for i in range(15)]
+        MockYoutubeDL.return_value.extract_info = MagicMock(return_value={'entries': entries})
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            results = await vidterm.search_videos_async("paged query", page=1)
+
+        self.assertEqual([r.id for r in results], [str(i) for i in range(10, 15)])
+        MockYoutubeDL.return_value.extract_info.assert_called_once_with("ytsearch1000:paged query", download=False, process=False)
+        self.assertEqual(vidterm.search_cache.get("paged query", 1), results)
+        self.assertIsNone(vidterm.search_cache.get("paged query"))
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_next_page_continues_the_open_search(self, MockYoutubeDL):
+        pulled = []
+
+        def entries():
+            for i in range(35):
+                pulled.append(i)
+                yield {'id': str(i), 'title': f'Video {i}'}
+        MockYoutubeDL.return_value.extract_info = MagicMock(side_effect=lambda *args, **kwargs: {'entries': entries()})
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            pages = [await vidterm.search_videos_streaming_async("deep query", lambda result: None,
+                                                                 vidterm.threading.Event(), page) for page in range(2)]
+            pages.append(await vidterm.search_videos_async("deep query", page=2))
+            pages.append(await vidterm.search_videos_async("deep query", page=3))
+
+        self.assertEqual([[r.id for r in page] for page in pages],
+                         [[str(i) for i in range(start, min(start + 10, 35))] for start in (0, 10, 20, 30)])
+        MockYoutubeDL.return_value.extract_info.assert_called_once() # Each page read on from the last
+        self.assertEqual(pulled, list(range(35)))
+        self.assertEqual(vidterm.search_sessions.continued, 3)
+
+    def test_failed_page_closes_its_search_session(self):
+        ydl = MagicMock()
+        ydl.extract_info.return_value = {'entries': iter([{'id': 'a'}, {'id': 'b'}])}
+        sessions = vidterm.SearchSessionPool()
+        with patch.object(vidterm.ydl_pool, 'acquire', return_value=ydl), \
+             patch.object(vidterm.ydl_pool, 'release') as release:
+            with self.assertRaises(vidterm.JobCancelled):
+                with sessions.checkout('q', 0) as session:
+                    next(session.read(0, 10))
+                    raise vidterm.JobCancelled()
+            release.assert_called_once_with('search', ydl)
+            with sessions.checkout('q', 0) as session: # Searches again
+                self.assertEqual(session.position, 0)
+        self.assertEqual(ydl.extract_info.call_count, 2)
+        self.assertEqual(sessions.continued, 0)
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_identical_concurrent_searches_share_one_extraction(self, MockYoutubeDL):
+        MockYoutubeDL.return_value.extract_info = MagicMock(return_value={
+            'entries': iter([{'id': '123', 'title': 'Test Video 1'}, {'id': '456', 'title': 'Test Video 2'}])
+        })
+        first, second = [], []
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            results = await asyncio.gather(
+                vidterm.search_videos_streaming_async("shared query", first.append, vidterm.threading.Event()),
+                vidterm.search_videos_streaming_async("Shared  Query", second.append, vidterm.threading.Event()))
+
+        MockYoutubeDL.return_value.extract_info.assert_called_once()
+        self.assertEqual(results[0], results[1])
+        self.assertEqual([r.id for r in first], ['123', '456'])
+        self.assertEqual(first, second)
+        self.assertEqual(vidterm.inflight_searches, {})
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_identical_concurrent_batch_searches_are_coalesced(self, MockYoutubeDL):
+        MockYoutubeDL.return_value.extract_info = MagicMock(return_value={'entries': [{'id': '123', 'title': 'Test Video 1'}]})
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            results = await asyncio.gather(vidterm.search_videos_async("batch query"), vidterm.search_videos_async("batch query"))
+
+        MockYoutubeDL.return_value.extract_info.assert_called_once()
+        self.assertEqual(results[0], results[1])
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_get_stream_url_async_uses_prefetched_url(self, MockYoutubeDL):
+        vidterm.stream_url_cache.put('video123', 'http://example.com/prefetched.mp4', 1.5)
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            url = await vidterm.get_stream_url_async('video123')
+
+        self.assertEqual(url, 'http://example.com/prefetched.mp4')
+        MockYoutubeDL.return_value.extract_info.assert_not_called()
+        self.assertEqual(vidterm.stream_url_cache.stats()['latency_saved'], 1.5)
+
+    @patch('yt_dlp.YoutubeDL')
+    @async_test
+    async def test_get_stream_url_async_caches_until_expiry(self, MockYoutubeDL):
+        expire = int(time.time()) + 6 * 60 * 60
+        MockYoutubeDL.return_value.extract_info = MagicMock(return_value={'url': f'https://rr1.googlevideo.com/videoplayback?expire={expire}&id=1'})
+
+        with patch('vidterm.application_instance', MagicMock()):
+            vidterm.show_status_message = MagicMock()
+            first = await vidterm.get_stream_url_async('video123')
+            second = await vidterm.get_stream_url_async('video123')
+            with patch('time.time', return_value=expire - 60): # Inside the expiry margin
+                self.assertIsNone(vidterm.stream_url_cache.get('video123'))
+
+        self.assertEqual(first, second)
+        MockYoutubeDL.return_value.extract_info.assert_called_once()
+        self.assertEqual(vidterm.stream_url_cache.entries['video123'].expires_at, expire)
+        self.assertEqual(vidterm.stream_url_cache.hits, 1)
+
+
+class TestStreamUrlCache(unittest.TestCase):
+
+    def test_stream_url_expiry(self):
+        self.assertEqual(vidterm.stream_url_expiry('https://x.googlevideo.com/videoplayback?expire=1700000000&ei=abc'), 1700000000)
+        self.assertEqual(vidterm.stream_url_expiry('https://manifest.googlevideo.com/api/manifest/hls/expire/1700000000/ei/abc'), 1700000000)
+        self.assertEqual(vidterm.stream_url_expiry('http://example.com/a.mp4', {'expire': 1700000000}), 1700000000)
+        self.assertIsNone(vidterm.stream_url_expiry('http://example.com/a.mp4'))
+
+    @async_test
+    async def test_recently_used_entries_are_refreshed_before_expiry(self):
+        resolver = AsyncMock(return_value=('http://stream/new', time.time() + 7200))
+        cache = vidterm.StreamUrlCache(resolver)
+        with patch('vidterm.STREAM_URL_REFRESH_BEFORE', 3600):
+            cache.put('a', 'http://stream/old', 1.0, time.time() + 3600.01) # Refresh is due right away
+            await asyncio.sleep(0.05)
+        resolver.assert_awaited_with('a')
+        self.assertEqual(cache.peek('a'), 'http://stream/new')
+        self.assertEqual(cache.stats()['refreshes'], 1)
+        cache.close()
+
+    @async_test
+    async def test_entry_for_another_playback_target_is_a_miss(self):
+        small, large = {'vo': 'tct', 'width': 80, 'height': 48}, {'vo': 'gpu', 'width': 1280, 'height': 720}
+        resolver = AsyncMock(return_value=('http://stream/large', time.time() + 7200))
+        cache = vidterm.StreamUrlCache(resolver)
+        cache.put('a', 'http://stream/small', 1.0, time.time() + 7200, small)
+        vidterm.requested_playback_target.set(small)
+        self.assertEqual(cache.peek('a'), 'http://stream/small')
+        vidterm.requested_playback_target.set({'vo': 'tct', 'width': 82, 'height': 50}) # Resized a little
+        self.assertEqual(cache.peek('a'), 'http://stream/small')
+        vidterm.requested_playback_target.set(large)
+        self.assertIsNone(cache.peek('a'))
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['misses'], 1)
+        self.assertEqual(await cache.resolve('a'), 'http://stream/large')
+        resolver.assert_awaited_once_with('a')
+        self.assertEqual(cache.entries['a'].target, large)
+        cache.close()
+
+
+class TestFormatSelection(unittest.TestCase):
+
+    FORMATS = [
+        {'format_id': '18', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'width': 640, 'height': 360, 'tbr': 700},
+        {'format_id': '22', 'vcodec': 'avc1.64001F', 'acodec': 'mp4a.40.2', 'width': 1280, 'height': 720, 'tbr': 1500},
+        {'format_id': '160', 'vcodec': 'avc1.4d400c', 'acodec': 'none', 'width': 256, 'height': 144, 'tbr': 80},
+        {'format_id': '133', 'vcodec': 'avc1.4d4015', 'acodec': 'none', 'width': 426, 'height': 240, 'tbr': 150},
+        {'format_id': '134', 'vcodec': 'avc1.4d401e', 'acodec': 'none', 'width': 640, 'height': 360, 'tbr': 300},
+        {'format_id': '243', 'vcodec': 'vp9', 'acodec': 'none', 'width': 640, 'height': 360, 'tbr': 250},
+        {'format_id': '396', 'vcodec': 'av01.0.01M.08', 'acodec': 'none', 'width': 640, 'height': 360, 'tbr': 200},
+        {'format_id': '137', 'vcodec': 'avc1.640028', 'acodec': 'none', 'width': 1920, 'height': 1080, 'tbr': 4000},
+        {'format_id': '248', 'vcodec': 'vp9', 'acodec': 'none', 'width': 1920, 'height': 1080, 'tbr': 2500},
+        {'format_id': '249', 'vcodec': 'none', 'acodec': 'opus', 'abr': 50},
+        {'format_id': '251', 'vcodec': 'none', 'acodec': 'opus', 'abr': 130},
+        {'format_id': '96', 'vcodec': 'avc1', 'acodec': 'mp4a', 'width': 1920, 'height': 1080, 'tbr': 100,
+         'protocol': 'm3u8_native'},
+    ]
+    for f in FORMATS:
+        f['url'] = f"https://host/videoplayback?itag={f['format_id']}&expire={1700000000 + len(f['format_id'])}"
+        f.setdefault('protocol', 'https')
+
+    def select(self, width, height, bandwidth=None):
+        chosen = vidterm.select_stream_formats(self.FORMATS, {'width': width, 'height': height}, bandwidth)
+        return [f['format_id'] for f in chosen]
+
+    def test_smallest_stream_that_fills_the_target(self):
+        self.assertEqual(self.select(80, 48), ['160', '251']) # tct in an 80x24 terminal
+        self.assertEqual(self.select(640, 400), ['134', '251']) # Separate streams beat format 18
+        self.assertEqual(self.select(1920, 1080), ['248', '251']) # VP9 costs less here despite decoding
+        self.assertEqual(self.select(3840, 2160), ['248', '251']) # Nothing larger exists
+
+    def test_measured_bandwidth_caps_the_bitrate(self):
+        self.assertEqual(self.select(1920, 1080, bandwidth=200_000), ['134', '251'])
+        self.assertEqual(self.select(1920, 1080, bandwidth=1), ['160', '251'])
+
+    def test_targets_on_the_same_rung_select_the_same_streams(self):
+        for width, height in ((80, 48), (82, 50), (200, 100), (640, 400), (400, 230), (1920, 1080), (1900, 1000)):
+            rung = vidterm.playback_target_rung({'width': width, 'height': height})
+            chosen_height = next(f['height'] for f in self.FORMATS if f['format_id'] == self.select(width, height)[0])
+            self.assertEqual(rung, chosen_height, (width, height))
+        self.assertNotEqual(vidterm.playback_target_rung({'width': 80, 'height': 48}),
+                            vidterm.playback_target_rung({'width': 1920, 'height': 1080}))
+        self.assertIsNone(vidterm.playback_target_rung(None))
+
+    def test_manifest_only_formats_are_not_selected(self):
+        self.assertEqual(vidterm.select_stream_formats(self.FORMATS[-1:], {'width': 80, 'height': 48}), [])
+
+    def test_edl_urls_round_trip(self):
+        urls = ['https://host/video?a=1;b=%20', 'https://host/audio?x=2']
+        joined = vidterm.join_stream_urls(urls)
+        self.assertTrue(joined.startswith('edl://'))
+        self.assertEqual(vidterm.split_stream_url(joined), urls)
+        self.assertEqual(vidterm.join_stream_urls(urls[:1]), urls[0])
+        self.assertEqual(vidterm.split_stream_url(urls[0]), urls[:1])
+
+    @patch('vidterm.extract_info_pooled')
+    def test_stream_url_payload_uses_the_target(self, extract_info):
+        extract_info.return_value = {'url': 'https://host/best', 'formats': self.FORMATS}
+        url, expires_at = vidterm.stream_url_payload('vid', {'vo': 'tct', 'width': 80, 'height': 48})
+        self.assertEqual([u.split('itag=')[1][:3] for u in vidterm.split_stream_url(url)], ['160', '251'])
+        self.assertEqual(expires_at, 1700000003)
+        self.assertEqual(vidterm.stream_url_payload('vid'), ('https://host/best', None)) # Headless: yt-dlp's pick
+
+    def test_playback_vo(self):
+        mpv = MagicMock(vos=['gpu', 'kitty', 'sixel', 'tct'])
+        with patch('vidterm.MPV_PERSISTENT', False), patch('vidterm.MPV_VO', 'auto'), \
+             patch('vidterm.THUMBNAIL_PROTOCOL', 'auto'):
+            self.assertIsNone(vidterm.playback_vo(mpv, {'DISPLAY': ':0', 'TERM': 'xterm-kitty'}))
+            self.assertEqual(vidterm.playback_vo(mpv, {'SSH_CONNECTION': 'x', 'DISPLAY': ':10', 'TERM': 'xterm-kitty'}), 'kitty')
+            self.assertEqual(vidterm.playback_vo(mpv, {'TERM': 'foot'}), 'sixel')
+            self.assertEqual(vidterm.playback_vo(mpv, {'TERM': 'xterm-256color'}), 'tct')
+            self.assertIsNone(vidterm.playback_vo(MagicMock(vos=[]), {'TERM': 'linux'}))
+            with patch('shutil.get_terminal_size', return_value=os.terminal_size((80, 24))):
+                self.assertEqual(vidterm.terminal_playback_target(mpv, {'TERM': 'linux'}),
+                                 {'vo': 'tct', 'width': 80, 'height': 48})
+
+    @async_test
+    async def test_renewed_urls_keep_their_target(self):
+        targets = []
+
+        async def resolver(video_id):
+            targets.append(vidterm.requested_playback_target.get())
+            return f'http://stream/{len(targets)}', None
+        cache = vidterm.StreamUrlCache(resolver)
+        vidterm.requested_playback_target.set({'vo': 'tct', 'width': 80, 'height': 48})
+        await cache.resolve('a')
+        vidterm.requested_playback_target.set(None) # e.g. the proxy re-resolving an expired URL
+        self.assertEqual(await cache.renew('a'), 'http://stream/2')
+        self.assertEqual(targets, [{'vo': 'tct', 'width': 80, 'height': 48}] * 2)
+        cache.close()
+
+
+class TestStreamPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.resolve = AsyncMock(side_effect=lambda vid: (f'http://stream/{vid}', None))
+        patcher = patch('vidterm.stream_url_cache', vidterm.StreamUrlCache(self.resolve))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @async_test
+    async def test_prefetches_top_results_and_highlight_after_dwell(self):
+        prefetcher = vidterm.StreamPrefetcher(dwell=0.01, top_n=2)
+        prefetcher.update('e', ['a', 'b', 'c', 'd', 'e'])
+        await asyncio.sleep(0.05)
+        self.assertEqual(set(vidterm.stream_url_cache.entries), {'a', 'b', 'e'})
+        vidterm.stream_url_cache.close()
+
+    @async_test
+    async def test_irrelevant_prefetches_are_cancelled(self):
+        scheduler = vidterm.JobScheduler(background_workers=1)
+        self.addCleanup(scheduler.close)
+        release = vidterm.threading.Event()
+        scheduler.submit(release.wait, 5, lane=vidterm.BACKGROUND) # Keeps prefetch jobs queued
+        resolved = []
+
+        def payload(video_id, target=None, bandwidth=None):
+            resolved.append(video_id)
+            return f'http://stream/{video_id}', None
+
+        cache = vidterm.StreamUrlCache(vidterm.resolve_stream_url_async)
+        with patch('vidterm.job_scheduler', scheduler), patch('vidterm.stream_url_payload', payload), \
+             patch('vidterm.stream_url_cache', cache), patch.dict(vidterm.inflight_extractions, clear=True):
+            prefetcher = vidterm.StreamPrefetcher(dwell=0, top_n=0)
+            prefetcher.update('a', ['a', 'b']) # Selection only passes over 'a'
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.stats()[vidterm.BACKGROUND]['queued'], 1)
+            prefetcher.update('b', ['a', 'b'])
+            await asyncio.sleep(0.01)
+            release.set()
+            await asyncio.sleep(0.1)
+            self.assertEqual(resolved, ['b']) # The job for 'a' never ran
+            self.assertEqual(cache.peek('b'), 'http://stream/b')
+            self.assertIsNone(cache.peek('a'))
+        cache.close()
+
+    @async_test
+    async def test_prefetch_is_cancelled_during_dwell(self):
+        prefetcher = vidterm.StreamPrefetcher(dwell=0.05, top_n=0)
+        prefetcher.update('a', ['a', 'b']) # Selection only passes over 'a'
+        await asyncio.sleep(0)
+        prefetcher.update('b', ['a', 'b'])
+        await asyncio.sleep(0.1)
+        self.resolve.assert_awaited_once_with('b')
+        self.assertEqual(vidterm.stream_url_cache.peek('b'), 'http://stream/b')
+        self.assertIsNone(vidterm.stream_url_cache.peek('a'))
+        vidterm.stream_url_cache.close()
+
+
+class TestMpvProbe(unittest.TestCase):
+
+    def test_parse_output(self):
+        self.assertEqual(vidterm.MpvProbe.parse_version("mpv 0.35.1 Copyright © 2000-2023 mpv/MPlayer/mplayer2 projects\n"), '0.35.1')
+        self.assertEqual(vidterm.MpvProbe.parse_version("mpv v0.38.0-dirty Copyright\n"), '0.38.0-dirty')
+        vo_help = "Available video outputs:\n  gpu              Shader-based GPU Renderer\n  tct              true-color terminals\n  sixel            terminal graphics using sixels\n"
+        self.assertEqual(vidterm.MpvProbe.parse_help_list(vo_help), ['gpu', 'tct', 'sixel'])
+
+    @async_test
+    async def test_probe_runs_once_and_reprobes_after_invalidate(self):
+        outputs = {'--version': b"mpv 0.35.1 Copyright\n", '--vo=help': b"Available video outputs:\n  tct   terminal\n",
+                   '--hwdec=help': b"Valid values:\n  no\n  vaapi (vaapi)\n"}
+
+        async def fake_exec(path, arg, **kwargs):
+            process = MagicMock()
+            process.communicate = AsyncMock(return_value=(outputs[arg], b''))
+            return process
+
+        probe = vidterm.MpvProbe()
+        with patch('shutil.which', return_value='/usr/bin/mpv') as mock_which, \
+             patch('asyncio.create_subprocess_exec', side_effect=fake_exec) as mock_exec:
+            probe.start()
+            result = await probe.result()
+            await probe.result()
+            self.assertEqual(mock_exec.call_count, 3)
+            probe.invalidate()
+            await probe.result()
+
+        self.assertIs(result, probe)
+        self.assertEqual((probe.path, probe.version, probe.vos, probe.hwdecs), ('/usr/bin/mpv', '0.35.1', ['tct'], ['no', 'vaapi']))
+        self.assertEqual(mock_which.call_count, 2)
+
+    @async_test
+    async def test_playback_uses_cached_probe(self):
+        probe = vidterm.MpvProbe()
+        with patch('shutil.which', return_value=None):
+            await probe.result()
+        with patch('vidterm.mpv_probe', probe), \
+             patch('vidterm.application_instance', None), \
+             patch('asyncio.create_subprocess_exec') as mock_exec, \
+             patch('vidterm.get_stream_url_async', new=AsyncMock()) as mock_get_url:
+            vidterm.show_status_message = MagicMock()
+            await vidterm.play_video_in_terminal_async('video123')
+        mock_exec.assert_not_called() # No 'which mpv' per playback
+        mock_get_url.assert_not_awaited()
+        vidterm.show_status_message.assert_any_call("mpv not found. Please install mpv.", 5, vidterm.STATUS_PRIORITY_ERROR)
+
+
+class TestMpvController(unittest.TestCase):
+
+    async def start_fake_mpv(self, controller):
+        """ Serves mpv's JSON IPC protocol on the controller's socket path. """
+        received = []
+
+        async def handle(reader, writer):
+            while line := await reader.readline():
+                request = json.loads(line)
+                received.append(request['command'])
+                name = request['command'][0]
+                if name == 'get_property':
+                    reply = {'request_id': request['request_id'], 'error': 'success', 'data': 12.5}
+                elif name == 'loadfile' and request['command'][1] == 'bad://url':
+                    reply = {'request_id': request['request_id'], 'error': 'invalid parameter'}
+                else:
+                    reply = {'request_id': request['request_id'], 'error': 'success', 'data': None}
+                writer.write(json.dumps(reply).encode() + b'\n')
+                if name == 'observe_property':
+                    event = {'event': 'property-change', 'id': request['command'][1], 'name': request['command'][2], 'data': True}
+                    writer.write(json.dumps(event).encode() + b'\n')
+                if name == 'loadfile' and reply['error'] == 'success':
+                    writer.write(json.dumps({'event': 'end-file', 'reason': 'eof'}).encode() + b'\n')
+                await writer.drain()
+
+        server = await asyncio.start_unix_server(handle, path=controller.socket_path)
+        return server, received
+
+    @async_test
+    async def test_commands_properties_and_events(self):
+        controller = vidterm.MpvController()
+        controller.socket_path = os.path.join(tempfile.mkdtemp(), 'mpv.sock')
+        server, received = await self.start_fake_mpv(controller)
+        observed, events = [], []
+        await controller.observe_property('pause', lambda name, value: observed.append((name, value)))
+        controller.on_event('end-file', events.append)
+
+        await controller.connect()
+        self.assertEqual(await controller.command('get_property', 'time-pos'), 12.5)
+        await controller.loadfile('http://example.com/stream.mp4', title='VidTerm: abc')
+        with self.assertRaises(vidterm.MpvError):
+            await controller.command('loadfile', 'bad://url', 'replace')
+        await asyncio.sleep(0.01)
+
+        self.assertIn(['observe_property', 1, 'pause'], received) # Observers are registered on connect
+        self.assertIn(['loadfile', 'http://example.com/stream.mp4', 'replace'], received)
+        self.assertEqual(observed, [('pause', True)])
+        self.assertEqual(events, [{'event': 'end-file', 'reason': 'eof'}])
+        await controller.close()
+        self.assertFalse(controller.connected)
+        server.close()
+        await server.wait_closed()
+
+    @async_test
+    async def test_ipc_socket_is_created_in_a_private_directory(self):
+        controller = vidterm.MpvController()
+        with patch('asyncio.create_subprocess_exec', AsyncMock(return_value=MagicMock(returncode=None))), \
+             patch.object(controller, 'connect', AsyncMock()):
+            await controller.start()
+        directory = os.path.dirname(controller.socket_path)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        controller.process = None
+        await controller.close()
+        self.assertFalse(os.path.exists(directory))
+        self.assertIsNone(controller.socket_path)
+
+    @async_test
+    async def test_command_requires_connection(self):
+        with self.assertRaises(vidterm.MpvError):
+            await vidterm.MpvController().command('get_property', 'pause')
+
+
+class TestLiveSearch(unittest.TestCase):
+
+    @async_test
+    async def test_debouncer_fires_once_with_last_value(self):
+        callback = MagicMock()
+        debouncer = vidterm.Debouncer(0.01, callback)
+        for text in ['c', 'ca', 'cat']:
+            debouncer(text)
+        await asyncio.sleep(0.05)
+        callback.assert_called_once_with('cat')
+
+    def test_short_queries_are_not_searched_live(self):
+        with patch('vidterm.start_search') as mock_start:
+            vidterm.run_live_search('ab')
+            vidterm.run_live_search('abc')
+        mock_start.assert_called_once_with('abc')
+
+
+class TestResultsControl(unittest.TestCase):
+
+    def setUp(self):
+        self.results = [vidterm.VideoResult(str(i), f'Video {i}', 'U', 60) for i in range(10000)]
+        self.selected = 0
+        self.control = vidterm.ResultsControl(lambda: self.results, lambda: self.selected, placeholder="Nothing yet")
+
+    def test_only_requested_rows_are_formatted(self):
+        content = self.control.create_content(80, 10)
+        self.assertEqual(content.line_count, 10000)
+        self.assertEqual(self.control._line_cache, {}) # Nothing formatted up front
+        self.assertEqual(content.get_line(0), [('class:results.selected', "[SELECTED] 1. Video 0 (1:00) - U")])
+        self.assertEqual(content.get_line(1), [('', "           2. Video 1 (1:00) - U")])
+        self.assertEqual(len(self.control._line_cache), 2)
+
+    def test_selection_moves_reuse_cached_rows(self):
+        self.control.create_content(80, 10).get_line(1)
+        cached_line = self.control._line_cache[(1, '1')]
+        self.selected = 1
+        content = self.control.create_content(80, 10)
+        self.assertEqual(content.get_line(1), [('class:results.selected', "[SELECTED] " + cached_line)])
+        self.assertEqual(content.cursor_position.y, 1) # Keeps the selection scrolled into view
+        self.assertEqual(len(self.control._line_cache), 1)
+
+    def test_new_results_list_drops_the_cache(self):
+        self.control.create_content(80, 10).get_line(0)
+        self.results = []
+        content = self.control.create_content(80, 10)
+        self.assertEqual(content.get_line(0), [('', "Nothing yet")])
+        self.assertEqual(self.control._line_cache, {})
+
+
+class TestFuzzyFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.results = [vidterm.VideoResult('1', 'Lo-fi Hip Hop Radio', 'Lofi Girl'),
+                        vidterm.VideoResult('2', 'Python Tutorial', 'Corey Schafer'),
+                        vidterm.VideoResult('3', 'Hip hop beats', 'Beat Maker')]
+        self.filter = vidterm.FuzzyFilter()
+
+    def test_terms_match_in_order_across_title_and_uploader(self):
+        self.filter.set_pattern('hhrad')
+        self.assertEqual([r.id for r in self.filter.apply(self.results)], ['1'])
+        self.filter.set_pattern('hip GIRL')
+        self.assertEqual([r.id for r in self.filter.apply(self.results)], ['1'])
+        self.filter.set_pattern('')
+        self.assertIs(self.filter.apply(self.results), self.results)
+
+    def test_extending_the_pattern_only_rechecks_previous_matches(self):
+        self.filter.set_pattern('hip')
+        self.assertEqual([r.id for r in self.filter.apply(self.results)], ['1', '3'])
+        with patch.object(vidterm.FuzzyFilter, 'matches', wraps=vidterm.FuzzyFilter.matches) as matches:
+            self.filter.set_pattern('hip b')
+            self.assertEqual([r.id for r in self.filter.apply(self.results)], ['3'])
+        self.assertEqual(matches.call_count, 2)
+
+    def test_appended_rows_are_filtered(self):
+        self.filter.set_pattern('hip')
+        self.filter.apply(self.results)
+        self.results.append(vidterm.VideoResult('4', 'More hip hop', 'U'))
+        self.assertEqual([r.id for r in self.filter.apply(self.results)], ['1', '3', '4'])
+
+
+class TestSearchPagination(unittest.TestCase):
+
+    def setUp(self):
+        controller = vidterm.SearchController()
+        controller.begin('query')
+        for name, value in [('current_search_results', []), ('current_search_result_ids', set()),
+                            ('current_search_page', 0), ('search_results_exhausted', False),
+                            ('search_controller', controller), ('selected_video_index', 0),
+                            ('update_results_display', MagicMock())]:
+            patcher = patch(f'vidterm.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @async_test
+    async def test_next_page_is_appended_and_deduplicated(self):
+        vidterm.append_search_result(vidterm.VideoResult('a'))
+
+        async def fake_search(query, on_result, cancel_event, page=0):
+            page_results = [vidterm.VideoResult('a'), vidterm.VideoResult('b')]
+            for result in page_results:
+                on_result(result)
+            return page_results
+
+        with patch('vidterm.search_videos_streaming_async', side_effect=fake_search) as mock_search:
+            await vidterm.load_next_search_page_async(vidterm.search_controller.generation)
+
+        self.assertEqual(mock_search.call_args.kwargs['page'], 1)
+        self.assertEqual([r.id for r in vidterm.current_search_results], ['a', 'b'])
+        self.assertEqual(vidterm.current_search_page, 1)
+        self.assertTrue(vidterm.search_results_exhausted) # Short page
+
+    @async_test
+    async def test_next_page_only_loads_near_the_end(self):
+        for i in range(10):
+            vidterm.append_search_result(vidterm.VideoResult(str(i)))
+        with patch('vidterm.load_next_search_page_async', new=AsyncMock()) as mock_load:
+            vidterm.maybe_load_next_search_page()
+            self.assertFalse(vidterm.search_controller.busy())
+            vidterm.selected_video_index = 7
+            vidterm.maybe_load_next_search_page()
+            self.assertTrue(vidterm.search_controller.busy())
+            await asyncio.sleep(0)
+        mock_load.assert_awaited_once()
+
+
+class TestSearchController(unittest.TestCase):
+
+    @async_test
+    async def test_new_query_cancels_superseded_search(self):
+        controller = vidterm.SearchController()
+        first_generation = controller.begin('first')
+        first_cancel_event = controller.cancel_event
+        first_task = controller.spawn(asyncio.sleep(10))
+
+        second_generation = controller.begin('second')
+        await asyncio.sleep(0)
+
+        self.assertTrue(first_task.cancelled())
+        self.assertTrue(first_cancel_event.is_set()) # Stops the executor thread of the first search
+        self.assertFalse(controller.is_current(first_generation))
+        self.assertTrue(controller.is_current(second_generation))
+        self.assertEqual(controller.query, 'second')
+
+    @async_test
+    async def test_stale_results_are_never_rendered(self):
+        controller = vidterm.SearchController()
+        release_first = asyncio.Event()
+
+        async def slow_search(query):
+            if query == 'slow':
+                await release_first.wait()
+            return [vidterm.VideoResult(query)]
+
+        with patch('vidterm.search_controller', controller), \
+             patch('vidterm.STREAMING_SEARCH', False), \
+             patch('vidterm.search_videos_async', side_effect=slow_search), \
+             patch('vidterm.update_results_display', MagicMock()), \
+             patch('vidterm.on_highlight_changed', MagicMock()), \
+             patch('vidterm.current_search_results', []):
+            generation = controller.begin('slow')
+            slow = controller.spawn(vidterm.search_accept_handler_async('slow', generation))
+            await asyncio.sleep(0)
+            await vidterm.search_accept_handler_async('fast', controller.begin('fast'))
+            release_first.set()
+            await asyncio.sleep(0)
+            self.assertTrue(slow.cancelled())
+            self.assertEqual([r.id for r in vidterm.current_search_results], ['fast'])
+
+
+class TestJobScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = vidterm.JobScheduler(foreground_workers=1, background_workers=1)
+        self.addCleanup(self.scheduler.close)
+
+    @async_test
+    async def test_background_waits_for_foreground(self):
+        order = []
+        release = vidterm.threading.Event()
+
+        def work(name, wait=False):
+            if wait:
+                release.wait(5)
+            order.append(name)
+            return name
+
+        search = self.scheduler.submit(work, 'search', True, lane=vidterm.FOREGROUND)
+        prefetch = self.scheduler.submit(work, 'prefetch', lane=vidterm.BACKGROUND)
+        playback = self.scheduler.submit(work, 'playback', lane=vidterm.FOREGROUND)
+        self.assertFalse(prefetch.started)
+        release.set()
+        await asyncio.gather(search.future, prefetch.future, playback.future)
+        self.assertEqual(order, ['search', 'playback', 'prefetch'])
+
+    @async_test
+    async def test_cancelled_queued_job_never_runs(self):
+        release = vidterm.threading.Event()
+        ran = []
+        blocker = self.scheduler.submit(release.wait, 5, lane=vidterm.BACKGROUND)
+        queued = self.scheduler.submit(ran.append, 'x', lane=vidterm.BACKGROUND)
+        queued.future.cancel()
+        await asyncio.sleep(0)
+        self.assertTrue(queued.token.cancelled)
+        release.set()
+        await blocker.future
+        await asyncio.sleep(0.05)
+        self.assertEqual(ran, [])
+        self.assertEqual(self.scheduler.stats()[vidterm.BACKGROUND], {'queued': 0, 'running': 0})
+
+    @async_test
+    async def test_foreground_caller_promotes_queued_background_extraction(self):
+        release = vidterm.threading.Event()
+        self.scheduler.submit(release.wait, 5, lane=vidterm.BACKGROUND)
+        calls = []
+
+        def extract(profile, url):
+            calls.append(url)
+            return {'url': 'http://stream'}
+
+        with patch('vidterm.job_scheduler', self.scheduler), \
+             patch.dict(vidterm.inflight_extractions, clear=True):
+            async def prefetch():
+                vidterm.job_lane.set(vidterm.BACKGROUND)
+                return await vidterm.coalesced_job('k', extract, 'stream', 'u')
+            background = asyncio.ensure_future(prefetch())
+            await asyncio.sleep(0)
+            job = vidterm.inflight_extractions['k']
+            self.assertEqual(job.lane, vidterm.BACKGROUND)
+            foreground = await vidterm.coalesced_job('k', extract, 'stream', 'u') # Does not wait for release
+            self.assertEqual(job.lane, vidterm.FOREGROUND)
+            self.assertEqual(foreground, await background)
+        self.assertEqual(calls, ['u'])
+        release.set()
+
+    @async_test
+    async def test_shared_job_is_cancelled_with_its_last_caller(self):
+        release = vidterm.threading.Event()
+        self.scheduler.submit(release.wait, 5, lane=vidterm.BACKGROUND)
+        calls = []
+        with patch('vidterm.job_scheduler', self.scheduler), \
+             patch.dict(vidterm.inflight_extractions, clear=True):
+            async def prefetch():
+                vidterm.job_lane.set(vidterm.BACKGROUND)
+                return await vidterm.coalesced_job('k', calls.append, 'u')
+            first, second = asyncio.ensure_future(prefetch()), asyncio.ensure_future(prefetch())
+            await asyncio.sleep(0)
+            job = vidterm.inflight_extractions['k']
+            first.cancel()
+            await asyncio.sleep(0.01)
+            self.assertFalse(job.future.done()) # Still wanted by the second caller
+            second.cancel()
+            await asyncio.sleep(0.01)
+        self.assertTrue(job.token.cancelled)
+        self.assertEqual(self.scheduler.stats()[vidterm.BACKGROUND], {'queued': 0, 'running': 1})
+        release.set()
+        await asyncio.sleep(0.05)
+        self.assertEqual(calls, [])
+
+    @async_test
+    async def test_running_job_stops_at_next_cancellation_check(self):
+        started, stopped = vidterm.threading.Event(), vidterm.threading.Event()
+
+        def extract():
+            started.set()
+            try:
+                while True:
+                    vidterm.yt_dlp_logger.debug('[youtube] step') # yt-dlp logs each step
+                    time.sleep(0.001)
+            except vidterm.JobCancelled:
+                stopped.set()
+
+        job = self.scheduler.submit(extract, lane=vidterm.BACKGROUND)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, started.wait, 5)
+        job.future.cancel()
+        self.assertTrue(await loop.run_in_executor(None, stopped.wait, 5))
+
+
+class TestProcessExtraction(unittest.TestCase):
+
+    @patch('yt_dlp.YoutubeDL')
+    def test_search_payload_is_trimmed_to_the_page(self, MockYoutubeDL):
+        entries = [{'id': str(i), 'title': f'T{i}', 'uploader': 'U', 'duration': i, 'formats': ['big'] * 50}
+                   for i in range(20)]
+        MockYoutubeDL.return_value.extract_info.return_value = {'entries': entries}
+        with patch('vidterm.ydl_pool', vidterm.YoutubeDLPool()), patch('vidterm.search_sessions', vidterm.SearchSessionPool()):
+            payload = vidterm.search_page_payload('q', 1)
+        self.assertEqual([data['id'] for data in payload], [str(i) for i in range(10, 20)])
+        self.assertEqual(payload[0], {'id': '10', 'title': 'T10', 'uploader': 'U', 'duration': 10})
+
+    def test_worker_process_runs_extraction_functions(self):
+        backend = vidterm.ProcessExtractionBackend(1)
+        self.addCleanup(backend.close)
+        with patch('vidterm.extraction_backend', backend):
+            self.assertEqual(vidterm.run_extraction(vidterm.format_duration, 61), '1:01')
+            self.assertNotEqual(vidterm.run_extraction(vidterm._extraction_worker_ready), os.getpid())
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'vidtermd.sock')
+        for name in ('start_yt_dlp_warmup', 'mpv_probe'):
+            patcher = patch(f'vidterm.{name}', MagicMock())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def start(self):
+        daemon = vidterm.VidtermDaemon(self.path, idle_timeout=0)
+        served = asyncio.ensure_future(daemon.serve())
+        while not os.path.exists(self.path):
+            await asyncio.sleep(0.01)
+        client = await vidterm.connect_daemon(self.path, spawn=False, timeout=2)
+        self.assertIsNotNone(client)
+        self.addCleanup(lambda: setattr(vidterm, 'daemon_client', None))
+        return daemon, served, client
+
+    @async_test
+    async def test_streamed_search_and_status_messages(self):
+        async def fake_search(query, on_result, cancel_event, page=0):
+            vidterm.show_status_message(f"Searching for: {query}...")
+            results = [vidterm.VideoResult('a', 'A', 'U', 60), vidterm.VideoResult('b')]
+            for result in results:
+                on_result(result)
+            return results
+
+        received = []
+        with patch('vidterm.search_videos_streaming_async', fake_search), \
+             patch('vidterm.show_status_message', show_status_message), \
+             patch('vidterm.status_manager') as status_manager:
+            daemon, served, client = await self.start()
+            results = await client.search('q', 0, received.append, vidterm.threading.Event())
+            status_manager.show.assert_called_with("Searching for: q...", None, vidterm.STATUS_PRIORITY_INFO)
+            self.assertEqual(results, [vidterm.VideoResult('a', 'A', 'U', 60), vidterm.VideoResult('b')])
+            self.assertEqual(received, results)
+            self.assertTrue(await client.request('shutdown'))
+            self.assertTrue(await served)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_lock_and_socket_are_private_and_lock_does_not_follow_symlinks(self):
+        target = self.path + '.target'
+        with open(target, 'w') as f:
+            f.write('keep')
+        os.symlink(target, self.path + '.lock')
+        self.assertFalse(vidterm.VidtermDaemon(self.path)._lock())
+        with open(target) as f:
+            self.assertEqual(f.read(), 'keep')
+        os.unlink(self.path + '.lock')
+
+        async def check_socket():
+            daemon, served, client = await self.start()
+            self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+            self.assertEqual(os.stat(self.path + '.lock').st_mode & 0o777, 0o600)
+            daemon.stop()
+            await served
+            await client.close()
+        asyncio.run(check_socket())
+
+    def test_socket_directory_must_be_private(self):
+        shared = os.path.join(os.path.dirname(self.path), 'shared')
+        os.mkdir(shared)
+        os.chmod(shared, 0o755)
+        path = os.path.join(shared, 'vidtermd.sock')
+        with self.assertRaises(PermissionError):
+            asyncio.run(vidterm.VidtermDaemon(path).serve())
+        with patch('vidterm.spawn_daemon') as spawn:
+            self.assertIsNone(asyncio.run(vidterm.connect_daemon(path, timeout=0.1)))
+        spawn.assert_not_called()
+
+    @async_test
+    async def test_daemon_running_other_code_is_shut_down(self):
+        exited = vidterm.subprocess.Popen(['true'])
+        exited.wait()
+
+        async def old_ping(daemon, send):
+            return {'pid': exited.pid, 'clients': len(daemon.clients)} # From before versions were sent
+        with patch.object(vidterm.VidtermDaemon, 'op_ping', old_ping):
+            daemon = vidterm.VidtermDaemon(self.path, idle_timeout=0)
+            served = asyncio.ensure_future(daemon.serve())
+            while not os.path.exists(self.path):
+                await asyncio.sleep(0.01)
+            self.assertIsNone(await vidterm.connect_daemon(self.path, spawn=False, timeout=2))
+            self.assertTrue(await asyncio.wait_for(served, 2))
+
+    def test_spawned_daemon_gets_extract_processes(self):
+        with patch('vidterm.subprocess.Popen') as popen:
+            vidterm.spawn_daemon(3)
+        command = popen.call_args[0][0]
+        self.assertEqual(command[2:], ['--extract-processes', '3', 'daemon'])
+        self.assertEqual(vidterm.parse_args(command[2:]).extract_processes, 3)
+
+    @async_test
+    async def test_cancelled_request_is_cancelled_in_daemon(self):
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def slow_resolve(video_id):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        with patch('vidterm.stream_url_cache', vidterm.StreamUrlCache(slow_resolve)):
+            daemon, served, client = await self.start()
+            request = asyncio.ensure_future(client.resolve('abc'))
+            await started.wait()
+            request.cancel()
+            await asyncio.wait_for(cancelled.wait(), 2)
+            with self.assertRaises(vidterm.DaemonError):
+                await client.request('no-such-op')
+            daemon.stop()
+            await served
+            await asyncio.sleep(0.05)
+            self.assertFalse(client.connected)
+
+    @async_test
+    async def test_no_daemon_falls_back_in_process(self):
+        client = await vidterm.connect_daemon(self.path, spawn=False, timeout=0.1)
+        self.assertIsNone(client)
+        vidterm.start_yt_dlp_warmup.assert_called_once()
+
+
+class TestSearchCommand(unittest.TestCase):
+
+    @async_test
+    async def test_streams_json_lines_across_pages_up_to_limit(self):
+        pages = []
+
+        async def fake_search(query, on_result, cancel_event, page=0):
+            pages.append(page)
+            results = [vidterm.VideoResult(f'{page}-{i}', 'T', 'U', 5) for i in range(vidterm.SEARCH_PAGE_SIZE)]
+            for result in results:
+                if cancel_event.is_set():
+                    return None
+                on_result(result)
+            return results
+
+        with patch('vidterm.search_videos_streaming_async', fake_search), \
+             patch('vidterm.start_yt_dlp_warmup'), \
+             patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            status = await vidterm.search_command_async('q', 12, use_daemon=False)
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(status, 0)
+        self.assertEqual(pages, [0, 1])
+        self.assertEqual(len(lines), 12)
+        self.assertEqual(lines[10], {'id': '1-0', 'title': 'T', 'uploader': 'U', 'duration': 5,
+                                     'url': 'https://www.youtube.com/watch?v=1-0'})
+
+    @async_test
+    async def test_errors_go_to_stderr_and_exit_status(self):
+        async def failing_search(query, on_result, cancel_event, page=0):
+            vidterm.show_status_message("Searching for: q...")
+            vidterm.show_status_message("Search Error: boom", 5, vidterm.STATUS_PRIORITY_ERROR)
+            return []
+
+        with patch('vidterm.search_videos_streaming_async', failing_search), \
+             patch('vidterm.show_status_message', show_status_message), \
+             patch('vidterm.start_yt_dlp_warmup'), \
+             patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            status = await vidterm.search_command_async('q', 5, use_daemon=False)
+        self.assertEqual(status, 1)
+        self.assertEqual(stderr.getvalue(), "Search Error: boom\n")
+
+
+class TestResolveCommand(unittest.TestCase):
+
+    def test_parse_video_reference(self):
+        for text in ('dQw4w9WgXcQ', ' https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=1 ',
+                     'https://youtu.be/dQw4w9WgXcQ', 'https://youtube.com/shorts/dQw4w9WgXcQ'):
+            self.assertEqual(vidterm.parse_video_reference(text), 'dQw4w9WgXcQ')
+        self.assertEqual(vidterm.parse_video_reference('https://vimeo.com/123'), 'https://vimeo.com/123')
+        self.assertEqual(vidterm.watch_url('https://vimeo.com/123'), 'https://vimeo.com/123')
+
+    def test_counts_must_be_positive(self):
+        self.assertEqual(vidterm.parse_args(['resolve', '-j', '3']).parallel, 3)
+        self.assertEqual(vidterm.parse_args(['search', '-n', '5', 'q']).limit, 5)
+        for argv in (['resolve', '-j', '0'], ['resolve', '-j', '-2'], ['search', '-n', '0', 'q']):
+            with patch('sys.stderr', io.StringIO()), self.assertRaises(SystemExit):
+                vidterm.parse_args(argv)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(vidterm.percentile(values, 0.5), 50)
+        self.assertEqual(vidterm.percentile(values, 0.99), 99)
+        self.assertEqual(vidterm.percentile([7], 0.9), 7)
+        self.assertEqual(vidterm.percentile([1, 2, 3, 4, 5], 0.5), 3) # Rank 2.5 rounds up, not to even
+        self.assertEqual(vidterm.percentile([1, 2, 3, 4, 5], 0.9), 5)
+
+    def run_command(self, ordered):
+        delays = {'slow': 0.05, 'fast': 0.0, 'bad': 0.01}
+
+        async def fake_resolve(video_id):
+            await asyncio.sleep(delays[video_id])
+            if video_id == 'bad':
+                raise ValueError("unavailable")
+            return f'http://stream/{video_id}', 123
+
+        async def run():
+            with patch('vidterm.resolve_stream_url_async', fake_resolve), \
+                 patch('vidterm.start_yt_dlp_warmup'), \
+                 patch('vidterm.ensure_yt_dlp_async', AsyncMock()), \
+                 patch('vidterm.ydl_pool', vidterm.YoutubeDLPool()), \
+                 patch('vidterm.job_scheduler', vidterm.JobScheduler()), \
+                 patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                 patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                status = await vidterm.resolve_command_async(io.StringIO("slow\n\n# skipped\nfast\nbad\n"), 3, ordered)
+            return status, [json.loads(line) for line in stdout.getvalue().splitlines()], stderr.getvalue()
+        return asyncio.run(run())
+
+    def test_completion_order_and_summary(self):
+        status, records, summary = self.run_command(ordered=False)
+        self.assertEqual(status, 1)
+        self.assertEqual([r['id'] for r in records], ['fast', 'bad', 'slow'])
+        self.assertEqual(records[0]['url'], 'http://stream/fast')
+        self.assertEqual(records[1]['error'], 'unavailable')
+        self.assertIn("Resolved 2/3", summary)
+        self.assertIn("p50", summary)
+
+    def test_ordered_output(self):
+        status, records, _ = self.run_command(ordered=True)
+        self.assertEqual([r['input'] for r in records], ['slow', 'fast', 'bad'])
+
+
+class RangeServer:
+    """ Serves MEDIA bytes at /ok with range support; /expired answers 403. """
+
+    MEDIA = bytes(range(256)) * 40 # 10240 bytes
+
+    def __init__(self, keep_alive=False):
+        import http.server
+        import threading
+        media = self.MEDIA
+        self.requests = []
+        requests = self.requests
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' if keep_alive else 'HTTP/1.0'
+
+            def do_GET(self):
+                requests.append((self.path, self.headers['Range']))
+                if self.path != '/ok':
+                    self.send_error(403)
+                    return
+                start, end = self.headers['Range'].split('=')[1].split('-')
+                start, end = int(start), min(int(end), len(media) - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(media)}')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                self.wfile.write(media[start:end + 1])
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestMediaCache(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.server = RangeServer()
+        self.addCleanup(self.server.close)
+        patcher = patch('vidterm.MEDIA_FRAGMENT_SIZE', 1000)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cache(self, **kwargs):
+        cache = vidterm.MediaCache(self.directory, **kwargs)
+        self.addCleanup(cache.close)
+        return cache
+
+    @async_test
+    async def test_download_then_play_from_disk(self):
+        cache = self.cache()
+        url = self.server.url + '/ok'
+        self.assertEqual(cache.playback_source('vid', url), url) # Streams while downloading
+        await cache._downloads['vid']
+        path = cache.playback_source('vid', url)
+        self.assertEqual(path, cache.path('vid'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), RangeServer.MEDIA)
+        reloaded = vidterm.MediaCache(self.directory) # From the index file alone
+        self.assertEqual(reloaded.stats()['complete'], 1)
+        self.assertEqual(reloaded._entry('vid')['uses'], 2)
+
+    @async_test
+    async def test_resumes_partial_file_and_reresolves_expired_url(self):
+        resolver = AsyncMock(return_value=(self.server.url + '/ok', None))
+        cache = self.cache(resolver=resolver)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(cache.path('vid'), 'wb') as f:
+            f.write(RangeServer.MEDIA[:3000])
+        cache._load()['vid'] = {'size': 3000, 'total': len(RangeServer.MEDIA), 'complete': False, 'last_used': 0, 'uses': 1}
+        await cache.download('vid', self.server.url + '/expired')
+        resolver.assert_awaited_with('vid')
+        self.assertIn(('/ok', 'bytes=3000-3999'), self.server.requests)
+        self.assertNotIn(('/ok', 'bytes=0-999'), self.server.requests)
+        with open(cache.path('vid'), 'rb') as f:
+            self.assertEqual(f.read(), RangeServer.MEDIA)
+
+    @async_test
+    async def test_partial_download_in_progress_plays_appending(self):
+        cache = self.cache()
+        cache._load()['vid'] = {'size': 1000, 'total': 10240, 'complete': False, 'last_used': 0, 'uses': 0}
+        open(cache.path('vid'), 'wb').close()
+        cache._downloads['vid'] = MagicMock()
+        self.assertEqual(cache.playback_source('vid', 'http://remote'), f"appending://{cache.path('vid')}")
+
+    @async_test
+    async def test_partial_file_from_an_earlier_session_plays_appending_and_resumes(self):
+        cache = self.cache()
+        with open(cache.path('vid'), 'wb') as f:
+            f.write(RangeServer.MEDIA[:3000])
+        cache._load()['vid'] = {'size': 3000, 'total': len(RangeServer.MEDIA), 'complete': False, 'last_used': 0, 'uses': 1}
+        self.assertEqual(cache.playback_source('vid', self.server.url + '/ok'), f"appending://{cache.path('vid')}")
+        await cache._downloads['vid']
+        self.assertEqual(self.server.requests[0], ('/ok', 'bytes=3000-3999'))
+        self.assertTrue(cache._entry('vid')['complete'])
+
+    @async_test
+    async def test_partial_file_of_another_format_is_downloaded_again(self):
+        cache = self.cache()
+        with open(cache.path('vid'), 'wb') as f:
+            f.write(b'x' * 3000)
+        cache._load()['vid'] = {'size': 3000, 'total': 99999, 'complete': False, 'last_used': 0, 'uses': 1}
+        await cache.download('vid', self.server.url + '/ok')
+        with open(cache.path('vid'), 'rb') as f:
+            self.assertEqual(f.read(), RangeServer.MEDIA)
+        self.assertEqual(cache._entry('vid')['total'], len(RangeServer.MEDIA))
+        self.assertIn(('/ok', 'bytes=0-999'), self.server.requests)
+
+    def test_eviction_policies(self):
+        for eviction, survivor in (('lru', 'recent'), ('lfu', 'popular')):
+            cache = self.cache(max_bytes=150, eviction=eviction)
+            cache.entries = {}
+            for video_id, last_used, uses in (('recent', 30, 1), ('popular', 10, 9), ('old', 5, 1)):
+                with open(cache.path(video_id), 'wb') as f:
+                    f.write(b'x' * 100)
+                cache.entries[video_id] = {'size': 100, 'total': 100, 'complete': True, 'last_used': last_used, 'uses': uses}
+            cache.enforce_budget()
+            self.assertEqual(list(cache.entries), [survivor], eviction)
+            self.assertFalse(os.path.exists(cache.path('old')))
+
+
+class TestStreamProxy(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def server(self, **kwargs):
+        server = RangeServer(**kwargs)
+        self.addCleanup(server.close)
+        return server
+
+    async def start(self, resolver, **kwargs):
+        proxy = vidterm.StreamProxy(resolver, self.directory, block_size=1000, **kwargs)
+        await proxy.start()
+        proxy.register('vid', None)
+        return proxy
+
+    async def get(self, proxy, start, end, track=0):
+        loop = asyncio.get_running_loop()
+        data, total = await loop.run_in_executor(None, vidterm.fetch_byte_range, proxy.url_for('vid', track), start, end)
+        self.assertEqual(total, len(RangeServer.MEDIA))
+        return data
+
+    @async_test
+    async def test_fetches_only_missing_blocks(self):
+        server = self.server()
+        resolver = AsyncMock(return_value=server.url + '/ok')
+        proxy = await self.start(resolver, readahead=3)
+        try:
+            self.assertEqual(await self.get(proxy, 0, 2499), RangeServer.MEDIA[:2500])
+            self.assertEqual(await self.get(proxy, 500, 1500), RangeServer.MEDIA[500:1501]) # Seek back
+            self.assertEqual(await self.get(proxy, 5000, 5100), RangeServer.MEDIA[5000:5101])
+            self.assertEqual(server.requests, [('/ok', 'bytes=0-2999'), ('/ok', 'bytes=5000-7999')])
+            self.assertEqual(proxy.stats()['served_from_disk'], 1001)
+        finally:
+            await proxy.close()
+        replay = await self.start(resolver) # Blocks and size come from the index
+        try:
+            self.assertEqual(await self.get(replay, 9000, 10239), RangeServer.MEDIA[9000:])
+            self.assertEqual(await self.get(replay, 1000, 1999), RangeServer.MEDIA[1000:2000])
+            self.assertEqual(server.requests[2:], [('/ok', 'bytes=9000-10239')])
+        finally:
+            await replay.close()
+
+    @async_test
+    async def test_expired_upstream_url_is_resolved_again(self):
+        server = self.server()
+        resolver = AsyncMock(side_effect=lambda video_id, refresh: server.url + ('/ok' if refresh else '/expired'))
+        proxy = await self.start(resolver)
+        try:
+            self.assertEqual(await self.get(proxy, 0, 10239), RangeServer.MEDIA)
+        finally:
+            await proxy.close()
+        resolver.assert_awaited_with('vid', True)
+
+    @async_test
+    async def test_upstream_connections_are_reused(self):
+        server = self.server(keep_alive=True)
+        proxy = await self.start(AsyncMock(return_value=server.url + '/ok'), readahead=1)
+        try:
+            self.assertEqual(await self.get(proxy, 0, 2999), RangeServer.MEDIA[:3000])
+        finally:
+            await proxy.close()
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual((proxy.pool.opened, proxy.pool.reused), (1, 2))
+
+    @async_test
+    async def test_separate_video_and_audio_streams_are_proxied_as_tracks(self):
+        server = self.server()
+        resolver = AsyncMock(return_value=vidterm.join_stream_urls([server.url + '/video', server.url + '/ok']))
+        proxy = await self.start(resolver)
+        try:
+            self.assertEqual(await self.get(proxy, 0, 999, track=1), RangeServer.MEDIA[:1000])
+            with patch('vidterm.stream_proxy', proxy), patch('vidterm.connected_daemon', AsyncMock(return_value=None)):
+                url = await vidterm.proxied_stream_url('vid', resolver.return_value)
+        finally:
+            await proxy.close()
+        self.assertEqual(server.requests, [('/ok', 'bytes=0-7999')])
+        self.assertEqual(vidterm.split_stream_url(url), [proxy.url_for('vid'), proxy.url_for('vid', 1)])
+
+    @async_test
+    async def test_streams_resolve_for_the_target_they_were_registered_with(self):
+        server = self.server()
+        targets = []
+
+        async def resolver(video_id, refresh):
+            targets.append(vidterm.requested_playback_target.get())
+            return server.url + '/ok'
+
+        async def first_request():
+            # Starts the server from a request of another terminal, as in the daemon
+            vidterm.requested_playback_target.set({'vo': 'tct', 'width': 80, 'height': 48})
+            return await self.start(resolver)
+        proxy = await asyncio.ensure_future(first_request())
+        try:
+            proxy.register('vid', {'vo': 'gpu', 'width': 1920, 'height': 1080})
+            self.assertEqual(await self.get(proxy, 0, 999), RangeServer.MEDIA[:1000])
+        finally:
+            await proxy.close()
+        self.assertEqual(targets, [{'vo': 'gpu', 'width': 1920, 'height': 1080}])
+
+    @async_test
+    async def test_only_registered_videos_are_served_with_the_token(self):
+        server = self.server()
+        resolver = AsyncMock(return_value=server.url + '/ok')
+        proxy = await self.start(resolver)
+        loop = asyncio.get_running_loop()
+
+        async def status(url):
+            try:
+                await loop.run_in_executor(None, vidterm.fetch_byte_range, url, 0, 9)
+            except vidterm.urllib.error.HTTPError as e:
+                return e.code
+            return 206
+        try:
+            base = f"http://127.0.0.1:{proxy.port}"
+            self.assertEqual(await status(proxy.url_for('vid')), 206)
+            self.assertEqual(await status(f"{base}/vid"), 404)
+            self.assertEqual(await status(f"{base}/wrong-token/vid"), 404)
+            self.assertEqual(await status(proxy.url_for('https%3A%2F%2Fexample.com%2Fx')), 404)
+        finally:
+            await proxy.close()
+        resolver.assert_awaited_once_with('vid', False)
+
+    @async_test
+    async def test_errors_go_to_the_terminal_that_registered_the_video(self):
+        messages = []
+        proxy = await self.start(AsyncMock())
+        try:
+            proxy.register('vid', None, lambda text, duration, priority: messages.append(text))
+            proxy.store('vid').entry['total'] = 100
+            with patch.object(proxy, '_block', AsyncMock(return_value=None)), \
+                 patch.object(vidterm.SegmentStore, 'read', side_effect=RuntimeError("disk gone")), \
+                 patch('vidterm.show_status_message', show_status_message):
+                with self.assertRaises(Exception):
+                    await self.get(proxy, 0, 9)
+        finally:
+            await proxy.close()
+        self.assertEqual(messages, ["Stream proxy error: disk gone"])
+
+    def test_eviction_keeps_recently_played_streams(self):
+        proxy = vidterm.StreamProxy(None, self.directory, max_bytes=1500, block_size=1000)
+        for video_id, last_used in (('old', 1), ('recent', 2)):
+            proxy.store(video_id).blocks.add(0)
+            proxy.entries[video_id]['last_used'] = last_used
+        proxy.enforce_budget()
+        self.assertEqual(list(proxy.entries), ['recent'])
+
+    def test_manifests_and_local_files_bypass_the_proxy(self):
+        self.assertTrue(vidterm.proxyable('https://host/videoplayback?expire=1'))
+        self.assertFalse(vidterm.proxyable('https://host/api/manifest/hls_playlist/index.m3u8'))
+        self.assertFalse(vidterm.proxyable('/home/user/.cache/vidterm/media/vid.media'))
+        self.assertFalse(vidterm.proxyable('appending:///tmp/vid.media'))
+
+
+class TestYoutubeDLPool(unittest.TestCase):
+
+    @patch('yt_dlp.YoutubeDL')
+    def test_instances_are_reused_per_profile(self, MockYoutubeDL):
+        MockYoutubeDL.side_effect = lambda opts: MagicMock(opts=opts)
+        pool = vidterm.YoutubeDLPool()
+        with pool.checkout('search') as first:
+            pass
+        with pool.checkout('search') as second:
+            pass
+        with pool.checkout('stream') as stream:
+            pass
+        self.assertIs(first, second)
+        self.assertIsNot(first, stream)
+        self.assertEqual(stream.opts, dict(vidterm.YDL_PROFILES['stream'], logger=vidterm.yt_dlp_logger))
+
+    @patch('yt_dlp.YoutubeDL')
+    def test_overflow_and_close_all(self, MockYoutubeDL):
+        MockYoutubeDL.side_effect = lambda opts: MagicMock()
+        pool = vidterm.YoutubeDLPool(size=1)
+        with pool.checkout('search') as a:
+            with pool.checkout('search') as b:
+                self.assertIsNot(a, b)
+        a.close.assert_called_once() # Only one instance is kept idle
+        b.close.assert_not_called()
+        pool.close_all()
+        b.close.assert_called_once()
+
+
+class TestStartup(unittest.TestCase):
+
+    @async_test
+    async def test_yt_dlp_is_loaded_in_the_background(self):
+        module = await vidterm.ensure_yt_dlp_async()
+        self.assertIs(module, yt_dlp)
+        self.assertIs(vidterm.ensure_yt_dlp(), yt_dlp)
+        phases = [phase[0] for phase in vidterm.startup_profile.phases]
+        self.assertIn('import yt_dlp', phases)
+        import_thread = next(phase[3] for phase in vidterm.startup_profile.phases if phase[0] == 'import yt_dlp')
+        self.assertEqual(import_thread, 'yt-dlp-warmup')
+
+    def test_startup_profile_report(self):
+        profile = vidterm.StartupProfile(origin=10.0)
+        profile.record('second', 10.5, 10.75)
+        profile.record('first', 10.0, 10.25)
+        lines = profile.report().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['first', 'second'])
+        self.assertIn('500.0', lines[2])
+        self.assertIn('250.0', lines[2])
+
+    def test_startup_profile_flag(self):
+        self.assertTrue(vidterm.parse_args(['--startup-profile']).startup_profile)
+        self.assertFalse(vidterm.parse_args([]).startup_profile)
+
+
+class TestVideoResult(unittest.TestCase):
+
+    def test_from_entry_parses_once(self):
+        result = vidterm.VideoResult.from_entry({'id': 'abc', 'title': 'x' * 200, 'uploader': 'U', 'duration_string': '1:02:03'})
+        self.assertEqual(result.duration, 3723)
+        self.assertEqual(result.duration_string, '1:02:03')
+        self.assertEqual(len(result.display_title), vidterm.RESULT_TITLE_WIDTH)
+        self.assertTrue(result.display_title.endswith('…'))
+        self.assertEqual(result.title, 'x' * 200)
+        self.assertIs(result.id, vidterm.VideoResult(''.join(['a', 'bc'])).id) # Interned
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    def test_from_entry_rejects_unusable_entries(self):
+        self.assertIsNone(vidterm.VideoResult.from_entry(None))
+        self.assertIsNone(vidterm.VideoResult.from_entry({'title': 'no id'}))
+        self.assertEqual(vidterm.VideoResult.from_entry({'id': 'a', 'duration_string': 'live'}).duration_string, 'N/A')
+
+    def test_round_trip(self):
+        result = vidterm.VideoResult('abc', 'Title', 'U', 59)
+        self.assertEqual(vidterm.VideoResult.from_dict(result.to_dict()), result)
+
+
+class TestSearchResultCache(unittest.TestCase):
+
+    def test_expired_entries_are_misses(self):
+        cache = vidterm.SearchResultCache(':memory:', ttl=60)
+        cache.put("query", [vidterm.VideoResult('1')])
+        with patch('time.time', return_value=time.time() + 120):
+            self.assertIsNone(cache.get("query"))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_lru_eviction(self):
+        cache = vidterm.SearchResultCache(':memory:', max_entries=2)
+        now = time.time()
+        with patch('time.time', side_effect=[now, now + 1, now + 2, now + 3]):
+            cache.put("a", [vidterm.VideoResult('a')])
+            cache.put("b", [vidterm.VideoResult('b')])
+            cache.get("a") # Touch "a" so "b" becomes least recently used
+            cache.put("c", [vidterm.VideoResult('c')])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [vidterm.VideoResult('a')])
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_reads_rows_with_duration_strings(self):
+        cache = vidterm.SearchResultCache(':memory:')
+        now = time.time()
+        cache._connection().execute("INSERT INTO search_cache VALUES (?, ?, ?, ?, ?)", (
+            'old', 0, json.dumps([{'id': '1', 'title': 'T', 'uploader': 'U', 'duration_string': '10:00'}]), now, now))
+        self.assertEqual(cache.get('old'), [vidterm.VideoResult('1', 'T', 'U', 600)])
+
+    def test_pages_are_keyed_apart_from_the_query_text(self):
+        cache = vidterm.SearchResultCache(':memory:')
+        cache.put("foo", [vidterm.VideoResult('page1')], 1)
+        self.assertIsNone(cache.get("foo #page1"))
+        cache.put("foo #page1", [vidterm.VideoResult('query')])
+        self.assertEqual(cache.get("foo", 1), [vidterm.VideoResult('page1')])
+        self.assertEqual(cache.get("foo #page1"), [vidterm.VideoResult('query')])
+
+    def test_table_without_pages_is_replaced(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'cache.sqlite')
+        conn = vidterm.sqlite3.connect(path)
+        conn.execute("CREATE TABLE search_cache (query TEXT PRIMARY KEY, results TEXT NOT NULL,"
+                     " created REAL NOT NULL, last_access REAL NOT NULL)")
+        conn.execute("INSERT INTO search_cache VALUES ('foo #page1', '[]', 0, 0)")
+        conn.commit()
+        conn.close()
+        cache = vidterm.SearchResultCache(path)
+        self.addCleanup(cache.close)
+        self.assertIsNone(cache.get("foo", 1))
+        cache.put("foo", [vidterm.VideoResult('1')], 1)
+        self.assertEqual(cache.get("foo", 1), [vidterm.VideoResult('1')])
+
+
+
+class TestStatusManager(unittest.TestCase):
+
+    def setUp(self):
+        self.app = MagicMock()
+        self.app.status_bar_control.text = ''
+        self.app.invalidated = False
+        patcher = patch('vidterm.application_instance', self.app)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = vidterm.StatusManager(lambda: 'default')
+
+    @async_test
+    async def test_burst_of_updates_redraws_once(self):
+        for i in range(20):
+            self.manager.show(f"message {i}", 3)
+        self.app.invalidate.assert_not_called()
+        await asyncio.sleep(0)
+        self.assertEqual(self.app.status_bar_control.text, 'message 19')
+        self.app.invalidate.assert_called_once()
+        self.assertEqual(len(self.manager.log), 20)
+        self.manager.close()
+
+    @async_test
+    async def test_single_timer_expires_messages_in_priority_order(self):
+        self.manager.show("error", 0.05, vidterm.STATUS_PRIORITY_ERROR)
+        self.manager.show("searching...") # Lower priority: queued behind the error
+        timer = self.manager._timer
+        self.manager.show("still searching...")
+        self.assertIs(self.manager._timer, timer) # Same expiry, timer not rescheduled
+        await asyncio.sleep(0)
+        self.assertEqual(self.app.status_bar_control.text, 'error')
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.app.status_bar_control.text, 'still searching...')
+        self.manager.show("done", 0.01)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.app.status_bar_control.text, 'default')
+        self.assertIsNone(self.manager._timer)
+
+
+class TestFrameScheduler(unittest.TestCase):
+
+    def test_requests_merge_while_a_frame_is_pending(self):
+        scheduler = vidterm.FrameScheduler(max_fps=20)
+        app = MagicMock(invalidated=False)
+        app.invalidate.side_effect = lambda: setattr(app, 'invalidated', True)
+        with patch('vidterm.application_instance', app):
+            for _ in range(5):
+                scheduler.request_redraw()
+        app.invalidate.assert_called_once()
+        self.assertEqual(scheduler.merged, 4)
+
+    def test_render_times_and_dropped_frames(self):
+        scheduler = vidterm.FrameScheduler(max_fps=20) # 50ms budget
+        app = MagicMock()
+        scheduler.attach(app)
+        self.assertEqual(app.min_redraw_interval, 0.05)
+        with patch('time.perf_counter', side_effect=[0.0, 0.01, 1.0, 1.2]):
+            for _ in range(2):
+                scheduler._before_render(app)
+                scheduler._after_render(app)
+        self.assertEqual(scheduler.frames, 2)
+        self.assertEqual(scheduler.dropped, 1)
+        self.assertIn("dropped 1/2", scheduler.summary())
+        self.assertIn("max 200.0ms", scheduler.summary())
+
+    def test_max_fps_must_be_positive(self):
+        self.assertEqual(vidterm.parse_args(['--max-fps', '12.5']).max_fps, 12.5)
+        for value in ('0', '-5', 'nan'):
+            with patch('sys.stderr', io.StringIO()), self.assertRaises(SystemExit):
+                vidterm.parse_args(['--max-fps', value])
+
+
+def _jpeg_bytes(color=(255, 0, 0), size=(64, 36)):
+    import io
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class TestThumbnailPreview(unittest.TestCase):
+
+    def test_detect_graphics_protocol(self):
+        with patch('vidterm.THUMBNAIL_PROTOCOL', 'auto'):
+            self.assertEqual(vidterm.detect_graphics_protocol({'TERM': 'xterm-kitty'}), 'kitty')
+            self.assertEqual(vidterm.detect_graphics_protocol({'TERM': 'foot'}), 'sixel')
+            self.assertEqual(vidterm.detect_graphics_protocol({'TERM': 'xterm-256color'}), 'halfblock')
+            self.assertEqual(vidterm.detect_graphics_protocol({'TERM': 'xterm-kitty', 'TMUX': '1'}), 'halfblock')
+
+    @unittest.skipUnless(vidterm.importlib.util.find_spec('PIL'), "Pillow not installed")
+    def test_render_thumbnail_protocols(self):
+        raw = _jpeg_bytes()
+        lines = vidterm.render_thumbnail(raw, 4, 3, 'halfblock')
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(len(lines[0]), 4)
+        self.assertTrue(lines[0][0][0].startswith('fg:#'))
+        kitty = vidterm.render_thumbnail(raw, 4, 3, 'kitty')
+        self.assertTrue(kitty.startswith('\x1b_Ga=T,f=100,c=4,r=3'))
+        sixel = vidterm.render_thumbnail(raw, 4, 3, 'sixel')
+        self.assertTrue(sixel.startswith('\x1bPq') and sixel.endswith('\x1b\\'))
+
+    @async_test
+    async def test_rendered_thumbnails_respect_memory_budget(self):
+        preview = vidterm.ThumbnailPreview(cols=2, rows=1, memory_budget=30)
+        rendering = [[('fg:#000000', 'x')]] # 11 bytes
+        for video_id in ('a', 'b', 'c'):
+            preview._store(video_id, rendering)
+        self.assertEqual(list(preview._renderings), ['b', 'c'])
+        on_change = MagicMock()
+        preview.on_change = on_change
+        preview.show('c')
+        self.assertIs(preview.rendered, rendering) # Served from memory without a fetch
+        on_change.assert_called_once()
+        preview.close()
+
+    @async_test
+    async def test_fetch_prefers_disk_cache_and_coalesces(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'abc.jpg'), 'wb') as f:
+                f.write(b'cached')
+            preview = vidterm.ThumbnailPreview()
+            with patch('vidterm.THUMBNAIL_DISK_CACHE_DIR', directory), \
+                 patch('urllib.request.urlopen') as urlopen:
+                first, second = await asyncio.gather(preview.fetch('abc'), preview.fetch('abc'))
+            self.assertEqual((first, second), (b'cached', b'cached'))
+            urlopen.assert_not_called()
+            self.assertEqual(preview._fetches, {})
 
 
 if __name__ == '__main__':
@@ -1,150 +1,3555 @@
-import yt_dlp
+import time
+_process_started = time.perf_counter() # Origin of the --startup-profile timings
+import argparse
+import concurrent.futures
 import json
+import math
+import struct
+import multiprocessing
+import os
+import sqlite3
+import stat
 import subprocess
+import sys
 import shlex
+import shutil
+import tempfile
+import threading
+import itertools
+import collections
+import re
+import secrets
+import urllib.parse
 import asyncio # For running mpv and handling UI updates
+import atexit
+import base64
+import contextlib
+import contextvars
+import hashlib
+import heapq
+import http
+import importlib.util
+import io
+import urllib.error
+import urllib.request
+_stdlib_imported = time.perf_counter()
 
-from prompt_toolkit import Application
-from prompt_toolkit.buffer import Buffer
-from prompt_toolkit.layout.containers import HSplit, VSplit, Window, WindowAlign
-from prompt_toolkit.layout.controls import BufferControl, FormattedTextControl
-from prompt_toolkit.layout.layout import Layout
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.widgets import TextArea, Label, Frame, Box
-from prompt_toolkit.document import Document
-from prompt_toolkit.shortcuts import message_dialog # For simple error popups
 
-# --- Core yt-dlp and mpv logic ---
+# yt_dlp is imported on a background thread (see start_yt_dlp_warmup) because importing
+# it takes longer than bringing up the whole UI
+yt_dlp = None
+
+# --- Configuration ---
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'vidterm')
+SEARCH_CACHE_PATH = os.path.join(CACHE_DIR, 'search_cache.sqlite3')
+SEARCH_CACHE_TTL = 6 * 60 * 60 # Seconds a cached result list stays valid
+SEARCH_CACHE_MAX_ENTRIES = 500 # Least recently used queries are evicted beyond this
+YDL_POOL_SIZE = 2 # Warm YoutubeDL instances kept per option profile
+# Worker threads per job lane (see JobScheduler); foreground work never waits behind background work
+JOB_FOREGROUND_WORKERS = 2
+JOB_BACKGROUND_WORKERS = 2
+# Worker processes for yt-dlp extraction; 0 keeps extraction on threads in this process.
+# Worker processes keep yt-dlp's CPU-heavy parsing off the UI's GIL (see --extract-processes).
+EXTRACTION_PROCESSES = 0
+RESOLVE_PARALLELISM = 8 # Default for 'vidterm resolve -j'
+RESULT_TITLE_WIDTH = 70 # Titles are truncated to this many characters once, when a result is created
+STREAMING_SEARCH = True # Render search results one by one as yt-dlp extracts them
+SEARCH_PAGE_SIZE = 10 # Results fetched per search page
+SEARCH_PAGE_PREFETCH_MARGIN = 3 # Load the next page once the selection is this close to the end
+SEARCH_MAX_RESULTS = 1000 # Scrolling through one query's results stops here
+SEARCH_SESSIONS = 4 # Queries whose open search is kept for loading their next page
+SEARCH_SESSION_TTL = 30 * 60 # Seconds an open search is kept unused; its continuation goes stale
+LIVE_SEARCH = False # Search as you type instead of only on Enter
+LIVE_SEARCH_DEBOUNCE = 0.35 # Seconds of typing inactivity before a live search starts
+LIVE_SEARCH_MIN_CHARS = 3 # Shorter queries are not searched live
+PREFETCH_DWELL = 0.4 # Seconds a result must stay highlighted before its stream URL is prefetched
+PREFETCH_TOP_N = 3 # Stream URLs of this many top results are prefetched after every search
+STREAM_URL_CACHE_MAX_ENTRIES = 100 # Resolved stream URLs kept, least recently used dropped first
+STREAM_URL_DEFAULT_TTL = 30 * 60 # Assumed lifetime of stream URLs that carry no expiry
+STREAM_URL_EXPIRY_MARGIN = 5 * 60 # URLs this close to expiry are no longer handed to mpv
+STREAM_URL_REFRESH_BEFORE = 10 * 60 # Re-resolve cached URLs this long before they expire...
+STREAM_URL_KEEP_WARM = 30 * 60 # ...but only if they were used within this many seconds
+MAX_FPS = 30 # Redraws are capped at this rate; lower it over slow SSH links
+FRAME_STATS_OVERLAY = False # Show render times and dropped frames in the corner (toggle with F3)
+FRAME_STATS_WINDOW = 120 # Number of recent frames the overlay summarizes
+STATUS_LOG_SIZE = 200 # Status messages kept for the F2 message log
+THUMBNAIL_PREVIEWS = True # Show the highlighted video's thumbnail next to the results (needs Pillow)
+THUMBNAIL_PROTOCOL = 'auto' # 'kitty', 'sixel', 'halfblock', or 'auto' to detect from the terminal
+THUMBNAIL_COLS = 32 # Size of the preview panel in terminal cells
+THUMBNAIL_ROWS = 9
+THUMBNAIL_NEIGHBOURS = 2 # Thumbnails of this many rows around the highlight are fetched ahead
+THUMBNAIL_FETCH_CONCURRENCY = 4 # Simultaneous thumbnail downloads
+THUMBNAIL_DECODE_WORKERS = 2 # Processes that decode and downscale thumbnails
+THUMBNAIL_MEMORY_BUDGET = 8 * 1024 * 1024 # Bytes of rendered thumbnails kept in memory
+THUMBNAIL_DISK_CACHE_DIR = os.path.join(CACHE_DIR, 'thumbnails')
+THUMBNAIL_DISK_CACHE_MAX_FILES = 2000 # Oldest raw thumbnails are deleted beyond this
+# Keep one idle mpv running (in its own window) and send it videos over JSON IPC instead of
+# launching mpv in the terminal for every video
+MPV_PERSISTENT = False
+MPV_IPC_CONNECT_TIMEOUT = 5.0 # Seconds to wait for a freshly started mpv to open its IPC socket
+# mpv video output: 'auto' opens a window when there is a display and otherwise draws in the
+# terminal (kitty or sixel graphics if supported, else tct), or any mpv --vo name
+MPV_VO = 'auto'
+# Streams are chosen to be the cheapest that still fill what mpv draws (see select_stream_formats)
+FORMAT_WINDOW_SIZE = (1920, 1080) # Pixels assumed for playback in a window
+FORMAT_HEIGHTS = (144, 240, 360, 480, 720, 1080, 1440, 2160, 4320) # The usual 16:9 resolution ladder
+FORMAT_BANDWIDTH_HEADROOM = 1.5 # A stream needs this multiple of its bitrate in measured bandwidth
+FORMAT_MIN_AUDIO_KBPS = 64 # Audio tracks below this bitrate are only chosen if there is nothing better
+# Relative CPU cost of decoding each video codec in software, per bit
+CODEC_DECODE_COST = {'avc1': 1.0, 'vp9': 1.4, 'vp09': 1.4, 'hev1': 1.6, 'hvc1': 1.6, 'av01': 2.0}
+# Keep played videos on disk so replays do not stream them again. Off by default: the first
+# playback streams the video and downloads it alongside (see MediaCache)
+MEDIA_CACHE = False
+MEDIA_CACHE_DIR = os.path.join(CACHE_DIR, 'media')
+MEDIA_CACHE_MAX_BYTES = 2 * 1024 ** 3
+MEDIA_CACHE_EVICTION = 'lru' # 'lru' evicts the least recently played video first, 'lfu' the least often played
+MEDIA_FRAGMENT_SIZE = 2 * 1024 * 1024 # Bytes per HTTP range request
+MEDIA_DOWNLOAD_CONNECTIONS = 4 # Fragments fetched in parallel per download
+MEDIA_FETCH_TIMEOUT = 20.0
+# Hand mpv a URL on a local HTTP proxy instead of the stream URL. The proxy keeps the byte ranges
+# mpv fetched in a sparse file per video, so seeking back and replays do not download them again
+STREAM_PROXY = False
+STREAM_PROXY_DIR = os.path.join(CACHE_DIR, 'proxy')
+STREAM_PROXY_MAX_BYTES = 1024 ** 3
+STREAM_PROXY_BLOCK_SIZE = 512 * 1024 # Ranges are fetched and stored in blocks of this size
+STREAM_PROXY_READAHEAD = 8 # Missing blocks fetched per upstream request
+STREAM_PROXY_IDLE_CONNECTIONS = 4 # Keep-alive upstream connections kept per host
+# The TUI talks to a resident vidtermd process (started on demand) that keeps yt-dlp warm and
+# owns the caches, prefetching and the persistent mpv; --no-daemon does everything in-process
+USE_DAEMON = True
+# In a directory of its own that only this user can enter (see private_socket_directory)
+DAEMON_SOCKET_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+                                  f"vidterm-{os.getuid()}", 'vidtermd.sock')
+DAEMON_START_TIMEOUT = 10.0 # Seconds to wait for a freshly spawned daemon to accept connections
+DAEMON_PING_TIMEOUT = 2.0 # Seconds a running daemon gets to answer the version check
+DAEMON_IDLE_TIMEOUT = 30 * 60 # The daemon exits after this long without clients
+DAEMON_MAX_FRAME = 16 * 1024 * 1024
+
+# yt-dlp option profiles; each profile gets its own pool of YoutubeDL instances
+YDL_PROFILES = {
+    'search': {
+        'quiet': True,
+        'extract_flat': 'search',
+        'default_search': 'ytsearch10:',
+        'forcejson': True,
+    },
+    # yt-dlp's pick when no playback target is known; otherwise select_stream_formats chooses
+    'stream': {'quiet': True, 'format': 'best/bestvideo*+bestaudio'},
+}
+
+# --- Startup profiling and background yt-dlp loading ---
+
+class StartupProfile:
+    """ Collects how long each import and initialization step took, for --startup-profile. """
+
+    def __init__(self, origin):
+        self.origin = origin
+        self.phases = []
+        self._lock = threading.Lock() # Phases are recorded from the warm-up thread too
+
+    def record(self, name, started, finished=None):
+        finished = finished if finished is not None else time.perf_counter()
+        with self._lock:
+            self.phases.append((name, started - self.origin, finished - started, threading.current_thread().name))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def report(self):
+        lines = [f"{'phase':<34}{'start ms':>10}{'took ms':>10}  thread"]
+        for name, offset, took, thread in sorted(self.phases, key=lambda phase: phase[1]):
+            lines.append(f"{name:<34}{offset * 1000:>10.1f}{took * 1000:>10.1f}  {thread}")
+        return "\n".join(lines)
+
+startup_profile = StartupProfile(_process_started)
+startup_profile.record('import stdlib modules', _process_started, _stdlib_imported)
+
+yt_dlp_ready = concurrent.futures.Future()
+_yt_dlp_warmup_lock = threading.Lock()
+_yt_dlp_warmup_started = False
+
+def _warm_up_yt_dlp():
+    global yt_dlp
+    try:
+        with startup_profile.phase('import yt_dlp'):
+            import yt_dlp as module
+        with startup_profile.phase('load yt-dlp extractor registry'):
+            module.extractor.gen_extractor_classes()
+        yt_dlp = module
+        with startup_profile.phase('YoutubeDL option setup'):
+            ydl_pool.prewarm('search')
+    except BaseException as e:
+        yt_dlp_ready.set_exception(e)
+    else:
+        yt_dlp_ready.set_result(module)
+
+def start_yt_dlp_warmup():
+    """ Starts importing and initializing yt-dlp on a background thread (once). """
+    global _yt_dlp_warmup_started
+    with _yt_dlp_warmup_lock:
+        if not _yt_dlp_warmup_started:
+            _yt_dlp_warmup_started = True
+            threading.Thread(target=_warm_up_yt_dlp, name='yt-dlp-warmup', daemon=True).start()
+    return yt_dlp_ready
+
+def ensure_yt_dlp():
+    """ Returns the yt_dlp module, blocking until it is imported. For executor threads. """
+    if yt_dlp is not None:
+        return yt_dlp
+    return start_yt_dlp_warmup().result()
+
+async def ensure_yt_dlp_async():
+    """ Waits (without blocking the event loop) until yt-dlp is ready. """
+    return await asyncio.wrap_future(start_yt_dlp_warmup())
+
+# --- Result model ---
+
+def parse_duration_string(text):
+    """ '1:02:03' / '4:05' / '59' -> seconds, or None if it is not a duration. """
+    try:
+        parts = [int(part) for part in text.split(':')]
+    except (AttributeError, ValueError):
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+def format_duration(seconds):
+    """ Seconds -> 'H:MM:SS' or 'M:SS', the same shape as yt-dlp's duration_string. """
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+class VideoResult:
+    """ One search result. Slotted, with the duration parsed to integer seconds, the title
+    truncated for display and the id interned, all once, when the result is created. """
+
+    __slots__ = ('id', 'title', 'uploader', 'duration', 'display_title', 'match_text')
+
+    def __init__(self, id, title='N/A', uploader='N/A', duration=None):
+        self.id = sys.intern(str(id))
+        self.title = title
+        self.uploader = uploader
+        self.duration = duration
+        self.display_title = title if len(title) <= RESULT_TITLE_WIDTH else title[:RESULT_TITLE_WIDTH - 1] + "…"
+        self.match_text = f"{title} {uploader}".lower() # What the '/' filter matches against
+
+    @classmethod
+    def from_entry(cls, entry):
+        """ Builds a result from a yt-dlp search entry, or returns None if it is unusable. """
+        if not (entry and isinstance(entry, dict) and entry.get('id')):
+            return None
+        duration = entry.get('duration')
+        if duration is None:
+            duration = parse_duration_string(entry.get('duration_string'))
+        return cls(entry['id'], entry.get('title') or 'N/A', entry.get('uploader') or 'N/A',
+                   int(duration) if duration is not None else None)
+
+    @property
+    def duration_string(self):
+        return format_duration(self.duration) if self.duration is not None else 'N/A'
+
+    def to_dict(self):
+        return {'id': self.id, 'title': self.title, 'uploader': self.uploader, 'duration': self.duration}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['id'], data['title'], data['uploader'], data['duration'])
+
+    def __eq__(self, other):
+        return isinstance(other, VideoResult) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"VideoResult({self.id!r}, {self.title!r}, {self.uploader!r}, {self.duration!r})"
+
+# --- Search result cache ---
+
+class SearchResultCache:
+    """ SQLite-backed cache of (normalized query, page) -> VideoResult list, with TTL expiry and LRU eviction. """
+
+    def __init__(self, path, ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock() # The connection is shared with executor threads
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(query.lower().split())
+
+    def _connection(self):
+        # Opened lazily so that importing vidterm never touches the disk
+        if self._conn is None:
+            if self.path != ':memory:':
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(search_cache)")]
+            if columns and 'page' not in columns:
+                self._conn.execute("DROP TABLE search_cache") # From before pages had a column of their own
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache ("
+                " query TEXT NOT NULL, page INTEGER NOT NULL, results TEXT NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (query, page))")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS search_cache_lru ON search_cache(last_access)")
+        return self._conn
+
+    def get(self, query, page=0):
+        """ Returns the cached result list for a page of query, or None on a miss or an expired entry. """
+        key = self.normalize(query)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                row = conn.execute("SELECT results, created FROM search_cache WHERE query = ? AND page = ?",
+                                   (key, page)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                results, created = row
+                if now - created > self.ttl:
+                    conn.execute("DELETE FROM search_cache WHERE query = ? AND page = ?", (key, page))
+                    conn.commit()
+                    self.misses += 1
+                    return None
+                conn.execute("UPDATE search_cache SET last_access = ? WHERE query = ? AND page = ?", (now, key, page))
+                conn.commit()
+            except sqlite3.Error:
+                # A broken cache must never break searching
+                self.misses += 1
+                return None
+        self.hits += 1
+        # from_entry also reads rows cached before durations were stored as seconds
+        return [VideoResult.from_entry(data) for data in json.loads(results)]
+
+    def put(self, query, results, page=0):
+        key = self.normalize(query)
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO search_cache (query, page, results, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (key, page, json.dumps([result.to_dict() for result in results]), now, now))
+                conn.execute(
+                    "DELETE FROM search_cache WHERE rowid NOT IN"
+                    " (SELECT rowid FROM search_cache ORDER BY last_access DESC LIMIT ?)",
+                    (self.max_entries,))
+                conn.commit()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            try:
+                entries = self._connection().execute("SELECT COUNT(*) FROM search_cache").fetchone()[0]
+            except sqlite3.Error:
+                entries = 0
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+search_cache = SearchResultCache(SEARCH_CACHE_PATH)
+
+class QuietYtDlpLogger:
+    """ Discards yt-dlp's console output; it would be drawn over the full-screen UI.
+    Failures still surface as exceptions and are reported in the status bar. """
+
+    def debug(self, message):
+        # yt-dlp reports every step of an extraction here, so a cancelled job stops at the next one
+        raise_if_job_cancelled()
+
+    info = warning = error = debug
+
+yt_dlp_logger = QuietYtDlpLogger()
+
+# --- YoutubeDL instance pool ---
+
+class YoutubeDLPool:
+    """ Keeps warm YoutubeDL instances per option profile so extractor setup, the HTTP
+    session and cached player data survive between requests. A YoutubeDL instance is not
+    safe for concurrent use, so each one is checked out by a single executor thread at a time. """
+
+    def __init__(self, profiles=YDL_PROFILES, size=YDL_POOL_SIZE):
+        self.profiles = profiles
+        self.size = size
+        self._idle = {name: [] for name in profiles}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _create(self, profile):
+        return ensure_yt_dlp().YoutubeDL(dict(self.profiles[profile], logger=yt_dlp_logger))
+
+    def prewarm(self, profile):
+        """ Builds an idle instance ahead of the first request. """
+        with self.checkout(profile):
+            pass
+
+    @contextlib.contextmanager
+    def checkout(self, profile):
+        ydl = self.acquire(profile)
+        try:
+            yield ydl
+        finally:
+            self.release(profile, ydl)
+
+    def acquire(self, profile):
+        """ An instance for the caller's sole use until it is given back with release(). """
+        with self._lock:
+            idle = self._idle[profile]
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            # Pool exhausted: create a new instance rather than block the caller
+            ydl = self._create(profile)
+        return ydl
+
+    def release(self, profile, ydl):
+        with self._lock:
+            if not self._closed and len(self._idle[profile]) < self.size:
+                self._idle[profile].append(ydl)
+                return
+        ydl.close() # Overflow instances (or anything returned after close_all) are discarded
+
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            instances = [ydl for idle in self._idle.values() for ydl in idle]
+            for idle in self._idle.values():
+                idle.clear()
+        for ydl in instances:
+            try:
+                ydl.close()
+            except Exception:
+                pass
+
+ydl_pool = YoutubeDLPool()
+atexit.register(ydl_pool.close_all)
+
+def extract_info_pooled(profile, url, **kwargs):
+    """ Runs extract_info on a pooled YoutubeDL instance. Blocking; call from an executor. """
+    with ydl_pool.checkout(profile) as ydl:
+        return ydl.extract_info(url, download=False, **kwargs)
+
+class SearchSession:
+    """ yt-dlp's lazy result generator for one query, kept open between page loads so that the
+    next page continues where the last one stopped; yt-dlp fetches each continuation page of
+    results as the generator reaches it. The generator goes on using its YoutubeDL instance,
+    so the session keeps that instance out of the pool until it is closed. """
+
+    def __init__(self, query):
+        self.position = 0 # Entries read so far
+        self.last_used = time.monotonic()
+        self._ydl = ydl_pool.acquire('search')
+        try:
+            # process=False leaves 'entries' as the lazy generator
+            info_dict = self._ydl.extract_info(search_url(query), download=False, process=False)
+        except BaseException:
+            self.close()
+            raise
+        self._entries = iter((info_dict or {}).get('entries') or [])
+
+    def read(self, start, count):
+        """ Yields raw entries start..start+count-1 as yt-dlp extracts them, first skipping
+        to start. Blocking. """
+        skip = start - self.position
+        for index, entry in enumerate(itertools.islice(self._entries, skip, skip + count)):
+            self.position = start + index + 1
+            yield entry
+
+    def close(self):
+        if self._ydl is not None:
+            self._entries = None
+            ydl_pool.release('search', self._ydl)
+            self._ydl = None
+
+class SearchSessionPool:
+    """ The open SearchSession of recent queries, by normalized query. Like YoutubeDLPool, a
+    session is checked out by one thread at a time; a page that finds none (or one already
+    past its start) searches again and skips the earlier pages' entries. """
+
+    def __init__(self, size=SEARCH_SESSIONS, ttl=SEARCH_SESSION_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.continued = 0 # Pages read from an open session rather than a new search
+        self._idle = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def checkout(self, query, start):
+        """ A session that has read no further than entry start. It is kept for the next page
+        unless reading from it fails, e.g. because the job was cancelled mid-extraction. """
+        key = SearchResultCache.normalize(query)
+        with self._lock:
+            session = self._idle.pop(key, None)
+        if session is not None and (session.position > start or time.monotonic() - session.last_used > self.ttl):
+            session.close()
+            session = None
+        if session is None:
+            session = SearchSession(query)
+        else:
+            self.continued += 1
+        try:
+            yield session
+        except BaseException:
+            session.close()
+            raise
+        session.last_used = time.monotonic()
+        with self._lock:
+            stale = [self._idle.pop(key, None)] # From a concurrent search for the same query
+            self._idle[key] = session
+            while len(self._idle) > self.size:
+                stale.append(self._idle.popitem(last=False)[1])
+        for old in stale:
+            if old is not None:
+                old.close()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._idle.values())
+            self._idle.clear()
+        for session in sessions:
+            session.close()
+
+search_sessions = SearchSessionPool()
+atexit.register(search_sessions.close_all) # Runs before ydl_pool.close_all, so instances are closed too
+
+# --- Job scheduling ---
+
+FOREGROUND = 'foreground' # Work the user is waiting for: searches, playback
+BACKGROUND = 'background' # Speculative work: prefetching, thumbnails, cache refresh
+
+# Lane used by jobs submitted from the current task unless one is given explicitly. Background
+# tasks set it once, so deep helpers such as coalesced_job need no lane parameter.
+job_lane = contextvars.ContextVar('job_lane', default=FOREGROUND)
+
+class JobCancelled(Exception):
+    pass
+
+class CancelToken:
+    """ Cooperative cancellation for a job running on a worker thread. Cancelling stops a
+    queued job from starting; a running job can poll cancelled or call raise_if_cancelled()
+    (raise_if_job_cancelled() finds the current job's token). """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+_job_thread_state = threading.local() # The token of the job a worker thread is running
+
+def raise_if_job_cancelled():
+    """ Raises JobCancelled if the job running on this thread has been cancelled. """
+    token = getattr(_job_thread_state, 'token', None)
+    if token is not None:
+        token.raise_if_cancelled()
+
+class Job:
+    __slots__ = ('lane', 'fn', 'args', 'token', 'future', 'started')
+
+    def __init__(self, lane, fn, args, token, future):
+        self.lane = lane
+        self.fn = fn
+        self.args = args
+        self.token = token
+        self.future = future # asyncio future on the submitting loop
+        self.started = False
+
+class JobScheduler:
+    """ Runs blocking work (yt-dlp extraction, downloads) on worker threads in two lanes with
+    their own bounded worker counts. Background jobs only start while no foreground job is
+    queued or running, so speculative work can never hold up an explicit user action; a
+    queued background job that a foreground caller starts waiting on is promoted. A thread
+    that is already running cannot be interrupted, so preemption applies to queued work. """
+
+    def __init__(self, foreground_workers=JOB_FOREGROUND_WORKERS, background_workers=JOB_BACKGROUND_WORKERS):
+        self.limits = {FOREGROUND: foreground_workers, BACKGROUND: background_workers}
+        self._queues = {FOREGROUND: collections.deque(), BACKGROUND: collections.deque()}
+        self._running = {FOREGROUND: 0, BACKGROUND: 0}
+        self._executors = {}
+
+    def submit(self, fn, *args, lane=None, token=None):
+        """ Queues fn(*args) and returns its Job; await job.future for the result.
+        Cancelling job.future also cancels the job's token. """
+        lane = lane or job_lane.get()
+        job = Job(lane, fn, args, token or CancelToken(), asyncio.get_running_loop().create_future())
+        job.future.add_done_callback(lambda f: self._cancelled(job) if f.cancelled() else None)
+        self._queues[lane].append(job)
+        self._pump()
+        return job
+
+    def _cancelled(self, job):
+        job.token.cancel()
+        if not job.started:
+            with contextlib.suppress(ValueError):
+                self._queues[job.lane].remove(job)
+            self._pump() # A foreground job leaving the queue may release background work
+
+    async def run(self, fn, *args, lane=None, token=None):
+        return await self.submit(fn, *args, lane=lane, token=token).future
+
+    def promote(self, job):
+        """ Moves a queued background job to the foreground lane. """
+        if job.lane == BACKGROUND and not job.started:
+            self._queues[BACKGROUND].remove(job)
+            job.lane = FOREGROUND
+            self._queues[FOREGROUND].append(job)
+            self._pump()
+
+    def _executor(self, lane):
+        if lane not in self._executors:
+            self._executors[lane] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.limits[lane], thread_name_prefix=f'vidterm-{lane}')
+        return self._executors[lane]
+
+    def _pump(self):
+        for lane in (FOREGROUND, BACKGROUND):
+            queue = self._queues[lane]
+            while queue and self._running[lane] < self.limits[lane]:
+                if lane == BACKGROUND and (self._queues[FOREGROUND] or self._running[FOREGROUND]):
+                    return # Held back until the foreground is idle
+                job = queue.popleft()
+                if job.future.done() or job.token.cancelled:
+                    continue # Cancelled while queued
+                self._start(job)
+
+    def _start(self, job):
+        job.started = True
+        self._running[job.lane] += 1
+        lane = job.lane
+        work = asyncio.wrap_future(self._executor(lane).submit(self._call, job), loop=job.future.get_loop())
+        work.add_done_callback(lambda f: self._finished(job, lane, f))
+
+    @staticmethod
+    def _call(job):
+        job.token.raise_if_cancelled()
+        _job_thread_state.token = job.token
+        try:
+            return job.fn(*job.args)
+        finally:
+            _job_thread_state.token = None
+
+    def _finished(self, job, lane, work):
+        self._running[lane] -= 1
+        if not job.future.done():
+            if work.cancelled():
+                job.future.cancel()
+            elif work.exception() is not None:
+                job.future.set_exception(work.exception())
+            else:
+                job.future.set_result(work.result())
+        self._pump()
+
+    def stats(self):
+        return {lane: {'queued': len(self._queues[lane]), 'running': self._running[lane]} for lane in self._queues}
+
+    def close(self):
+        for queue in self._queues.values():
+            for job in queue:
+                job.token.cancel()
+            queue.clear()
+        for executor in self._executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self._executors.clear()
+
+job_scheduler = JobScheduler()
+
+# --- Process extraction backend ---
+
+def search_page_payload(query, page):
+    """ Extracts one page of search results as compact dicts (see VideoResult.to_dict). Blocking;
+    runs on a job thread or in an extraction worker process. """
+    start = SEARCH_PAGE_SIZE * page
+    with search_sessions.checkout(query, start) as session:
+        results = [VideoResult.from_entry(entry) for entry in session.read(start, SEARCH_PAGE_SIZE)]
+    return [result.to_dict() for result in results if result]
+
+def stream_url_payload(video_id, target=None, bandwidth=None):
+    """ Resolves (stream_url, expires_at) for video_id, with the streams chosen for target (see
+    select_stream_formats). Blocking, like search_page_payload. """
+    info_dict = extract_info_pooled('stream', watch_url(video_id))
+    chosen = target and select_stream_formats(info_dict.get('formats') or [], target, bandwidth, info_dict.get('duration'))
+    stream_url = join_stream_urls([f['url'] for f in chosen]) if chosen else _stream_url_from_info(info_dict)
+    if not stream_url:
+        return None, None
+    expiries = [stream_url_expiry(url, info_dict) for url in split_stream_url(stream_url)]
+    return stream_url, min((expiry for expiry in expiries if expiry), default=None)
+
+def _init_extraction_worker():
+    # Each worker process keeps its own ydl_pool, so its YoutubeDL instances live as long as it does
+    ensure_yt_dlp()
+    ydl_pool.prewarm('stream')
+
+def _extraction_worker_ready():
+    return os.getpid()
+
+class ProcessExtractionBackend:
+    """ Runs the *_payload extraction functions in a pool of worker processes. Job threads
+    block on the worker's result, so the job lanes still decide what runs when, while the
+    CPU-heavy extraction itself happens outside this process. Only the trimmed payloads
+    are sent back. Workers are spawned rather than forked, because forking a process that
+    is running threads can leave locks held in the child. """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._process_pool = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._process_pool is None:
+                self._process_pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_extraction_worker)
+            return self._process_pool
+
+    def start(self):
+        """ Starts every worker now, so that the first extraction does not pay for process startup. """
+        pool = self._pool()
+        for _ in range(self.workers):
+            pool.submit(_extraction_worker_ready)
+
+    def call(self, fn, *args):
+        return self._pool().submit(fn, *args).result()
+
+    def close(self):
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+                self._process_pool = None
+
+extraction_backend = None # A ProcessExtractionBackend when extraction runs in worker processes
+
+def run_extraction(fn, *args):
+    """ Calls an extraction function here or in a worker process. Blocking; runs on a job thread. """
+    if extraction_backend is not None:
+        return extraction_backend.call(fn, *args)
+    return fn(*args)
+
+# --- Core yt-dlp and mpv logic ---
+
+# Global application instance to access UI elements from functions
+application_instance = None
+
+STATUS_PRIORITY_INFO = 0
+STATUS_PRIORITY_ERROR = 1 # Not replaced by routine updates until it expires
+
+class StatusManager:
+    """ Owns the status bar text. Messages sit in a priority queue; the bar shows the newest
+    message of the highest priority still queued, or the default text. Timed messages expire
+    through one shared timer, and any number of updates within a loop iteration produce a
+    single redraw. Recent messages are kept in a scrollback log. """
+
+    def __init__(self, get_default_text, log_size=STATUS_LOG_SIZE):
+        self.get_default_text = get_default_text
+        self.log = collections.deque(maxlen=log_size) # (time.time(), message), oldest first
+        self._queue = [] # (-priority, -sequence, expires_at, message) heap
+        self._sequence = itertools.count()
+        self._timer = None
+        self._timer_at = None
+        self._flush_pending = False
+
+    def show(self, message, duration=None, priority=STATUS_PRIORITY_INFO, log=True):
+        # A new message supersedes everything queued at its priority or below
+        self._queue = [item for item in self._queue if -item[0] > priority]
+        expires_at = time.monotonic() + duration if duration else float('inf')
+        heapq.heappush(self._queue, (-priority, -next(self._sequence), expires_at, message))
+        if log:
+            self.log.append((time.time(), message))
+        self._schedule_expiry()
+        self._request_flush()
+
+    def current(self):
+        return self._queue[0][3] if self._queue else self.get_default_text()
+
+    def _expire(self):
+        self._timer = self._timer_at = None
+        now = time.monotonic()
+        remaining = [item for item in self._queue if item[2] > now]
+        if len(remaining) != len(self._queue):
+            self._queue = remaining
+            heapq.heapify(self._queue)
+            self._request_flush()
+        self._schedule_expiry()
+
+    def _schedule_expiry(self):
+        next_expiry = min((item[2] for item in self._queue), default=float('inf'))
+        if next_expiry == float('inf') or next_expiry == self._timer_at:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # No event loop (e.g. during tests); timed messages then stay until replaced
+        if self._timer:
+            self._timer.cancel()
+        self._timer_at = next_expiry
+        self._timer = loop.call_at(loop.time() + max(0.0, next_expiry - time.monotonic()), self._expire)
+
+    def _request_flush(self):
+        if self._flush_pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._flush()
+            return
+        self._flush_pending = True
+        loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_pending = False
+        if application_instance and hasattr(application_instance, 'status_bar_control'):
+            text = self.current()
+            if application_instance.status_bar_control.text != text:
+                application_instance.status_bar_control.text = text
+                frame_scheduler.request_redraw()
+
+    def close(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = self._timer_at = None
+
+# Where show_status_message sends messages from the current task instead of the status bar;
+# the daemon points it at the client that made the request
+status_message_sink = contextvars.ContextVar('status_message_sink', default=None)
+
+def show_status_message(message, duration=None, priority=STATUS_PRIORITY_INFO):
+    """ Displays a message in the status bar. Clears after duration if specified. """
+    sink = status_message_sink.get()
+    if sink is not None:
+        sink(message, duration, priority)
+        return
+    status_manager.show(message, duration, priority)
+
+
+def get_default_status_text():
+    return "VidTerm | (Ctrl-C/Q to quit) | (Up/Down, Enter to play)"
+
+status_manager = StatusManager(get_default_status_text)
+
+def search_url(query):
+    """ yt-dlp search URL for every result of query that can be scrolled to; extracted with
+    process=False, results are only fetched as they are read (see SearchSession). """
+    return f"ytsearch{SEARCH_MAX_RESULTS}:{query}"
+
+def _search_summary_message(query, page, count):
+    if not count:
+        return f"No results found for '{query}'." if page == 0 else f"No more results for '{query}'."
+    return f"Found {count} videos." if page == 0 else f"Loaded {count} more videos."
+
+async def search_videos_async(query, page=0):
+    client = await connected_daemon()
+    if client is not None:
+        with contextlib.suppress(DaemonConnectionError): # On failure, fall through and search in-process
+            return await client.search(query, page)
+    cached = search_cache.get(query, page)
+    if cached is not None:
+        show_status_message(f"Found {len(cached)} videos (cached).", 3)
+        return cached
+
+    show_status_message(f"Searching for: {query}...")
+    await ensure_yt_dlp_async()
+    try:
+        # yt-dlp is synchronous, run as a job to not block event loop
+        key = ('search', SearchResultCache.normalize(query), page)
+        payload = await coalesced_job(key, search_page_payload, query, page)
+        results = [VideoResult.from_dict(data) for data in payload]
+        if results:
+            search_cache.put(query, results, page)
+        show_status_message(_search_summary_message(query, page, len(results)), 3)
+        return results
+    except yt_dlp.utils.DownloadError as e:
+        show_status_message(f"Search Error: {e}", 5, STATUS_PRIORITY_ERROR)
+    except Exception as e:
+        show_status_message(f"Unexpected Search Error: {e}", 5, STATUS_PRIORITY_ERROR)
+    return [] # Return empty list on error
+
+class InflightSearch:
+    """ A streaming extraction shared by every caller that asks for the same query and page.
+    Late subscribers get the rows extracted so far replayed, and the worker thread keeps
+    going for as long as at least one subscriber has not been cancelled. """
+
+    def __init__(self):
+        self.results = []
+        self.subscribers = []
+        self.abandoned = False
+        self.future = None
+        self._lock = threading.Lock() # wanted() runs on the executor thread
+
+    def subscribe(self, on_result, cancel_event):
+        """ Returns False if the worker already gave up, in which case a new search is needed. """
+        with self._lock:
+            if self.abandoned:
+                return False
+            self.subscribers.append((on_result, cancel_event))
+        for result in list(self.results):
+            on_result(result)
+        return True
+
+    def wanted(self):
+        with self._lock:
+            if all(cancel_event.is_set() for _, cancel_event in self.subscribers):
+                self.abandoned = True
+            return not self.abandoned
+
+    def deliver(self, result):
+        # Runs on the event loop; rows queued before a cancel are dropped here
+        self.results.append(result)
+        for on_result, cancel_event in list(self.subscribers):
+            if not cancel_event.is_set():
+                on_result(result)
+
+# In-flight work keyed by normalized request, so identical concurrent requests share one extraction
+inflight_extractions = {}
+inflight_searches = {}
+
+def _forget_inflight(registry, key, value):
+    if registry.get(key) is value:
+        del registry[key]
+
+def _ignore_task_result(task):
+    if not task.cancelled():
+        task.exception() # Mark as retrieved; nobody may be waiting on shared or speculative work any more
+
+shared_waiters = collections.Counter() # future -> callers awaiting it through await_shared
+
+async def await_shared(future):
+    """ Awaits future on behalf of one of the callers sharing it. A cancelled caller leaves it
+    running for the others, but the last one to go cancels it, so abandoned work is dropped
+    from the job queue (or stopped at its next cancellation check). """
+    shared_waiters[future] += 1
+    try:
+        return await asyncio.shield(future)
+    finally:
+        shared_waiters[future] -= 1
+        if not shared_waiters[future]:
+            del shared_waiters[future]
+            future.cancel() # No-op once it has finished
+
+async def coalesced_job(key, fn, *args):
+    """ Runs the extraction fn(*args) as a job in the current lane, shared with any identical
+    request already queued or running. A foreground caller joining queued background work
+    promotes it; the job is cancelled once every caller has been. """
+    job = inflight_extractions.get(key)
+    if job is None:
+        job = job_scheduler.submit(run_extraction, fn, *args)
+        inflight_extractions[key] = job
+        job.future.add_done_callback(lambda f: _forget_inflight(inflight_extractions, key, job))
+        job.future.add_done_callback(_ignore_task_result)
+    elif job_lane.get() == FOREGROUND:
+        job_scheduler.promote(job)
+    return await await_shared(job.future)
+
+async def search_videos_streaming_async(query, on_result, cancel_event, page=0):
+    """ Like search_videos_async, but calls on_result(result) on the event loop for each entry
+    as soon as yt-dlp yields it. Setting cancel_event stops delivery, and once every caller
+    sharing the extraction has cancelled, the executor thread stops at the next entry.
+    A cancelled search returns None. """
+    client = await connected_daemon()
+    if client is not None:
+        with contextlib.suppress(DaemonConnectionError):
+            return await client.search(query, page, on_result, cancel_event)
+    cached = search_cache.get(query, page)
+    if cached is not None:
+        for result in cached:
+            on_result(result)
+        show_status_message(f"Found {len(cached)} videos (cached).", 3)
+        return cached
+
+    if extraction_backend is not None:
+        # Entries cannot be streamed back from a worker process; deliver the page once it is ready
+        results = await search_videos_async(query, page)
+        if cancel_event.is_set():
+            return None
+        for result in results:
+            on_result(result)
+        return results
+
+    await ensure_yt_dlp_async()
+    key = (SearchResultCache.normalize(query), page)
+    inflight = inflight_searches.get(key)
+    if inflight is None or not inflight.subscribe(on_result, cancel_event):
+        show_status_message(f"Searching for: {query}...")
+        loop = asyncio.get_event_loop()
+        inflight = InflightSearch()
+        inflight.subscribe(on_result, cancel_event)
+
+        def extract():
+            start = SEARCH_PAGE_SIZE * page
+            with search_sessions.checkout(query, start) as session:
+                # Each result is handed over before the next one is extracted
+                for entry in session.read(start, SEARCH_PAGE_SIZE):
+                    if not inflight.wanted():
+                        return
+                    result = VideoResult.from_entry(entry)
+                    if result:
+                        loop.call_soon_threadsafe(inflight.deliver, result)
+
+        inflight.future = job_scheduler.submit(extract).future
+        inflight.future.add_done_callback(_ignore_task_result)
+        inflight_searches[key] = inflight
+        inflight.future.add_done_callback(lambda f: _forget_inflight(inflight_searches, key, inflight))
+
+    try:
+        await asyncio.shield(inflight.future)
+    except yt_dlp.utils.DownloadError as e:
+        show_status_message(f"Search Error: {e}", 5, STATUS_PRIORITY_ERROR)
+        return []
+    except Exception as e:
+        show_status_message(f"Unexpected Search Error: {e}", 5, STATUS_PRIORITY_ERROR)
+        return []
+
+    if cancel_event.is_set() or inflight.abandoned:
+        return None
+    results = list(inflight.results)
+    if results:
+        search_cache.put(query, results, page)
+    show_status_message(_search_summary_message(query, page, len(results)), 3)
+    return results
+
+def watch_url(video_id):
+    if '://' in video_id:
+        return video_id # A URL from another site yt-dlp supports; see parse_video_reference
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+YOUTUBE_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})')
+
+def parse_video_reference(text):
+    """ The video id in a YouTube URL, or the text itself (a bare id or another site's URL). """
+    text = text.strip()
+    match = YOUTUBE_ID_PATTERN.search(text) if '://' in text else None
+    return match.group(1) if match else text
+
+def _stream_url_from_info(info_dict):
+    if info_dict and 'url' in info_dict:
+        return info_dict['url']
+    requested = [f.get('url') for f in info_dict.get('requested_formats') or []]
+    if requested and all(requested):
+        return join_stream_urls(requested) # Separate video and audio
+    formats = info_dict.get('formats', [])
+    for f in formats:
+        if f.get('url'):
+            return f['url']
+    return None
+
+def stream_url_expiry(stream_url, info_dict=None):
+    """ Unix time at which a resolved stream URL stops working, or None if unknown. """
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(stream_url).query)
+    if query.get('expire', [''])[0].isdigit():
+        return int(query['expire'][0])
+    match = re.search(r'/expire/(\d+)', stream_url) # HLS/DASH manifest URLs carry it in the path
+    if match:
+        return int(match.group(1))
+    if info_dict and isinstance(info_dict.get('expire'), (int, float)):
+        return info_dict['expire']
+    return None
+
+async def resolve_stream_url_async(video_id):
+    """ Resolves the stream URL for video_id without touching the UI; errors propagate.
+    Concurrent resolutions of the same video (e.g. a prefetch and playback) share one extraction.
+    Returns (stream_url, expires_at). """
+    client = await connected_daemon()
+    if client is not None:
+        with contextlib.suppress(DaemonConnectionError):
+            return await client.resolve(video_id, job_lane.get())
+    target = current_playback_target()
+    return await coalesced_job(('stream', video_id, json.dumps(target, sort_keys=True)),
+                               stream_url_payload, video_id, target, bandwidth_meter.rate)
+
+async def get_stream_url_async(video_id):
+    cached = stream_url_cache.get(video_id)
+    if cached:
+        show_status_message(f"Stream ready for {video_id}.", 2)
+        return cached
+
+    show_status_message(f"Fetching stream for {video_id}...")
+    try:
+        stream_url = await stream_url_cache.resolve(video_id)
+        if stream_url:
+            show_status_message(f"Stream ready for {video_id}.", 2)
+            return stream_url
+
+        show_status_message("Could not find direct stream URL.", 3, STATUS_PRIORITY_ERROR)
+        return None
+    except Exception as e:
+        show_status_message(f"Error getting stream URL: {e}", 5, STATUS_PRIORITY_ERROR)
+        return None
+
+async def play_video_in_terminal_async(video_id):
+    show_status_message(f"Preparing video ID: {video_id}...")
+
+    # mpv is located once at startup; see MpvProbe
+    mpv = await mpv_probe.result()
+    if not mpv.available:
+        show_status_message("mpv not found. Please install mpv.", 5, STATUS_PRIORITY_ERROR)
+        # Fallback to message_dialog if status bar is too transient for critical errors
+        if application_instance: # Ensure app instance exists for dialog
+             await message_dialog(title="Error", text="mpv not found. Please install mpv to play videos.").run_async(application_instance)
+        mpv_probe.invalidate() # Look again next time, the user may install it meanwhile
+        return
+
+    stream_url = await get_stream_url_async(video_id)
+    if not stream_url:
+        show_status_message("Failed to get stream URL. Cannot play video.", 3, STATUS_PRIORITY_ERROR)
+        return
+    if MEDIA_CACHE:
+        stream_url = await media_playback_source(video_id, stream_url)
+    if STREAM_PROXY:
+        stream_url = await proxied_stream_url(video_id, stream_url)
+
+    if MPV_PERSISTENT:
+        mpv_controller.mpv_path = mpv.path
+        client = await connected_daemon()
+        try:
+            if client is not None:
+                await client.play(stream_url, title=f"VidTerm: {video_id}") # The daemon's mpv is shared
+            else:
+                await mpv_controller.loadfile(stream_url, title=f"VidTerm: {video_id}")
+            show_status_message(f"Playing {video_id} in mpv.", 3)
+            return
+        except (MpvError, DaemonError, OSError) as e:
+            if isinstance(e, OSError):
+                mpv_probe.invalidate()
+            show_status_message(f"Persistent mpv unavailable ({e}), launching mpv directly.", 3)
+
+    show_status_message(f"Starting playback: {video_id}. (mpv will take over)")
+
+    # Suspend prompt_toolkit application
+    if application_instance:
+        await application_instance.suspend_to_background()
+
+    try:
+        command = [mpv.path, stream_url, f"--title=VidTerm: {video_id}"]
+        vo = playback_vo(mpv)
+        if vo:
+            command.append(f"--vo={vo}")
+        mpv_process = await asyncio.create_subprocess_exec(*command)
+        await mpv_process.wait() # Wait for mpv to exit
+    except OSError: # mpv was removed or replaced since it was probed
+        mpv_probe.invalidate()
+        show_status_message("mpv not found. Please install mpv.", 5, STATUS_PRIORITY_ERROR)
+    except Exception as e:
+        show_status_message(f"Error during playback: {e}", 5, STATUS_PRIORITY_ERROR)
+    finally:
+        # Resume prompt_toolkit application
+        if application_instance:
+            # application_instance.reset() # Reset UI state if needed
+            application_instance.renderer.clear() # Clear screen before resuming
+            await application_instance.resume_from_background()
+        show_status_message(get_default_status_text(), 3)
+
+
+# --- mpv capability probe ---
+
+class MpvProbe:
+    """ Locates mpv and records its version, video outputs and hwdec options. The probe runs
+    once in the background at startup; playback awaits the cached result, and invalidate()
+    makes the next caller probe again (done when launching mpv fails). """
+
+    def __init__(self):
+        self.path = None
+        self.version = None
+        self.vos = []
+        self.hwdecs = []
+        self._task = None
+
+    @property
+    def available(self):
+        return self.path is not None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._probe())
+        return self._task
+
+    async def result(self):
+        await asyncio.shield(self.start())
+        return self
+
+    def invalidate(self):
+        self._task = None
+
+    @staticmethod
+    def parse_version(output):
+        match = re.match(r'\s*mpv\s+v?(\S+)', output)
+        return match.group(1) if match else None
+
+    @staticmethod
+    def parse_help_list(output):
+        """ Option names from mpv's '--vo=help' / '--hwdec=help' listings (the indented lines). """
+        return [line.split()[0] for line in output.splitlines() if line[:1].isspace() and line.strip()]
+
+    async def _run(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            self.path, *args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        stdout, _ = await process.communicate()
+        return stdout.decode(errors='replace')
+
+    async def _probe(self):
+        self.path = shutil.which('mpv')
+        self.version, self.vos, self.hwdecs = None, [], []
+        if self.path is None:
+            return
+        try:
+            version, vos, hwdecs = await asyncio.gather(self._run('--version'), self._run('--vo=help'), self._run('--hwdec=help'))
+        except OSError:
+            self.path = None
+            return
+        self.version = self.parse_version(version)
+        self.vos = self.parse_help_list(vos)
+        self.hwdecs = self.parse_help_list(hwdecs)
+
+mpv_probe = MpvProbe()
+
+# --- Stream format selection ---
+
+TERMINAL_VOS = ('tct', 'sixel', 'kitty', 'caca') # mpv outputs that draw into the terminal
+
+def split_stream_url(stream_url):
+    """ The URLs of the streams in stream_url: just stream_url, or the tracks of an edl:// URL
+    made by join_stream_urls. """
+    if not stream_url.startswith('edl://'):
+        return [stream_url]
+    urls, rest = [], stream_url[len('edl://'):]
+    while rest:
+        if rest.startswith('%'): # %length%url
+            length, _, rest = rest[1:].partition('%')
+            urls.append(rest[:int(length)])
+            rest = rest[int(length):]
+        else: # A header such as !new_stream
+            _, _, rest = rest.partition(';')
+            continue
+        rest = rest[1:] if rest.startswith(';') else rest
+    return urls
+
+def join_stream_urls(urls):
+    """ One URL mpv can open for several streams played together (e.g. video and audio
+    tracks): an edl:// URL with one stream per URL. """
+    if len(urls) == 1:
+        return urls[0]
+    return 'edl://' + ';!new_stream;'.join(f"!no_clip;!no_chapters;%{len(url.encode())}%{url}" for url in urls)
+
+def playback_vo(mpv=None, environ=os.environ):
+    """ The mpv video output VidTerm plays with: a window when there is a display to open it on,
+    otherwise the best terminal output mpv supports (see TERMINAL_VOS). None leaves it to mpv. """
+    if MPV_VO != 'auto':
+        return MPV_VO
+    if MPV_PERSISTENT:
+        return None # Always plays in its own window
+    local = not (environ.get('SSH_CONNECTION') or environ.get('SSH_TTY'))
+    if local and (environ.get('DISPLAY') or environ.get('WAYLAND_DISPLAY') or sys.platform == 'darwin'):
+        return None
+    vos = mpv.vos if mpv is not None else []
+    for vo in (detect_graphics_protocol(environ), 'tct'):
+        if vo in vos:
+            return vo
+    return None
+
+def terminal_playback_target(mpv=None, environ=os.environ):
+    """ What the next playback is drawn on: {'vo', 'width', 'height'} with the size in pixels.
+    Terminal outputs get the terminal's size (tct draws two pixels per cell), windows
+    FORMAT_WINDOW_SIZE. """
+    vo = playback_vo(mpv_probe if mpv is None else mpv, environ)
+    if vo not in TERMINAL_VOS:
+        width, height = FORMAT_WINDOW_SIZE
+    else:
+        columns, rows = shutil.get_terminal_size()
+        if vo in ('tct', 'caca'):
+            width, height = columns, rows * 2
+        else:
+            cell_width, cell_height = terminal_cell_size()
+            width, height = columns * cell_width, rows * cell_height
+    return {'vo': vo or 'gpu', 'width': width, 'height': height}
+
+# The target of the current daemon request; otherwise this process's own terminal, if it runs the TUI
+requested_playback_target = contextvars.ContextVar('requested_playback_target', default=None)
+playback_target_source = None
+
+def current_playback_target():
+    """ The target streams are resolved for, or None to take yt-dlp's own pick (headless use). """
+    target = requested_playback_target.get()
+    if target is None and playback_target_source is not None:
+        target = playback_target_source()
+    return target
+
+def playback_target_rung(target):
+    """ The height on FORMAT_HEIGHTS that select_stream_formats settles on for target, or None
+    for no target. Targets on the same rung get the same streams, so resizing the terminal
+    by a few cells keeps cached stream URLs. """
+    if target is None:
+        return None
+    for height in FORMAT_HEIGHTS:
+        if height * 16 // 9 >= target['width'] or height >= target['height']:
+            return height
+    return FORMAT_HEIGHTS[-1]
+
+def format_kbps(f, duration=None):
+    """ A format's bitrate in kbit/s, from what yt-dlp reports or estimated from its size. """
+    if f.get('tbr'):
+        return f['tbr']
+    if f.get('vbr') or f.get('abr'):
+        return (f.get('vbr') or 0) + (f.get('abr') or 0)
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size and duration:
+        return size * 8 / 1000 / duration
+    return (f.get('width') or 0) * (f.get('height') or 0) / 1000 # Roughly 1 kbit/s per 1000 pixels
+
+def decode_cost(f):
+    codec = (f.get('vcodec') or '').split('.')[0]
+    return CODEC_DECODE_COST.get(codec, max(CODEC_DECODE_COST.values()))
+
+def select_stream_formats(formats, target, bandwidth=None, duration=None):
+    """ Picks the cheapest streams that still fill target ({'width', 'height'} in pixels): the
+    lowest resolution that covers it (or the highest there is), among streams whose bitrate the
+    measured bandwidth (bytes/s) sustains with FORMAT_BANDWIDTH_HEADROOM. At that resolution the
+    candidate with the lowest bitrate weighted by CODEC_DECODE_COST wins; a video-only stream
+    plus the cheapest audio stream competes with streams that carry both. Returns [video] or
+    [video, audio], or [] if there is no direct HTTP stream (e.g. only HLS manifests). """
+    direct = [f for f in formats if f.get('url') and f.get('protocol', 'https') in ('http', 'https')]
+    audio_only = [f for f in direct if f.get('vcodec') == 'none' and f.get('acodec') != 'none']
+    adequate_audio = [f for f in audio_only if format_kbps(f, duration) >= FORMAT_MIN_AUDIO_KBPS]
+    audio = (min(adequate_audio, key=lambda f: format_kbps(f, duration)) if adequate_audio else
+             max(audio_only, key=lambda f: format_kbps(f, duration), default=None))
+    candidates = []
+    for f in direct:
+        if f.get('vcodec') == 'none' or not f.get('height'):
+            continue
+        if f.get('acodec') != 'none':
+            candidates.append([f])
+        elif audio is not None:
+            candidates.append([f, audio])
+    if not candidates:
+        return []
+
+    def kbps(streams):
+        return sum(format_kbps(f, duration) for f in streams)
+
+    def fills(video):
+        width = video.get('width') or video['height'] * 16 // 9
+        return width >= target['width'] or video['height'] >= target['height']
+
+    affordable = [c for c in candidates if not bandwidth or kbps(c) * 1000 / 8 * FORMAT_BANDWIDTH_HEADROOM <= bandwidth]
+    pool = affordable or [min(candidates, key=kbps)]
+    adequate = [c for c in pool if fills(c[0])]
+    height = min(c[0]['height'] for c in adequate) if adequate else max(c[0]['height'] for c in pool)
+    return min((c for c in pool if c[0]['height'] == height),
+               key=lambda c: format_kbps(c[0], duration) * decode_cost(c[0]) + kbps(c[1:]))
+
+class BandwidthMeter:
+    """ Smoothed throughput of a single download connection in bytes per second, measured on
+    the media cache's and the stream proxy's transfers. Feeds format selection. """
+
+    def __init__(self, smoothing=0.3, min_bytes=256 * 1024):
+        self.smoothing = smoothing
+        self.min_bytes = min_bytes # Smaller transfers mostly measure latency
+        self.rate = None
+
+    def record(self, size, seconds):
+        if size < self.min_bytes or seconds <= 0:
+            return
+        sample = size / seconds
+        self.rate = sample if self.rate is None else self.rate + self.smoothing * (sample - self.rate)
+
+bandwidth_meter = BandwidthMeter()
+
+# --- Persistent mpv controller ---
+
+class MpvError(Exception):
+    """ Raised when mpv rejects an IPC command or cannot be reached over IPC. """
+
+class MpvController:
+    """ Keeps a single idle mpv process running and drives it over its JSON IPC socket, so that
+    playing a video is a 'loadfile' command rather than a new mpv launch. Property observers and
+    event handlers survive mpv restarts. """
+
+    def __init__(self, mpv_path='mpv', extra_args=()):
+        self.mpv_path = mpv_path
+        self.extra_args = list(extra_args)
+        self.socket_path = None # Inside a private directory that start() creates
+        self._socket_dir = None
+        self.process = None
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._request_ids = itertools.count(1)
+        self._pending = {}
+        self._observer_ids = itertools.count(1)
+        self._observers = {} # observer id -> (property name, callback(name, value))
+        self._event_handlers = collections.defaultdict(list)
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def start(self):
+        """ Starts mpv in idle mode and connects to it, unless it is already running. """
+        if self.connected:
+            return # The IPC connection drops when mpv exits
+        await self.close()
+        if self.socket_path is None:
+            # mkdtemp's directory is 0700: at a predictable path in the shared temp directory,
+            # another user could bind the socket first and receive every command
+            self._socket_dir = tempfile.mkdtemp(prefix='vidterm-mpv-')
+            self.socket_path = os.path.join(self._socket_dir, 'mpv.sock')
+        self.process = await asyncio.create_subprocess_exec(
+            self.mpv_path, '--idle=yes', '--force-window=yes', '--no-terminal',
+            f'--input-ipc-server={self.socket_path}', *self.extra_args,
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        await self.connect()
+
+    async def connect(self, timeout=MPV_IPC_CONNECT_TIMEOUT):
+        """ Connects to the IPC socket, waiting for mpv to create it. """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if (self.process and self.process.returncode is not None) or loop.time() > deadline:
+                    raise MpvError(f"mpv did not open its IPC socket at {self.socket_path}")
+                await asyncio.sleep(0.05)
+        self._read_task = asyncio.create_task(self._read_loop())
+        for observer_id, (name, _) in self._observers.items():
+            await self.command('observe_property', observer_id, name)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self._reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except ValueError:
+                    continue
+                self._dispatch(message)
+        finally:
+            self._writer = None
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(MpvError("mpv IPC connection closed"))
+            self._pending.clear()
+
+    def _dispatch(self, message):
+        event = message.get('event')
+        if event is None:
+            future = self._pending.pop(message.get('request_id'), None)
+            if future and not future.done():
+                if message.get('error') == 'success':
+                    future.set_result(message.get('data'))
+                else:
+                    future.set_exception(MpvError(message.get('error')))
+            return
+        if event == 'property-change':
+            observer = self._observers.get(message.get('id'))
+            if observer:
+                observer[1](message.get('name'), message.get('data'))
+        for handler in list(self._event_handlers[event]):
+            handler(message)
+
+    async def command(self, *args):
+        """ Sends an IPC command and returns its 'data', raising MpvError if mpv reports an error. """
+        if not self.connected:
+            raise MpvError("mpv is not running")
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        self._writer.write(json.dumps({'command': list(args), 'request_id': request_id}).encode() + b'\n')
+        await self._writer.drain()
+        return await future
+
+    async def observe_property(self, name, callback):
+        """ Calls callback(name, value) whenever the mpv property changes (e.g. 'time-pos',
+        'pause', 'demuxer-cache-state'). Returns an id for unobserve_property. """
+        observer_id = next(self._observer_ids)
+        self._observers[observer_id] = (name, callback)
+        if self.connected:
+            await self.command('observe_property', observer_id, name)
+        return observer_id
+
+    async def unobserve_property(self, observer_id):
+        if self._observers.pop(observer_id, None) and self.connected:
+            await self.command('unobserve_property', observer_id)
+
+    def on_event(self, event, handler):
+        """ Calls handler(message) for every mpv event of this name (e.g. 'end-file'). """
+        self._event_handlers[event].append(handler)
+
+    async def loadfile(self, url, title=None):
+        await self.start()
+        if title:
+            await self.command('set_property', 'force-media-title', title)
+        await self.command('loadfile', url, 'replace')
+
+    async def close(self):
+        if self.connected:
+            with contextlib.suppress(MpvError, OSError, asyncio.TimeoutError):
+                await asyncio.wait_for(self.command('quit'), 1)
+        if self._read_task:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self.process and self.process.returncode is None:
+            self.process.terminate()
+            await self.process.wait()
+        self.process = None
+        if self.socket_path is not None:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+        if self._socket_dir is not None:
+            with contextlib.suppress(OSError):
+                os.rmdir(self._socket_dir)
+            self._socket_dir = self.socket_path = None
+
+mpv_controller = MpvController()
+# Last known state of the persistent mpv player, fed by property observers
+playback_state = {'time-pos': None, 'duration': None, 'pause': False, 'demuxer-cache-state': None}
+
+# --- Stream URL cache ---
+
+class StreamUrlCache:
+    """ In-memory cache of resolved stream URLs that honours their expiry. Entries are not
+    served once they are within STREAM_URL_EXPIRY_MARGIN of expiring, or to a lookup for a
+    playback target on another resolution rung (see playback_target_rung), and recently
+    used entries are re-resolved in the background shortly before that happens. """
+
+    class Entry:
+        __slots__ = ('url', 'expires_at', 'latency', 'last_used', 'target')
+
+        def __init__(self, url, expires_at, latency, last_used, target=None):
+            self.url = url
+            self.expires_at = expires_at
+            self.latency = latency # Seconds the extraction took, i.e. what a hit saves
+            self.last_used = last_used
+            self.target = target # The playback target the streams were chosen for
+
+    def __init__(self, resolver, max_entries=STREAM_URL_CACHE_MAX_ENTRIES):
+        self.resolver = resolver
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.latency_saved = 0.0
+        self._refresh_timers = {}
+
+    def _valid(self, entry, now):
+        # A URL chosen for a much smaller or larger picture is a miss, not a stale hit
+        return (entry.expires_at - STREAM_URL_EXPIRY_MARGIN > now
+                and playback_target_rung(entry.target) == playback_target_rung(current_playback_target()))
+
+    def peek(self, video_id):
+        """ Returns a valid cached URL for the current playback target without counting a lookup. """
+        entry = self.entries.get(video_id)
+        return entry.url if entry and self._valid(entry, time.time()) else None
+
+    def invalidate(self, video_id):
+        """ Forgets video_id's URL, e.g. because the server no longer accepts it. """
+        self.entries.pop(video_id, None)
+        self._cancel_refresh(video_id)
+
+    def get(self, video_id):
+        now = time.time()
+        entry = self.entries.get(video_id)
+        if entry is None or not self._valid(entry, now):
+            self.misses += 1
+            return None
+        entry.last_used = now
+        self.entries.move_to_end(video_id)
+        self.hits += 1
+        self.latency_saved += entry.latency
+        return entry.url
+
+    def put(self, video_id, url, latency, expires_at=None, target=None):
+        now = time.time()
+        expires_at = expires_at or now + STREAM_URL_DEFAULT_TTL
+        previous = self.entries.pop(video_id, None)
+        last_used = previous.last_used if previous else now
+        self.entries[video_id] = self.Entry(url, expires_at, latency, last_used, target)
+        while len(self.entries) > self.max_entries:
+            evicted, _ = self.entries.popitem(last=False)
+            self._cancel_refresh(evicted)
+        self._schedule_refresh(video_id, expires_at - STREAM_URL_REFRESH_BEFORE - now)
+
+    async def resolve(self, video_id):
+        """ Returns a valid URL for video_id, from the cache or freshly resolved and cached. """
+        cached = self.peek(video_id)
+        if cached:
+            return cached
+        started = time.monotonic()
+        url, expires_at = await self.resolver(video_id)
+        if url:
+            self.put(video_id, url, time.monotonic() - started, expires_at, current_playback_target())
+        return url
+
+    async def renew(self, video_id):
+        """ Resolves video_id again for the same playback target, e.g. because the server no
+        longer accepts its URL. """
+        entry = self.entries.get(video_id)
+        token = requested_playback_target.set(entry.target if entry else requested_playback_target.get())
+        try:
+            self.invalidate(video_id)
+            return await self.resolve(video_id)
+        finally:
+            requested_playback_target.reset(token)
+
+    def _schedule_refresh(self, video_id, delay):
+        self._cancel_refresh(video_id)
+        if delay <= 0:
+            return # Too short-lived to refresh ahead of time
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return # Nothing to refresh with outside the event loop
+        self._refresh_timers[video_id] = loop.call_later(
+            delay, lambda: asyncio.ensure_future(self._refresh(video_id)))
+
+    def _cancel_refresh(self, video_id):
+        timer = self._refresh_timers.pop(video_id, None)
+        if timer:
+            timer.cancel()
+
+    async def _refresh(self, video_id):
+        job_lane.set(BACKGROUND) # Only affects this task
+        self._refresh_timers.pop(video_id, None)
+        entry = self.entries.get(video_id)
+        if entry is None or time.time() - entry.last_used > STREAM_URL_KEEP_WARM:
+            return # Not worth another extraction; it will be resolved again on demand
+        requested_playback_target.set(entry.target)
+        started = time.monotonic()
+        try:
+            url, expires_at = await self.resolver(video_id)
+        except Exception:
+            return
+        if url:
+            self.refreshes += 1
+            self.put(video_id, url, time.monotonic() - started, expires_at, entry.target)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'refreshes': self.refreshes,
+            'latency_saved': self.latency_saved,
+            'entries': len(self.entries),
+        }
+
+    def close(self):
+        for video_id in list(self._refresh_timers):
+            self._cancel_refresh(video_id)
+
+stream_url_cache = StreamUrlCache(lambda video_id: resolve_stream_url_async(video_id))
+
+# --- Stream URL prefetching ---
+
+class StreamPrefetcher:
+    """ Speculatively resolves stream URLs into stream_url_cache for the top results and,
+    after a short dwell, for the highlighted result, so that playback can start from an
+    already resolved URL.
+    Prefetches for results that are no longer relevant are cancelled. """
+
+    def __init__(self, dwell=PREFETCH_DWELL, top_n=PREFETCH_TOP_N):
+        self.dwell = dwell
+        self.top_n = top_n
+        self._tasks = {}
+
+    def update(self, highlighted_id, result_ids):
+        """ Re-targets prefetching at the highlighted result and the first top_n of result_ids. """
+        top_ids = list(result_ids[:self.top_n])
+        relevant = set(top_ids)
+        if highlighted_id:
+            relevant.add(highlighted_id)
+        for video_id, task in list(self._tasks.items()):
+            if video_id not in relevant:
+                task.cancel()
+        for video_id in top_ids:
+            self._schedule(video_id, 0)
+        if highlighted_id:
+            self._schedule(highlighted_id, self.dwell)
+
+    def _schedule(self, video_id, delay):
+        if video_id in self._tasks or stream_url_cache.peek(video_id):
+            return
+        task = asyncio.create_task(self._prefetch(video_id, delay))
+        self._tasks[video_id] = task
+        task.add_done_callback(lambda t: _forget_inflight(self._tasks, video_id, t))
+
+    async def _prefetch(self, video_id, delay):
+        job_lane.set(BACKGROUND) # Only affects this task
+        if delay:
+            await asyncio.sleep(delay) # Cancelled here if the selection moves on
+        try:
+            await stream_url_cache.resolve(video_id)
+        except Exception:
+            pass # Speculative; playback will retry and report the error
+
+    def cancel_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+stream_prefetcher = StreamPrefetcher()
+
+# --- Media cache ---
+
+class MediaDownloadError(Exception):
+    pass
+
+def fetch_byte_range(url, start, end, timeout=MEDIA_FETCH_TIMEOUT):
+    """ GETs bytes start..end (inclusive) of url. Returns (data, total size). Blocking. """
+    request = urllib.request.Request(url, headers={'Range': f'bytes={start}-{end}', 'User-Agent': 'Mozilla/5.0'})
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            content_range = response.headers.get('Content-Range', '')
+            if response.status != 206 or '/' not in content_range:
+                raise MediaDownloadError("server does not support range requests")
+            total = content_range.rsplit('/', 1)[1]
+            data = response.read()
+            bandwidth_meter.record(len(data), time.monotonic() - started)
+            return data, int(total) if total.isdigit() else None
+    except urllib.error.HTTPError as e:
+        if e.code in (403, 410):
+            raise MediaDownloadError("stream URL expired") from e
+        raise
+
+def cache_file_name(video_id):
+    # Hash so that URL references (see parse_video_reference) make safe file names
+    return video_id if re.fullmatch(r'[\w-]+', video_id) else hashlib.sha1(video_id.encode()).hexdigest()
+
+class MediaCache:
+    """ Played videos on disk under a size budget. A download fetches MEDIA_DOWNLOAD_CONNECTIONS
+    fragments at a time with HTTP range requests but appends them to the file in order, so the
+    file is always a playable prefix of the video: an interrupted download resumes from the
+    file's size, and a download in progress can be played through mpv's appending:// protocol.
+    Entries live in an index file, so nothing is scanned at startup; when the budget is
+    exceeded, complete entries are evicted least recently (or least often) played first. """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES, eviction=MEDIA_CACHE_EVICTION,
+                 resolver=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.resolver = resolver # async video_id -> (stream_url, expires_at), for expired URLs
+        self.index_path = os.path.join(directory, 'index.json')
+        self.entries = None # video_id -> {'size', 'total', 'complete', 'last_used', 'uses'}
+        self._downloads = {}
+        self._executor = None
+
+    def _load(self):
+        if self.entries is None:
+            try:
+                with open(self.index_path) as f:
+                    self.entries = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        partial = f"{self.index_path}.part"
+        with open(partial, 'w') as f:
+            json.dump(self._load(), f, separators=(',', ':'))
+        os.replace(partial, self.index_path)
+
+    def path(self, video_id):
+        return os.path.join(self.directory, f"{cache_file_name(video_id)}.media")
+
+    def _entry(self, video_id):
+        """ The index entry for video_id, dropped if its file went missing. """
+        entry = self._load().get(video_id)
+        if entry is not None and not os.path.exists(self.path(video_id)):
+            del self.entries[video_id]
+            entry = None
+        return entry
+
+    def playback_source(self, video_id, stream_url):
+        """ What mpv should open for video_id: the cached file, the partial file while the
+        (re)started download appends to it, or stream_url while nothing is on disk yet. """
+        entry = self._entry(video_id)
+        if entry is None:
+            entry = self.entries[video_id] = {'size': 0, 'total': None, 'complete': False, 'last_used': 0, 'uses': 0}
+        entry['last_used'] = time.time()
+        entry['uses'] += 1
+        self.save_index()
+        if entry['complete']:
+            return self.path(video_id)
+        if len(split_stream_url(stream_url)) > 1:
+            return stream_url # Separate video and audio streams cannot be appended to one file
+        self.download(video_id, stream_url) # Resumes a partial file left by an earlier session
+        if entry['size']:
+            return f"appending://{self.path(video_id)}"
+        return stream_url
+
+    def download(self, video_id, stream_url):
+        if video_id in self._downloads:
+            return self._downloads[video_id]
+        task = asyncio.ensure_future(self._download(video_id, stream_url))
+        self._downloads[video_id] = task
+        task.add_done_callback(lambda t: _forget_inflight(self._downloads, video_id, t))
+        task.add_done_callback(_ignore_task_result)
+        return task
+
+    def _pool(self):
+        if self._executor is None:
+            # Downloads are long transfers; own threads keep them out of the job lanes
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MEDIA_DOWNLOAD_CONNECTIONS * 2, thread_name_prefix='vidterm-media')
+        return self._executor
+
+    async def _download(self, video_id, url):
+        loop = asyncio.get_running_loop()
+        entry = self._load()[video_id]
+        path = self.path(video_id)
+        os.makedirs(self.directory, exist_ok=True)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if not entry['total'] and offset:
+            offset = 0 # Cannot tell what the partial file belongs to
+        in_flight = collections.deque()
+        next_start = offset
+        with open(path, 'r+b' if offset else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            try:
+                while entry['total'] is None or offset < entry['total']:
+                    while len(in_flight) < MEDIA_DOWNLOAD_CONNECTIONS and (
+                            next_start == offset or (entry['total'] is not None and next_start < entry['total'])):
+                        end = next_start + MEDIA_FRAGMENT_SIZE - 1
+                        in_flight.append((end, loop.run_in_executor(self._pool(), fetch_byte_range, url, next_start, end)))
+                        next_start = end + 1
+                    end, fetch = in_flight.popleft()
+                    try:
+                        data, total = await fetch
+                    except MediaDownloadError as e:
+                        if str(e) != "stream URL expired" or self.resolver is None:
+                            raise
+                        for _, fetch in in_flight:
+                            fetch.cancel()
+                        in_flight.clear()
+                        url, _ = await self.resolver(video_id)
+                        next_start = offset
+                        continue
+                    if entry['total'] not in (None, total):
+                        # The partial file is of another format (e.g. one chosen for another size); start over
+                        for _, fetch in in_flight:
+                            fetch.cancel()
+                        in_flight.clear()
+                        f.seek(0)
+                        f.truncate(0)
+                        offset = next_start = 0
+                        entry['size'], entry['total'] = 0, None
+                        self.save_index()
+                        continue
+                    entry['total'] = total
+                    if len(data) != min(end + 1, total) - offset:
+                        raise MediaDownloadError("short fragment") # Appending it would shift everything after
+                    await loop.run_in_executor(self._pool(), f.write, data)
+                    offset += len(data)
+                    entry['size'] = offset
+                    if offset // MEDIA_FRAGMENT_SIZE % 16 == 0:
+                        self.save_index() # Progress survives a crash; resuming relies on the file size anyway
+                    self.enforce_budget(keep=video_id)
+            except BaseException:
+                for _, fetch in in_flight:
+                    fetch.cancel()
+                raise
+            finally:
+                self.save_index()
+        entry['complete'] = True
+        self.save_index()
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self._load().values())
+
+    def enforce_budget(self, keep=None):
+        """ Deletes cached videos until the cache fits max_bytes; never one being downloaded. """
+        if self.eviction == 'lfu':
+            order = lambda item: (item[1]['uses'], item[1]['last_used'])
+        else:
+            order = lambda item: item[1]['last_used']
+        total = self.total_bytes()
+        for video_id, entry in sorted(self._load().items(), key=order):
+            if total <= self.max_bytes:
+                break
+            if video_id == keep or video_id in self._downloads:
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path(video_id))
+            total -= entry['size']
+            del self.entries[video_id]
+
+    def stats(self):
+        entries = self._load()
+        return {'entries': len(entries), 'bytes': self.total_bytes(), 'max_bytes': self.max_bytes,
+                'complete': sum(1 for entry in entries.values() if entry['complete']),
+                'downloading': len(self._downloads)}
+
+    def close(self):
+        for task in list(self._downloads.values()):
+            task.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        if self.entries is not None:
+            with contextlib.suppress(OSError):
+                self.save_index()
+
+media_cache = MediaCache(resolver=lambda video_id: resolve_stream_url_async(video_id))
+
+async def media_playback_source(video_id, stream_url):
+    """ MediaCache.playback_source, in the daemon when there is one (it owns the cache). """
+    client = await connected_daemon()
+    if client is not None:
+        with contextlib.suppress(DaemonConnectionError):
+            return await client.request('media_source', video_id=video_id, url=stream_url)
+    return media_cache.playback_source(video_id, stream_url)
+
+# --- Stream proxy ---
+
+class UpstreamError(Exception):
+    pass
+
+class UpstreamResponse:
+    """ An upstream response whose headers have arrived. Its connection goes back to the pool on
+    release() only if the body was read to the end. """
+
+    def __init__(self, pool, key, reader, writer, status, headers, keep_alive):
+        self.pool = pool
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers # Lower-cased names
+        self.length = int(headers['content-length']) if headers.get('content-length', '').isdigit() else None
+        self.chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        self.keep_alive = keep_alive and (self.length is not None or self.chunked)
+        self.finished = False
+
+    def total_size(self):
+        """ The full size of the resource from Content-Range, or None. """
+        total = self.headers.get('content-range', '').rsplit('/', 1)[-1]
+        return int(total) if total.isdigit() else None
+
+    async def chunks(self, size=64 * 1024):
+        timeout = self.pool.timeout
+        if self.chunked:
+            while True:
+                length = int((await asyncio.wait_for(self.reader.readline(), timeout)).split(b';')[0], 16)
+                if length == 0:
+                    while (await asyncio.wait_for(self.reader.readline(), timeout)) not in (b'\r\n', b'\n', b''):
+                        pass # Trailers
+                    break
+                yield await asyncio.wait_for(self.reader.readexactly(length), timeout)
+                await asyncio.wait_for(self.reader.readline(), timeout)
+        else:
+            remaining = self.length
+            while remaining is None or remaining > 0:
+                data = await asyncio.wait_for(self.reader.read(size if remaining is None else min(size, remaining)), timeout)
+                if not data:
+                    if remaining is None:
+                        break # Delimited by the connection closing
+                    raise UpstreamError("upstream closed the connection mid-response")
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+        self.finished = True
+
+    def release(self):
+        if self.writer is None:
+            return
+        if self.finished and self.keep_alive:
+            self.pool.put_back(self.key, self.reader, self.writer)
+        else:
+            self.writer.close()
+        self.writer = None
+
+class UpstreamPool:
+    """ Keep-alive HTTP/1.1 connections to stream origins. The range requests for one video all go
+    to the same host, so reusing connections saves a TCP and TLS handshake on each of them. """
+
+    def __init__(self, max_idle=STREAM_PROXY_IDLE_CONNECTIONS, timeout=MEDIA_FETCH_TIMEOUT):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = collections.defaultdict(list) # (scheme, host, port) -> [(reader, writer)]
+        self.opened = 0
+        self.reused = 0
+
+    def put_back(self, key, reader, writer):
+        idle = self._idle[key]
+        if len(idle) < self.max_idle and not writer.is_closing():
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    async def _connection(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                self.reused += 1
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=(scheme == 'https') or None), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"cannot connect to {host}: {e or type(e).__name__}") from e
+        self.opened += 1
+        return reader, writer, False
+
+    async def get(self, url, start, end, redirects=5):
+        """ GETs bytes start..end (inclusive) of url, following redirects, and returns the
+        UpstreamResponse as soon as its headers are in. The caller must release() it. """
+        for _ in range(redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            scheme = parts.scheme.lower()
+            if scheme not in ('http', 'https') or not parts.hostname:
+                raise UpstreamError(f"cannot proxy {url!r}")
+            key = (scheme, parts.hostname, parts.port or (443 if scheme == 'https' else 80))
+            target = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+            request = (f"GET {target} HTTP/1.1\r\nHost: {parts.netloc.rsplit('@', 1)[-1]}\r\n"
+                       f"User-Agent: Mozilla/5.0\r\nRange: bytes={start}-{end}\r\n"
+                       "Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n")
+            response = await self._send(key, request.encode('latin-1'))
+            if response.status in (301, 302, 303, 307, 308) and 'location' in response.headers:
+                response.release()
+                url = urllib.parse.urljoin(url, response.headers['location'])
+                continue
+            return response
+        raise UpstreamError("too many redirects")
+
+    async def _send(self, key, request):
+        while True:
+            reader, writer, reused = await self._connection(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if not status_line:
+                    raise ConnectionResetError("connection closed")
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+            except (OSError, asyncio.TimeoutError) as e:
+                writer.close()
+                if reused:
+                    continue # The server dropped the idle connection meanwhile; open a new one
+                raise UpstreamError(f"upstream request failed: {e or type(e).__name__}") from e
+            except BaseException:
+                writer.close()
+                raise
+            version, _, rest = status_line.decode('latin-1').partition(' ')
+            if not rest[:3].isdigit():
+                writer.close()
+                raise UpstreamError("malformed upstream response")
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            return UpstreamResponse(self, key, reader, writer, int(rest[:3]), headers, keep_alive)
+
+    def close(self):
+        for idle in self._idle.values():
+            for _, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+class SegmentStore:
+    """ The fetched blocks of one stream, kept at their own offsets in a sparse file. Which
+    blocks are present is recorded in the stream's entry in the proxy's index. """
+
+    def __init__(self, path, entry, block_size):
+        self.path = path
+        self.entry = entry # {'total', 'content_type', 'blocks', 'last_used'}
+        self.block_size = block_size
+        self.blocks = set(entry['blocks']) if os.path.exists(path) else set()
+        self.pending = {} # block index -> future resolved once the block is stored
+        self._file = None
+
+    @property
+    def total(self):
+        return self.entry['total']
+
+    def block_count(self):
+        return -(-self.total // self.block_size)
+
+    def _open(self):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+        return self._file
+
+    def read(self, start, end):
+        f = self._open()
+        f.seek(start)
+        return f.read(end - start + 1)
+
+    def write(self, offset, data):
+        f = self._open()
+        f.seek(offset) # Seeking past the end leaves a hole, which takes no disk space
+        f.write(data)
+
+    def reset(self, total):
+        """ Drops every block, e.g. because the stream now has a different size (another format). """
+        self.blocks.clear()
+        self._open().truncate(0)
+        self.entry['total'] = total
+
+    def size(self):
+        return len(self.blocks) * self.block_size
+
+    def sync(self):
+        self.entry['blocks'] = sorted(self.blocks)
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class StreamProxy:
+    """ Local HTTP server between mpv and the stream origin. mpv opens
+    http://127.0.0.1:<port>/<token>/<video_id> and sends range requests as it plays and seeks.
+    The random token keeps other local users out, and only videos registered for playback are
+    served, so nobody else can make this process extract or fetch URLs of their choosing. Blocks
+    already in the video's SegmentStore are served from disk; missing ones are fetched upstream,
+    STREAM_PROXY_READAHEAD blocks per request over pooled connections, and each is sent on as soon
+    as it is stored. When the upstream URL has expired, it is resolved again and the fetch retried.
+    Streams are listed in an index file and evicted least recently played first beyond max_bytes. """
+
+    def __init__(self, resolver, directory=STREAM_PROXY_DIR, max_bytes=STREAM_PROXY_MAX_BYTES,
+                 block_size=STREAM_PROXY_BLOCK_SIZE, readahead=STREAM_PROXY_READAHEAD):
+        self.resolver = resolver # async (video_id, refresh) -> stream URL; refresh after a rejection
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.readahead = readahead
+        self.index_path = os.path.join(directory, 'index.json')
+        self.entries = None # video_id -> SegmentStore entry
+        self.stores = {}
+        self.registered = {} # video_id -> (playback target, status message sink); see register
+        self.token = secrets.token_urlsafe(16)
+        self.pool = UpstreamPool()
+        self.port = None
+        self.served_from_disk = 0
+        self.fetched = 0
+        self._starting = None
+        self._server = None
+        self._clients = set()
+        self._fetches = set()
+
+    async def start(self):
+        if self._starting is None:
+            # In a fresh context: connection handlers inherit the context the server was started
+            # in, and the playback target and status sink of whichever request started it are
+            # not theirs
+            self._starting = contextvars.Context().run(
+                asyncio.ensure_future, asyncio.start_server(self._serve_client, '127.0.0.1', 0))
+        self._server = await asyncio.shield(self._starting)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    def register(self, video_id, target, status_sink=None):
+        """ Allows video_id to be served, with its streams chosen for the playback target and
+        errors reported to status_sink. mpv's requests carry neither, and with a daemon the
+        proxy serves several terminals. """
+        self.registered[video_id] = (target, status_sink)
+
+    def url_for(self, video_id, track=0):
+        """ The URL of track (see split_stream_url) of video_id's stream. """
+        path = urllib.parse.quote(video_id, safe='')
+        return f"http://127.0.0.1:{self.port}/{self.token}/{path}" + (f"/{track}" if track else '')
+
+    @staticmethod
+    def stream_key(video_id, track):
+        return f"{video_id}\n{track}" if track else video_id
+
+    def _load(self):
+        if self.entries is None:
+            try:
+                with open(self.index_path) as f:
+                    self.entries = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self.entries = {}
+            if any(entry.get('block_size') != self.block_size for entry in self.entries.values()):
+                self.entries = {} # Written with another block size; the files are overwritten as needed
+        return self.entries
+
+    def save_index(self):
+        for store in self.stores.values():
+            store.sync()
+        os.makedirs(self.directory, exist_ok=True)
+        partial = f"{self.index_path}.part"
+        with open(partial, 'w') as f:
+            json.dump(self._load(), f, separators=(',', ':'))
+        os.replace(partial, self.index_path)
+
+    def store(self, key):
+        store = self.stores.get(key)
+        if store is None:
+            entry = self._load().setdefault(key, {
+                'total': None, 'content_type': None, 'blocks': [], 'last_used': 0, 'block_size': self.block_size})
+            store = self.stores[key] = SegmentStore(
+                os.path.join(self.directory, f"{cache_file_name(key)}.data"), entry, self.block_size)
+        store.entry['last_used'] = time.time()
+        return store
+
+    # Client side
+
+    async def _serve_client(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                method, target = (request_line.decode('latin-1').split() + ['', ''])[:2]
+                if not await self._answer(method, target, headers, writer):
+                    break
+        except (OSError, asyncio.IncompleteReadError, UpstreamError):
+            pass # mpv drops connections when it seeks; upstream failures end the response early
+        except Exception as e:
+            show_status_message(f"Stream proxy error: {e}", 5, STATUS_PRIORITY_ERROR)
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def _reply_head(self, writer, status, headers):
+        lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def _reply_error(self, writer, status, message=''):
+        body = message.encode('utf-8', 'replace')
+        self._reply_head(writer, status, {'Content-Type': 'text/plain; charset=utf-8',
+                                          'Content-Length': len(body), 'Connection': 'close'})
+        writer.write(body)
+
+    async def _answer(self, method, target, headers, writer):
+        """ Answers one request; returns whether the connection can take another. """
+        if method not in ('GET', 'HEAD'):
+            self._reply_error(writer, 405)
+            return False
+        token, _, path = target.split('?', 1)[0].lstrip('/').partition('/')
+        path, _, track = path.partition('/')
+        video_id = urllib.parse.unquote(path)
+        registration = self.registered.get(video_id)
+        if not secrets.compare_digest(token.encode('latin-1'), self.token.encode()) or registration is None or not (track or '0').isdigit():
+            self._reply_error(writer, 404)
+            return False
+        # For this connection's task only, so errors reach the terminal that plays the video
+        playback_target, status_sink = registration
+        requested_playback_target.set(playback_target)
+        status_message_sink.set(status_sink)
+        source = (video_id, int(track or 0))
+        store = self.store(self.stream_key(*source))
+        fetched_through = -1
+        try:
+            if store.total is None:
+                fetched_through = await self._block(source, store, 0) # Learns the size
+        except Exception as e:
+            self._reply_error(writer, 502, str(e) or type(e).__name__)
+            return False
+        total = store.total
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', headers.get('range', '').replace(' ', ''))
+        if match and match.group(1):
+            start, end = int(match.group(1)), min(int(match.group(2) or total - 1), total - 1)
+        elif match and match.group(2):
+            start, end = max(total - int(match.group(2)), 0), total - 1 # Suffix range: the last N bytes
+        else:
+            start, end = 0, total - 1
+        if start > end:
+            self._reply_head(writer, 416, {'Content-Range': f"bytes */{total}", 'Content-Length': 0})
+            return True
+        response_headers = {'Content-Type': store.entry['content_type'] or 'application/octet-stream',
+                            'Accept-Ranges': 'bytes', 'Content-Length': end - start + 1}
+        if match:
+            response_headers['Content-Range'] = f"bytes {start}-{end}/{total}"
+        self._reply_head(writer, 206 if match else 200, response_headers)
+        if method == 'GET':
+            await self._send_range(source, store, start, end, writer, fetched_through)
+        await writer.drain()
+        return True
+
+    async def _send_range(self, source, store, start, end, writer, fetched_through=-1):
+        """ fetched_through: blocks up to this one were fetched while answering this request. """
+        position = start
+        while position <= end:
+            index = position // self.block_size
+            run_end = await self._block(source, store, index)
+            block_end = min(end, (index + 1) * self.block_size - 1)
+            writer.write(store.read(position, block_end))
+            if run_end is not None:
+                fetched_through = run_end
+            elif index > fetched_through:
+                self.served_from_disk += block_end - position + 1
+            await writer.drain()
+            position = block_end + 1
+
+    # Upstream side
+
+    async def _block(self, source, store, index):
+        """ Returns once block index is stored, fetching it (and the missing blocks after it)
+        unless a fetch for it is already underway. Returns the last block of the fetch it
+        waited for, or None if the block was already on disk. source is (video_id, track). """
+        if index in store.blocks:
+            return None
+        if index not in store.pending:
+            last = index + self.readahead - 1
+            if store.total is not None:
+                last = min(last, store.block_count() - 1)
+            run = [index]
+            while run[-1] < last and run[-1] + 1 not in store.blocks and run[-1] + 1 not in store.pending:
+                run.append(run[-1] + 1)
+            loop = asyncio.get_running_loop()
+            for block in run:
+                future = store.pending[block] = loop.create_future()
+                future.add_done_callback(_ignore_task_result)
+            # Not part of this request: a block is completed even if mpv seeks away meanwhile
+            fetch = asyncio.ensure_future(self._fetch(source, store, run[0], run[-1]))
+            self._fetches.add(fetch)
+            fetch.add_done_callback(self._fetches.discard)
+        return await asyncio.shield(store.pending[index])
+
+    async def _fetch(self, source, store, first, last):
+        """ Fetches blocks first..last with one range request, storing each as it completes. """
+        video_id, track = source
+        size = self.block_size
+        error = None
+        try:
+            for refresh in (False, True):
+                urls = split_stream_url(await self.resolver(video_id, refresh) or '')
+                if track >= len(urls) or not urls[track]:
+                    raise UpstreamError(f"no stream URL for {video_id}")
+                url = urls[track]
+                end = (last + 1) * size if store.total is None else min((last + 1) * size, store.total)
+                started = time.monotonic()
+                response = await self.pool.get(url, first * size, end - 1)
+                try:
+                    if response.status in (403, 410) and not refresh:
+                        continue # Expired: resolve again and retry once
+                    total = response.total_size()
+                    if response.status != 206 or total is None:
+                        raise UpstreamError(f"upstream answered HTTP {response.status} without a usable range")
+                    if store.total is not None and store.total != total:
+                        store.reset(total)
+                    store.entry['total'] = total
+                    store.entry['content_type'] = response.headers.get('content-type')
+                    offset, index, buffered = first * size, first, bytearray()
+                    async for chunk in response.chunks():
+                        buffered += chunk
+                        while index <= last and offset < total and len(buffered) >= min(size, total - offset):
+                            length = min(size, total - offset)
+                            store.write(offset, bytes(buffered[:length]))
+                            del buffered[:length]
+                            store.blocks.add(index)
+                            self.fetched += length
+                            future = store.pending.pop(index, None)
+                            if future is not None and not future.done():
+                                future.set_result(last)
+                            offset += length
+                            index += 1
+                finally:
+                    response.release()
+                bandwidth_meter.record((index - first) * size, time.monotonic() - started)
+                break
+        except Exception as e:
+            error = e
+        finally:
+            for index in range(first, last + 1):
+                future = store.pending.pop(index, None)
+                if future is not None and not future.done():
+                    if error is None and store.total is not None and index >= store.block_count():
+                        future.set_exception(UpstreamError("range past the end of the stream"))
+                    else:
+                        future.set_exception(error or UpstreamError("upstream response ended early"))
+            with contextlib.suppress(OSError):
+                self.enforce_budget(keep=self.stream_key(*source))
+                self.save_index()
+
+    def total_bytes(self):
+        return sum(len(entry['blocks']) * self.block_size for entry in self._load().values())
+
+    def enforce_budget(self, keep=None):
+        """ Deletes streams, least recently played first, until the store fits max_bytes. """
+        for store in self.stores.values():
+            store.sync()
+        total = self.total_bytes()
+        for key, entry in sorted(self._load().items(), key=lambda item: item[1]['last_used']):
+            if total <= self.max_bytes:
+                break
+            store = self.stores.get(key)
+            if key == keep or (store is not None and store.pending):
+                continue
+            if store is not None:
+                store.close()
+                del self.stores[key]
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(self.directory, f"{cache_file_name(key)}.data"))
+            total -= len(entry['blocks']) * self.block_size
+            del self.entries[key]
+
+    def stats(self):
+        return {'streams': len(self._load()), 'bytes': self.total_bytes(), 'max_bytes': self.max_bytes,
+                'served_from_disk': self.served_from_disk, 'fetched': self.fetched,
+                'connections_opened': self.pool.opened, 'connections_reused': self.pool.reused}
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            self._starting = None
+        for writer in list(self._clients):
+            writer.close()
+        for fetch in list(self._fetches):
+            fetch.cancel()
+        await asyncio.gather(*self._fetches, return_exceptions=True)
+        self.pool.close()
+        if self.entries is not None:
+            with contextlib.suppress(OSError):
+                self.save_index()
+        for store in self.stores.values():
+            store.close()
+        self.stores.clear()
+
+async def proxy_upstream_url(video_id, refresh=False):
+    if refresh:
+        return await stream_url_cache.renew(video_id)
+    return await stream_url_cache.resolve(video_id)
+
+stream_proxy = StreamProxy(proxy_upstream_url)
+
+def proxyable(stream_url):
+    """ Whether the stream proxy can serve stream_url: a single file over HTTP, not a local
+    file or an HLS/DASH manifest, whose segments mpv fetches from URLs of their own. """
+    parts = urllib.parse.urlsplit(stream_url)
+    return (parts.scheme in ('http', 'https') and not parts.path.endswith(('.m3u8', '.mpd'))
+            and '/manifest/' not in parts.path)
+
+async def proxied_stream_url(video_id, stream_url):
+    """ The URL mpv should open for stream_url: the stream proxy's, from the daemon's proxy when
+    there is a daemon (it owns the stream URL cache the proxy resolves from). """
+    urls = split_stream_url(stream_url)
+    if not all(proxyable(url) for url in urls):
+        return stream_url
+    client = await connected_daemon()
+    if client is not None:
+        with contextlib.suppress(DaemonConnectionError):
+            return join_stream_urls(await client.request('proxy_url', video_id=video_id, tracks=len(urls)))
+    await stream_proxy.start()
+    stream_proxy.register(video_id, current_playback_target(), status_message_sink.get())
+    return join_stream_urls([stream_proxy.url_for(video_id, track) for track in range(len(urls))])
+
+# --- Search controller ---
+
+class SearchController:
+    """ Tracks the search work for the query shown in the results pane. Each submitted query
+    starts a new generation: tasks of older generations are cancelled, their cancel event
+    stops executor threads at the next extracted entry, and callers check is_current()
+    before rendering so that only the latest results ever reach the screen. """
+
+    def __init__(self):
+        self.generation = 0
+        self.query = None
+        self.cancel_event = threading.Event()
+        self._tasks = set()
+
+    def begin(self, query):
+        """ Supersedes all earlier work and returns the new generation number. """
+        self.cancel()
+        self.generation += 1
+        self.query = query
+        self.cancel_event = threading.Event()
+        return self.generation
+
+    def spawn(self, coro):
+        """ Runs coro as a task belonging to the current generation. """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def is_current(self, generation):
+        return generation == self.generation and not self.cancel_event.is_set()
 
-# Global application instance to access UI elements from functions
-application_instance = None
+    def busy(self):
+        return any(not task.done() for task in self._tasks)
 
-def show_status_message(message, duration=None):
-    """ Displays a message in the status bar. Clears after duration if specified. """
-    if application_instance and hasattr(application_instance, 'status_bar_control'):
-        application_instance.status_bar_control.text = message
-        application_instance.invalidate()
-        if duration:
-            # This is a simple way; for multiple timed messages, a queue would be better
-            async def clear_message():
-                await asyncio.sleep(duration)
-                # Clear only if the message hasn't changed
-                if application_instance.status_bar_control.text == message:
-                    application_instance.status_bar_control.text = get_default_status_text()
-                application_instance.invalidate()
-            asyncio.create_task(clear_message())
+    def cancel(self):
+        self.cancel_event.set()
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
 
+search_controller = SearchController()
 
-def get_default_status_text():
-    return "VidTerm | (Ctrl-C/Q to quit) | (Up/Down, Enter to play)"
+class Debouncer:
+    """ Calls callback(*args) once calls have stopped arriving for delay seconds. """
 
-async def search_videos_async(query):
-    show_status_message(f"Searching for: {query}...")
-    ydl_opts = {
-        'quiet': True,
-        'extract_flat': 'search',
-        'default_search': 'ytsearch10:',
-        'forcejson': True,
-    }
-    results = []
+    def __init__(self, delay, callback):
+        self.delay = delay
+        self.callback = callback
+        self._handle = None
+
+    def __call__(self, *args):
+        self.cancel()
+        self._handle = asyncio.get_event_loop().call_later(self.delay, self.callback, *args)
+
+    def cancel(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+
+
+# --- Daemon and client ---
+
+# Frames are a 4-byte big-endian length followed by a compact JSON object. Requests carry an
+# 'id', an 'op' and the op's arguments; the daemon answers each with {'id', 'result'} or
+# {'id', 'error'}, optionally preceded by {'id', 'event', ...} messages (streamed search
+# results, status messages). Messages without an 'id' are broadcasts such as playback updates.
+
+class DaemonError(Exception):
+    pass
+
+class DaemonConnectionError(DaemonError):
+    """ The daemon could not be reached; callers fall back to working in-process. """
+
+def _source_version():
     try:
-        # yt-dlp is synchronous, run in executor to not block event loop
-        loop = asyncio.get_event_loop()
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = await loop.run_in_executor(None, lambda: ydl.extract_info(f"ytsearch10:{query}", download=False))
-
-            if info_dict and 'entries' in info_dict:
-                for entry in info_dict['entries']:
-                    if entry and isinstance(entry, dict) and entry.get('id'):
-                        results.append({
-                            'id': entry.get('id'),
-                            'title': entry.get('title', 'N/A'),
-                            'uploader': entry.get('uploader', 'N/A'),
-                            'duration_string': entry.get('duration_string', 'N/A')
-                        })
-        if not results:
-            show_status_message(f"No results found for '{query}'.", 3)
-        else:
-            show_status_message(f"Found {len(results)} videos.", 3)
-        return results
-    except yt_dlp.utils.DownloadError as e:
-        show_status_message(f"Search Error: {e}", 5)
-    except Exception as e:
-        show_status_message(f"Unexpected Search Error: {e}", 5)
-    return [] # Return empty list on error
+        with open(os.path.abspath(__file__), 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()[:12]
+    except OSError:
+        return None
 
-async def get_stream_url_async(video_id):
-    show_status_message(f"Fetching stream for {video_id}...")
-    ydl_opts = {'quiet': True, 'format': 'best'}
+# A daemon started from other code may not know the ops this client sends; clients replace it
+DAEMON_VERSION = _source_version()
+
+def private_socket_directory(path):
+    """ Creates the directory of socket path if needed and checks that it belongs to this user
+    and that nobody else can enter it. Otherwise, in a shared temp directory, another user
+    could bind the path first and answer in the daemon's place. Raises PermissionError. """
+    directory = os.path.dirname(path)
+    with contextlib.suppress(FileExistsError):
+        os.mkdir(directory, 0o700)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"{directory} is not a private directory of this user")
+
+def encode_frame(message):
+    body = json.dumps(message, separators=(',', ':')).encode()
+    return struct.pack('>I', len(body)) + body
+
+async def read_frame(reader):
+    """ Returns the next message, or None at end of stream. """
     try:
-        loop = asyncio.get_event_loop()
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = await loop.run_in_executor(None, lambda: ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=False))
+        header = await reader.readexactly(4)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = struct.unpack('>I', header)
+    if length > DAEMON_MAX_FRAME:
+        raise DaemonError(f"frame of {length} bytes exceeds the limit")
+    try:
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+class VidtermDaemon:
+    """ vidtermd: serves searches, stream URL resolution and persistent-mpv playback to TUI
+    clients over a Unix socket, so yt-dlp, the YoutubeDL pool, the caches and mpv stay warm
+    across launches and are shared between terminals. Each request runs in its own task;
+    a client disconnecting cancels its outstanding requests. """
+
+    def __init__(self, path=DAEMON_SOCKET_PATH, idle_timeout=DAEMON_IDLE_TIMEOUT):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.clients = set()
+        self._server = None
+        self._stopped = None
+        self._idle_timer = None
+        self._lock_file = None
+
+    async def serve(self):
+        """ Serves until stopped or idle. Returns False if another daemon already owns the socket. """
+        self._stopped = asyncio.Event()
+        private_socket_directory(self.path)
+        if not self._lock():
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path) # Left behind by a daemon that did not exit cleanly
+        start_yt_dlp_warmup()
+        mpv_probe.start()
+        old_umask = os.umask(0o177) # Created 0600, with no window where others could connect
+        try:
+            self._server = await asyncio.start_unix_server(self._serve_client, self.path)
+        finally:
+            os.umask(old_umask)
+        if MPV_PERSISTENT:
+            for name in playback_state:
+                await mpv_controller.observe_property(
+                    name, lambda name, value: self.broadcast({'event': 'playback', 'name': name, 'value': value}))
+            mpv_controller.on_event('end-file', lambda message: self.broadcast({'event': 'playback-end'}))
+        self._reset_idle_timer()
+        try:
+            await self._stopped.wait()
+        finally:
+            self._server.close()
+            for writer in list(self.clients):
+                writer.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+            stream_prefetcher.cancel_all()
+            await mpv_controller.close()
+            await stream_proxy.close()
+            self._lock_file.close()
+        return True
+
+    def _lock(self):
+        # Held for the daemon's lifetime, so two daemons started at once cannot both take the socket
+        import fcntl
+        try:
+            fd = os.open(f"{self.path}.lock", os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        except OSError:
+            return False
+        self._lock_file = os.fdopen(fd, 'r+')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            return False
+        return True
+
+    def stop(self):
+        if self._stopped:
+            self._stopped.set()
+
+    def _reset_idle_timer(self):
+        if self._idle_timer:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+        if not self.clients and self.idle_timeout:
+            self._idle_timer = asyncio.get_running_loop().call_later(self.idle_timeout, self.stop)
+
+    def broadcast(self, message):
+        frame = encode_frame(message)
+        for writer in list(self.clients):
+            writer.write(frame)
+
+    async def _serve_client(self, reader, writer):
+        self.clients.add(writer)
+        self._reset_idle_timer()
+        requests = {} # request id -> task
+        try:
+            while True:
+                try:
+                    message = await read_frame(reader)
+                except (DaemonError, ValueError, OSError):
+                    break
+                if message is None:
+                    break
+                if message.get('op') == 'cancel':
+                    task = requests.get(message.get('target'))
+                    if task:
+                        task.cancel()
+                    continue
+                task = asyncio.create_task(self._answer(message, writer))
+                requests[message.get('id')] = task
+                task.add_done_callback(lambda t, request_id=message.get('id'): _forget_inflight(requests, request_id, t))
+        finally:
+            for task in list(requests.values()):
+                task.cancel()
+            self.clients.discard(writer)
+            writer.close()
+            self._reset_idle_timer()
+
+    async def _answer(self, message, writer):
+        request_id = message.get('id')
+
+        def send(reply):
+            if not writer.is_closing():
+                writer.write(encode_frame(dict(reply, id=request_id)))
+
+        status_message_sink.set(lambda text, duration, priority: send(
+            {'event': 'status', 'message': text, 'duration': duration, 'priority': priority}))
+        requested_playback_target.set(message.get('playback_target'))
+        handler = getattr(self, f"op_{message.get('op')}", None)
+        try:
+            if handler is None:
+                raise DaemonError(f"unknown op {message.get('op')!r}")
+            send({'result': await handler(send, **message.get('args', {}))})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            send({'error': str(e) or type(e).__name__})
+
+    async def op_ping(self, send):
+        return {'pid': os.getpid(), 'clients': len(self.clients), 'version': DAEMON_VERSION}
+
+    async def op_search(self, send, query, page=0, stream=True):
+        if not stream:
+            return [result.to_dict() for result in await search_videos_async(query, page)]
+        cancel_event = threading.Event()
+        try:
+            results = await search_videos_streaming_async(
+                query, lambda result: send({'event': 'result', 'data': result.to_dict()}), cancel_event, page)
+        finally:
+            cancel_event.set() # Stops the extraction thread if this request was cancelled
+        return None if results is None else len(results)
+
+    async def op_resolve(self, send, video_id, lane=FOREGROUND):
+        job_lane.set(lane)
+        url = await stream_url_cache.resolve(video_id)
+        entry = stream_url_cache.entries.get(video_id)
+        return {'url': url, 'expires_at': entry.expires_at if entry else None}
+
+    async def op_play(self, send, url, title=None):
+        mpv = await mpv_probe.result()
+        if not mpv.available:
+            mpv_probe.invalidate()
+            raise DaemonError("mpv not found")
+        mpv_controller.mpv_path = mpv.path
+        await mpv_controller.loadfile(url, title=title)
+        return True
+
+    async def op_media_source(self, send, video_id, url):
+        return media_cache.playback_source(video_id, url)
+
+    async def op_proxy_url(self, send, video_id, tracks=1):
+        await stream_proxy.start()
+        stream_proxy.register(video_id, current_playback_target(), status_message_sink.get())
+        return [stream_proxy.url_for(video_id, track) for track in range(tracks)]
+
+    async def op_stats(self, send):
+        return {'search_cache': search_cache.stats(), 'stream_url_cache': stream_url_cache.stats(),
+                'media_cache': media_cache.stats(), 'stream_proxy': stream_proxy.stats(),
+                'bandwidth': bandwidth_meter.rate,
+                'jobs': job_scheduler.stats(), 'clients': len(self.clients)}
+
+    async def op_shutdown(self, send):
+        asyncio.get_running_loop().call_soon(self.stop)
+        return True
+
+class DaemonClient:
+    """ Connection from the TUI to vidtermd. Requests are multiplexed by id over one socket;
+    cancelling a request's awaiting task tells the daemon to cancel it too. """
+
+    def __init__(self, path=DAEMON_SOCKET_PATH):
+        self.path = path
+        self.on_broadcast = None # Called with each message that is not a reply
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._request_ids = itertools.count(1)
+        self._pending = {} # request id -> (future, on_event)
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                message = await read_frame(self._reader)
+                if message is None:
+                    break
+                self._dispatch(message)
+        except (DaemonError, ValueError, OSError):
+            pass
+        finally:
+            self._writer = None
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(DaemonConnectionError("connection to vidtermd closed"))
+            self._pending.clear()
+
+    def _dispatch(self, message):
+        pending = self._pending.get(message.get('id'))
+        if pending is None:
+            if 'id' not in message and self.on_broadcast:
+                self.on_broadcast(message)
+            return
+        future, on_event = pending
+        if 'event' in message:
+            if message['event'] == 'status':
+                show_status_message(message['message'], message['duration'], message['priority'])
+            elif on_event:
+                on_event(message)
+            return
+        del self._pending[message['id']]
+        if future.done():
+            return
+        if 'error' in message:
+            future.set_exception(DaemonError(message['error']))
+        else:
+            future.set_result(message.get('result'))
 
-            if info_dict and 'url' in info_dict:
-                show_status_message(f"Stream ready for {video_id}.", 2)
-                return info_dict['url']
+    async def request(self, op, on_event=None, **args):
+        if not self.connected:
+            raise DaemonConnectionError("not connected to vidtermd")
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, on_event)
+        message = {'id': request_id, 'op': op, 'args': args}
+        target = current_playback_target()
+        if target is not None:
+            message['playback_target'] = target # Streams the daemon resolves are chosen for this terminal
+        self._writer.write(encode_frame(message))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            self._pending.pop(request_id, None)
+            if self.connected:
+                self._writer.write(encode_frame({'op': 'cancel', 'target': request_id}))
+            raise
 
-            formats = info_dict.get('formats', [])
-            for f in formats:
-                if f.get('url'):
-                    show_status_message(f"Stream ready for {video_id}.", 2)
-                    return f['url']
+    async def search(self, query, page=0, on_result=None, cancel_event=None):
+        """ Results of one search page; with on_result, each is also passed on as it arrives.
+        Returns None if the search was cancelled. """
+        if on_result is None:
+            return [VideoResult.from_dict(data) for data in await self.request('search', query=query, page=page, stream=False)]
+        results = []
 
-            show_status_message("Could not find direct stream URL.", 3)
+        def on_event(message):
+            if message['event'] == 'result' and not (cancel_event and cancel_event.is_set()):
+                result = VideoResult.from_dict(message['data'])
+                results.append(result)
+                on_result(result)
+        count = await self.request('search', on_event, query=query, page=page)
+        if count is None or (cancel_event and cancel_event.is_set()):
             return None
-    except Exception as e:
-        show_status_message(f"Error getting stream URL: {e}", 5)
+        return results
+
+    async def resolve(self, video_id, lane=FOREGROUND):
+        reply = await self.request('resolve', video_id=video_id, lane=lane)
+        return reply['url'], reply['expires_at']
+
+    async def play(self, url, title=None):
+        await self.request('play', url=url, title=title)
+
+    async def close(self):
+        if self._read_task:
+            self._read_task.cancel()
+            self._read_task = None
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+daemon_client = None # Connected DaemonClient, or None when working in-process
+daemon_connect_task = None
+
+def spawn_daemon(extract_processes=0):
+    """ Starts vidtermd detached from this terminal; it outlives the TUI. """
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--extract-processes', str(extract_processes), 'daemon'],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True)
+
+async def connect_daemon(path=DAEMON_SOCKET_PATH, spawn=True, timeout=DAEMON_START_TIMEOUT, extract_processes=0):
+    """ Connects to vidtermd, starting it (with extract_processes extraction workers) if needed.
+    A daemon running other code than this is shut down and, with spawn, replaced. Returns the
+    client, or None (after starting the in-process yt-dlp warm-up) if no daemon could be reached. """
+    global daemon_client
+    client = DaemonClient(path)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    process = None
+    while True:
+        try:
+            private_socket_directory(path)
+            await client.connect()
+            if await _replaced_outdated_daemon(client, deadline):
+                client = DaemonClient(path)
+                continue
+            break
+        except (PermissionError, DaemonError, asyncio.TimeoutError):
+            await client.close() # Not a daemon to trust, or it failed the version check
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            if process is None and spawn:
+                try:
+                    process = spawn_daemon(extract_processes)
+                except OSError:
+                    break
+            elif process is None or process.poll() not in (None, 0) or loop.time() > deadline:
+                break # Exit status 0 means another daemon won the race to start; keep waiting for it
+            await asyncio.sleep(0.05)
+    if not client.connected:
+        start_yt_dlp_warmup() # Fall back to extracting in this process
         return None
+    client.on_broadcast = on_daemon_broadcast
+    daemon_client = client
+    client._read_task.add_done_callback(lambda t: _daemon_disconnected(client))
+    return client
 
-async def play_video_in_terminal_async(video_id):
-    show_status_message(f"Preparing video ID: {video_id}...")
+async def _replaced_outdated_daemon(client, deadline):
+    """ Checks the version of the daemon client is connected to. If it differs, shuts it down,
+    waits for it to exit and returns True; the caller then connects (or starts one) again. """
+    loop = asyncio.get_running_loop()
+    info = await asyncio.wait_for(client.request('ping'), max(deadline - loop.time(), DAEMON_PING_TIMEOUT))
+    if info.get('version') == DAEMON_VERSION:
+        return False
+    with contextlib.suppress(DaemonError):
+        await client.request('shutdown')
+    await client.close()
+    while loop.time() < deadline:
+        try:
+            os.kill(info['pid'], 0)
+        except ProcessLookupError:
+            return True # Gone, with its socket and lock
+        await asyncio.sleep(0.05)
+    raise DaemonConnectionError("the outdated vidtermd did not exit")
+
+def _daemon_disconnected(client):
+    global daemon_client
+    if daemon_client is client:
+        daemon_client = None
+        start_yt_dlp_warmup() # Keep working in-process
 
-    # Check if mpv is installed
+async def connected_daemon():
+    """ The daemon client once the startup connection attempt has finished, or None. """
+    if daemon_connect_task is not None and not daemon_connect_task.done():
+        await asyncio.shield(daemon_connect_task)
+    return daemon_client
+
+def on_daemon_broadcast(message):
+    if message.get('event') == 'playback':
+        on_playback_property(message['name'], message['value'])
+    elif message.get('event') == 'playback-end':
+        on_playback_end(message)
+
+def run_daemon(idle_timeout=DAEMON_IDLE_TIMEOUT):
+    daemon = VidtermDaemon(idle_timeout=idle_timeout)
     try:
-        process = await asyncio.create_subprocess_exec('which', 'mpv', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        await process.wait()
-        if process.returncode != 0:
-            show_status_message("mpv not found. Please install mpv.", 5)
-            # Fallback to message_dialog if status bar is too transient for critical errors
-            if application_instance: # Ensure app instance exists for dialog
-                 await message_dialog(title="Error", text="mpv not found. Please install mpv to play videos.").run_async(application_instance)
-            return
-    except FileNotFoundError: # 'which' not found
-        show_status_message("'which' command not found. Cannot check for mpv.", 5)
-        if application_instance: # Ensure app instance exists for dialog
-            await message_dialog(title="Error", text="'which' command not found. Cannot verify mpv installation.").run_async(application_instance)
-        return
+        asyncio.run(daemon.serve())
+    finally:
+        stream_url_cache.close()
+        media_cache.close()
+        job_scheduler.close()
+        if extraction_backend is not None:
+            extraction_backend.close()
+        search_sessions.close_all()
+        ydl_pool.close_all()
+        search_cache.close()
 
-    stream_url = await get_stream_url_async(video_id)
-    if not stream_url:
-        show_status_message("Failed to get stream URL. Cannot play video.", 3)
+# --- Thumbnail previews ---
+
+def terminal_cell_size(fd=None):
+    """ (width, height) of one terminal cell in pixels, or a typical 8x16 if the terminal
+    does not report its pixel size. """
+    try:
+        import fcntl
+        import termios
+        fd = sys.stdout.fileno() if fd is None else fd
+        rows, cols, width, height = struct.unpack('HHHH', fcntl.ioctl(fd, termios.TIOCGWINSZ, b'\0' * 8))
+        if rows and cols and width and height:
+            return width // cols, height // rows
+    except (ImportError, OSError, ValueError, io.UnsupportedOperation):
+        pass
+    return 8, 16
+
+def detect_graphics_protocol(environ=os.environ):
+    """ Picks how thumbnails are drawn: kitty graphics, sixel, or half-block characters. """
+    if THUMBNAIL_PROTOCOL != 'auto':
+        return THUMBNAIL_PROTOCOL
+    if environ.get('TMUX'):
+        return 'halfblock' # tmux does not pass image protocols through reliably
+    term = environ.get('TERM', '')
+    program = environ.get('TERM_PROGRAM', '')
+    if 'kitty' in term or environ.get('KITTY_WINDOW_ID') or program in ('WezTerm', 'ghostty'):
+        return 'kitty'
+    if any(name in term for name in ('sixel', 'foot', 'mlterm', 'contour', 'yaft')):
+        return 'sixel'
+    return 'halfblock'
+
+def thumbnail_url(video_id):
+    return f"https://i.ytimg.com/vi/{video_id}/mqdefault.jpg"
+
+def read_or_download_thumbnail(url, path):
+    """ Returns the raw image bytes, from the disk cache or downloaded into it. Blocking. """
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    with urllib.request.urlopen(url, timeout=10) as response:
+        raw = response.read()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{threading.get_ident()}.part"
+    with open(partial, 'wb') as f:
+        f.write(raw)
+    os.replace(partial, path) # Readers never see a half-written file
+    return raw
+
+def prune_thumbnail_disk_cache(directory=THUMBNAIL_DISK_CACHE_DIR, max_files=THUMBNAIL_DISK_CACHE_MAX_FILES):
+    try:
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime)
+    except FileNotFoundError:
         return
+    for entry in entries[:max(0, len(entries) - max_files)]:
+        with contextlib.suppress(OSError):
+            os.unlink(entry.path)
 
-    show_status_message(f"Starting playback: {video_id}. (mpv will take over)")
+def _rgb(pixel):
+    return f"#{pixel[0]:02x}{pixel[1]:02x}{pixel[2]:02x}"
 
-    # Suspend prompt_toolkit application
-    if application_instance:
-        await application_instance.suspend_to_background()
+def _sixel_row(column_bits):
+    """ Run-length encodes one colour of one six-pixel band. """
+    out = []
+    for bits, run in itertools.groupby(column_bits):
+        char = chr(63 + bits)
+        count = len(list(run))
+        out.append(f"!{count}{char}" if count > 3 else char * count)
+    return "".join(out)
+
+def sixel_image_escape(image, colors=64):
+    image = image.quantize(colors=colors)
+    palette = image.getpalette()[:colors * 3]
+    width, height = image.size
+    pixels = image.load()
+    out = ["\x1bPq", f'"1;1;{width};{height}']
+    for index in range(len(palette) // 3):
+        r, g, b = palette[index * 3:index * 3 + 3]
+        out.append(f"#{index};2;{r * 100 // 255};{g * 100 // 255};{b * 100 // 255}")
+    for band in range(0, height, 6):
+        columns_by_color = {}
+        for bit, y in enumerate(range(band, min(band + 6, height))):
+            for x in range(width):
+                columns_by_color.setdefault(pixels[x, y], [0] * width)[x] |= 1 << bit
+        for color, column_bits in columns_by_color.items():
+            out.append(f"#{color}{_sixel_row(column_bits)}$")
+        out.append("-")
+    out.append("\x1b\\")
+    return "".join(out)
+
+def kitty_image_escape(image, cols, rows):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    data = base64.standard_b64encode(buffer.getvalue()).decode()
+    chunks = [data[i:i + 4096] for i in range(0, len(data), 4096)] or ['']
+    out = []
+    for i, chunk in enumerate(chunks):
+        more = 1 if i < len(chunks) - 1 else 0
+        control = f"a=T,f=100,c={cols},r={rows},q=2,m={more}" if i == 0 else f"m={more}"
+        out.append(f"\x1b_G{control};{chunk}\x1b\\")
+    return "".join(out)
+
+def render_thumbnail(raw, cols, rows, protocol, cell_size=(8, 16)):
+    """ Decodes and downscales a thumbnail for a cols x rows cell box. Runs in a worker process.
+    Returns rows of (style, text) fragments for 'halfblock', or an escape sequence string. """
+    from PIL import Image
+    image = Image.open(io.BytesIO(raw)).convert('RGB')
+    if protocol == 'halfblock':
+        # Each cell shows two pixels: the upper half block in the foreground colour over the background
+        image = image.resize((cols, rows * 2))
+        pixels = image.load()
+        return [[(f"fg:{_rgb(pixels[x, y])} bg:{_rgb(pixels[x, y + 1])}", "▀") for x in range(cols)]
+                for y in range(0, rows * 2, 2)]
+    image.thumbnail((cols * cell_size[0], rows * cell_size[1]))
+    if protocol == 'kitty':
+        return kitty_image_escape(image, cols, rows)
+    return sixel_image_escape(image)
+
+def rendering_size(rendering):
+    if isinstance(rendering, str):
+        return len(rendering)
+    return sum(len(style) + len(text) for line in rendering for style, text in line)
+
+class ThumbnailPreview:
+    """ Fetch -> decode -> render pipeline behind the preview panel. Raw images come from a disk
+    cache or a download limited to THUMBNAIL_FETCH_CONCURRENCY at a time; decoding and
+    downscaling run in a process pool; finished renderings are kept in an LRU bounded by
+    THUMBNAIL_MEMORY_BUDGET. show() never waits: the panel shows whatever is ready, and
+    work for thumbnails that are no longer highlighted is cancelled. """
+
+    def __init__(self, cols=THUMBNAIL_COLS, rows=THUMBNAIL_ROWS, protocol='halfblock', memory_budget=THUMBNAIL_MEMORY_BUDGET):
+        self.cols = cols
+        self.rows = rows
+        self.protocol = protocol
+        self.memory_budget = memory_budget
+        self.current_id = None
+        self.rendered = None # Rendering of current_id once it is ready
+        self.on_change = None # Called when the panel needs a redraw
+        self._renderings = collections.OrderedDict()
+        self._renderings_size = 0
+        self._fetches = {}
+        self._fetch_slots = None
+        self._render_task = None
+        self._process_pool = None
+        self._downloads = 0
+        self._ahead = {} # video_id -> task fetching a neighbour's image ahead of time
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def show(self, video_id, neighbour_ids=()):
+        """ Switches the panel to video_id and fetches the neighbours' raw images ahead. """
+        if video_id != self.current_id:
+            self.current_id = video_id
+            if self._render_task:
+                self._render_task.cancel()
+                self._render_task = None
+            self.rendered = self._renderings.get(video_id)
+            if self.rendered is not None:
+                self._renderings.move_to_end(video_id)
+            elif video_id:
+                self._render_task = asyncio.ensure_future(self._render(video_id))
+            self._changed()
+        for ahead_id, task in list(self._ahead.items()):
+            if ahead_id not in neighbour_ids:
+                task.cancel() # Scrolled past; drops the download unless the highlight needs it
+        for neighbour_id in neighbour_ids:
+            if neighbour_id not in self._renderings and neighbour_id not in self._ahead:
+                task = self._ahead[neighbour_id] = asyncio.ensure_future(self.fetch(neighbour_id))
+                task.add_done_callback(_ignore_task_result)
+                task.add_done_callback(lambda t, ahead_id=neighbour_id: _forget_inflight(self._ahead, ahead_id, t))
+
+    async def fetch(self, video_id):
+        """ Raw image bytes for video_id; concurrent requests for one id share a download. """
+        task = self._fetches.get(video_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(video_id))
+            self._fetches[video_id] = task
+            task.add_done_callback(lambda t: _forget_inflight(self._fetches, video_id, t))
+            task.add_done_callback(_ignore_task_result)
+        return await await_shared(task) # Rows scrolled past no longer hold up the download queue
+
+    async def _fetch(self, video_id):
+        if self._fetch_slots is None:
+            self._fetch_slots = asyncio.Semaphore(THUMBNAIL_FETCH_CONCURRENCY)
+        path = os.path.join(THUMBNAIL_DISK_CACHE_DIR, f"{video_id}.jpg")
+        async with self._fetch_slots:
+            raw = await job_scheduler.run(read_or_download_thumbnail, thumbnail_url(video_id), path, lane=BACKGROUND)
+        self._downloads += 1
+        if self._downloads % 100 == 0:
+            job_scheduler.submit(prune_thumbnail_disk_cache, lane=BACKGROUND)
+        return raw
+
+    def _pool(self):
+        if self._process_pool is None:
+            # Spawned, not forked: the UI process runs threads whose locks a forked child could inherit held
+            self._process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=THUMBNAIL_DECODE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return self._process_pool
+
+    async def _render(self, video_id):
+        try:
+            raw = await self.fetch(video_id)
+            loop = asyncio.get_running_loop()
+            rendering = await loop.run_in_executor(
+                self._pool(), render_thumbnail, raw, self.cols, self.rows, self.protocol, terminal_cell_size())
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            return # No preview for this one; the panel keeps showing its placeholder
+        self._store(video_id, rendering)
+        if video_id == self.current_id:
+            self.rendered = rendering
+            self._changed()
+
+    def _store(self, video_id, rendering):
+        self._renderings[video_id] = rendering
+        self._renderings_size += rendering_size(rendering)
+        while self._renderings_size > self.memory_budget and len(self._renderings) > 1:
+            _, evicted = self._renderings.popitem(last=False)
+            self._renderings_size -= rendering_size(evicted)
+
+    def close(self):
+        if self._render_task:
+            self._render_task.cancel()
+        for task in list(self._ahead.values()):
+            task.cancel()
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+thumbnail_previews_available = THUMBNAIL_PREVIEWS and importlib.util.find_spec('PIL') is not None
+thumbnail_preview = ThumbnailPreview(protocol=detect_graphics_protocol())
+
+# --- Frame scheduling ---
+
+class FrameScheduler:
+    """ Rate-limits and instruments redraws of the prompt_toolkit application. Code that changes
+    what is on screen calls request_redraw(); requests arriving while a frame is already
+    pending are merged into it, and frames (including the ones prompt_toolkit triggers after
+    each key press) are spaced at least 1/max_fps apart. Each render is timed between the
+    application's before_render and after_render events; a render that takes longer than the
+    frame budget counts as a dropped frame. """
+
+    def __init__(self, max_fps=MAX_FPS, window=FRAME_STATS_WINDOW):
+        self.max_fps = max_fps
+        self.frame_times = collections.deque(maxlen=window) # Seconds spent in each recent render
+        self.frames = 0
+        self.dropped = 0
+        self.merged = 0
+        self._render_started = None
+
+    @property
+    def budget(self):
+        return 1.0 / self.max_fps
+
+    def attach(self, app):
+        app.min_redraw_interval = self.budget
+        app.before_render += self._before_render
+        app.after_render += self._after_render
+
+    def request_redraw(self):
+        app = application_instance
+        if not app:
+            return
+        if app.invalidated:
+            self.merged += 1
+            return
+        app.invalidate()
+
+    def _before_render(self, app):
+        self._render_started = time.perf_counter()
+
+    def _after_render(self, app):
+        if self._render_started is None:
+            return
+        elapsed = time.perf_counter() - self._render_started
+        self._render_started = None
+        self.frames += 1
+        self.frame_times.append(elapsed)
+        if elapsed > self.budget:
+            self.dropped += 1
+
+    def summary(self):
+        if not self.frame_times:
+            return f"no frames yet | cap {self.max_fps} fps"
+        average = sum(self.frame_times) / len(self.frame_times)
+        return (f"render {self.frame_times[-1] * 1000:.1f}ms avg {average * 1000:.1f}ms"
+                f" max {max(self.frame_times) * 1000:.1f}ms | dropped {self.dropped}/{self.frames}"
+                f" | merged {self.merged} | cap {self.max_fps} fps")
+
+frame_scheduler = FrameScheduler()
+
+# --- Result filtering ---
+
+class FuzzyFilter:
+    """ Incremental fuzzy filter over the loaded results. Every space-separated term of the
+    pattern must occur in a result's title or uploader with its characters in order (not
+    necessarily adjacent). Match sets are kept for the prefixes of the current pattern, so
+    extending the pattern only re-checks the rows that matched before, and rows appended to
+    the source list (e.g. by pagination) are checked once. """
+
+    def __init__(self):
+        self.pattern = ''
+        self._source = None
+        self._checked = 0
+        self._matches = {}
+
+    @staticmethod
+    def matches(terms, result):
+        for term in terms:
+            chars = iter(result.match_text)
+            if not all(char in chars for char in term):
+                return False
+        return True
 
+    def set_pattern(self, pattern):
+        self.pattern = pattern.lower()
+        # Keep the match sets that can seed this pattern (or a backspace to a shorter one)
+        self._matches = {key: value for key, value in self._matches.items() if self.pattern.startswith(key)}
+
+    def apply(self, results):
+        """ Returns the results matching the pattern, in their original order. """
+        if results is not self._source:
+            self._source, self._checked, self._matches = results, 0, {}
+        if not self.pattern.strip():
+            return results
+        if self._checked < len(results):
+            new_rows = results[self._checked:]
+            for key, matched in self._matches.items():
+                terms = key.split()
+                matched.extend(result for result in new_rows if self.matches(terms, result))
+            self._checked = len(results)
+        matched = self._matches.get(self.pattern)
+        if matched is None:
+            seed = max((key for key in self._matches if self.pattern.startswith(key)), key=len, default=None)
+            candidates = self._matches[seed] if seed is not None else results
+            terms = self.pattern.split()
+            matched = self._matches[self.pattern] = [result for result in candidates if self.matches(terms, result)]
+        return matched
+
+# --- Headless commands ---
+# Commands that run without the full-screen UI: the JSON-lines commands and the daemon. They
+# are dispatched before the UI section below, so they never import prompt_toolkit or build widgets.
+
+HEADLESS_COMMANDS = ('search', 'resolve', 'daemon')
+
+def write_json_line(obj):
+    sys.stdout.write(json.dumps(obj, ensure_ascii=False) + '\n')
+    sys.stdout.flush() # One line per result as it arrives, for pipes into fzf or scripts
+
+def report_headless_status(errors):
+    """ status_message_sink for headless commands: errors go to stderr, progress is dropped. """
+    def sink(message, duration, priority):
+        if priority >= STATUS_PRIORITY_ERROR:
+            errors.append(message)
+            print(message, file=sys.stderr)
+    return sink
+
+async def search_command_async(query, limit, use_daemon=USE_DAEMON):
+    """ Streams up to limit results for query to stdout as JSON lines. Returns the exit status. """
+    global daemon_connect_task
+    errors = []
+    status_message_sink.set(report_headless_status(errors)) # Set first: the daemon reader task inherits it
+    if use_daemon:
+        # Only a daemon that is already running; a script should not leave one behind
+        daemon_connect_task = asyncio.ensure_future(connect_daemon(spawn=False))
+    else:
+        start_yt_dlp_warmup()
+    cancel_event = threading.Event()
+    emitted = 0
+
+    def on_result(result):
+        nonlocal emitted
+        if emitted >= limit:
+            return
+        try:
+            write_json_line(dict(result.to_dict(), url=watch_url(result.id)))
+        except BrokenPipeError:
+            cancel_event.set() # The reader went away (e.g. head); stop extracting
+            return
+        emitted += 1
+        if emitted >= limit:
+            cancel_event.set()
+
+    page = 0
     try:
-        command = ["mpv", stream_url, f"--title=VidTerm: {video_id}"]
-        mpv_process = await asyncio.create_subprocess_exec(*command)
-        await mpv_process.wait() # Wait for mpv to exit
-    except FileNotFoundError: # Should be caught by 'which' check, but as a fallback
-        show_status_message("mpv not found. Please install mpv.", 5)
-    except Exception as e:
-        show_status_message(f"Error during playback: {e}", 5)
+        while emitted < limit and not cancel_event.is_set():
+            results = await search_videos_streaming_async(query, on_result, cancel_event, page)
+            if not results or len(results) < SEARCH_PAGE_SIZE:
+                break
+            page += 1
     finally:
-        # Resume prompt_toolkit application
-        if application_instance:
-            # application_instance.reset() # Reset UI state if needed
-            application_instance.renderer.clear() # Clear screen before resuming
-            await application_instance.resume_from_background()
-        show_status_message(get_default_status_text(), 3)
+        if daemon_client is not None:
+            await daemon_client.close()
+    return 1 if errors and not emitted else 0
+
+def percentile(sorted_values, fraction):
+    """ Nearest-rank percentile of an already sorted, non-empty list. """
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+def read_lines_in_background(stream, loop, queue):
+    """ Feeds stripped non-empty, non-comment lines of stream into an asyncio queue, then None. """
+    def read():
+        for line in stream:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                loop.call_soon_threadsafe(queue.put_nowait, line)
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+    threading.Thread(target=read, name='stdin-reader', daemon=True).start()
+
+async def resolve_command_async(lines, parallel, ordered=False):
+    """ Resolves stream URLs for video ids/URLs from the lines iterable, parallel at a time,
+    printing one JSON line per input in completion (or input) order, then a summary on
+    stderr. Returns the exit status. """
+    start_yt_dlp_warmup()
+    # Every worker keeps its own warm YoutubeDL instance, in a lane as wide as the parallelism
+    ydl_pool.size = max(ydl_pool.size, parallel)
+    job_scheduler.limits[FOREGROUND] = parallel
+    loop = asyncio.get_running_loop()
+    inputs = asyncio.Queue()
+    read_lines_in_background(lines, loop, inputs)
+    await ensure_yt_dlp_async() # Keep the one-off import out of the per-item latencies
+    sequence = itertools.count()
+    waiting = {} # Input index -> finished record, for --ordered
+    next_to_print = 0
+    latencies = []
+    failures = 0
+    started = time.monotonic()
+
+    def emit(index, record):
+        nonlocal next_to_print
+        if not ordered:
+            write_json_line(record)
+            return
+        waiting[index] = record
+        while next_to_print in waiting:
+            write_json_line(waiting.pop(next_to_print))
+            next_to_print += 1
+
+    async def worker():
+        nonlocal failures
+        while True:
+            text = await inputs.get()
+            if text is None:
+                inputs.put_nowait(None) # Let the other workers finish too
+                return
+            index = next(sequence)
+            video_id = parse_video_reference(text)
+            item_started = time.monotonic()
+            try:
+                url, expires_at = await resolve_stream_url_async(video_id)
+                if not url:
+                    raise ValueError("no stream URL found")
+                record = {'input': text, 'id': video_id, 'url': url, 'expires_at': expires_at}
+            except Exception as e:
+                failures += 1
+                record = {'input': text, 'id': video_id, 'error': str(e)}
+            latency = time.monotonic() - item_started
+            latencies.append(latency)
+            record['latency'] = round(latency, 3)
+            emit(index, record)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(parallel)))
+    except BrokenPipeError:
+        return 0 # The reader went away (e.g. head)
+    elapsed = time.monotonic() - started
+    if latencies:
+        latencies.sort()
+        print(f"Resolved {len(latencies) - failures}/{len(latencies)} in {elapsed:.1f}s"
+              f" ({len(latencies) / elapsed:.1f}/s, {parallel} parallel); latency"
+              f" p50 {percentile(latencies, 0.5):.2f}s p90 {percentile(latencies, 0.9):.2f}s"
+              f" p99 {percentile(latencies, 0.99):.2f}s max {latencies[-1]:.2f}s", file=sys.stderr)
+    return 1 if failures else 0
+
+def apply_backend_options(args, in_process):
+    """ Applies the command-line options for whichever process does the yt-dlp, cache and
+    playback work: the daemon, or the TUI itself when in_process. """
+    global extraction_backend, MEDIA_CACHE, STREAM_PROXY
+    if args.extract_processes > 0 and in_process:
+        extraction_backend = ProcessExtractionBackend(args.extract_processes)
+        extraction_backend.start() # Workers import yt-dlp in the background
+    MEDIA_CACHE = args.media_cache
+    STREAM_PROXY = args.stream_proxy
+
+def run_headless_command(args):
+    if args.command == 'daemon':
+        apply_backend_options(args, in_process=True)
+        run_daemon(args.idle_timeout) # Cleans up after itself
+        return 0
+    try:
+        if args.command == 'search':
+            return asyncio.run(search_command_async(' '.join(args.query), args.limit, args.daemon))
+        if args.command == 'resolve':
+            return asyncio.run(resolve_command_async(sys.stdin, args.parallel, args.ordered))
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        job_scheduler.close()
+        search_sessions.close_all()
+        ydl_pool.close_all()
+        search_cache.close()
+        try:
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # Keep the interpreter from complaining about stdout again at exit
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
 
+def positive_int(text):
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0: {text}")
+    return value
+
+def positive_float(text):
+    value = float(text)
+    if not value > 0: # Also rejects nan
+        raise argparse.ArgumentTypeError(f"must be greater than 0: {text}")
+    return value
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Search and watch videos in the terminal.")
+    parser.add_argument('--startup-profile', action='store_true',
+                        help="print an import/initialization timing breakdown on exit")
+    parser.add_argument('--extract-processes', type=int, default=EXTRACTION_PROCESSES, metavar='N',
+                        help="run yt-dlp extraction in N worker processes instead of threads (default %(default)s)")
+    parser.add_argument('--no-daemon', dest='daemon', action='store_false', default=USE_DAEMON,
+                        help="do all work in this process instead of the shared vidtermd background process")
+    parser.add_argument('--media-cache', action='store_true', default=MEDIA_CACHE,
+                        help="keep played videos on disk so that replays need no network")
+    parser.add_argument('--stream-proxy', action='store_true', default=STREAM_PROXY,
+                        help="play through a local caching proxy, so that seeking back and replays reuse fetched data")
+    parser.add_argument('--max-fps', type=positive_float, default=MAX_FPS,
+                        help=f"cap on screen redraws per second (default {MAX_FPS})")
+    parser.add_argument('--frame-stats', action='store_true',
+                        help="show render times and dropped frames in the top right corner (F3 toggles)")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    search = commands.add_parser('search', help="print search results as JSON lines (no UI)")
+    search.add_argument('query', nargs='+')
+    search.add_argument('-n', '--limit', type=positive_int, default=SEARCH_PAGE_SIZE,
+                        help="number of results to print (default %(default)s)")
+    resolve = commands.add_parser('resolve', help="print stream URLs for video ids or URLs read from stdin, as JSON lines")
+    resolve.add_argument('-j', '--parallel', type=positive_int, default=RESOLVE_PARALLELISM,
+                         help="resolve this many at once (default %(default)s)")
+    resolve.add_argument('--ordered', action='store_true',
+                         help="print results in input order instead of as they finish")
+    daemon = commands.add_parser('daemon', help="run vidtermd, the shared background process, in the foreground")
+    daemon.add_argument('--idle-timeout', type=float, default=DAEMON_IDLE_TIMEOUT, metavar='SECONDS',
+                        help="exit after this long without clients; 0 never exits (default %(default)s)")
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    _args = parse_args()
+    if _args.command in HEADLESS_COMMANDS:
+        sys.exit(run_headless_command(_args))
 
 # --- TUI Implementation ---
+_prompt_toolkit_import_started = time.perf_counter()
+from prompt_toolkit import Application
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.layout.containers import HSplit, VSplit, Window, WindowAlign, ConditionalContainer, FloatContainer, Float
+from prompt_toolkit.filters import Condition
+from prompt_toolkit.layout.controls import BufferControl, FormattedTextControl, UIControl, UIContent
+from prompt_toolkit.data_structures import Point
+from prompt_toolkit.styles import Style
+from prompt_toolkit.layout.layout import Layout
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.widgets import TextArea, Label, Frame, Box
+from prompt_toolkit.document import Document
+from prompt_toolkit.shortcuts import message_dialog # For simple error popups
+_prompt_toolkit_imported = time.perf_counter()
+startup_profile.record('import prompt_toolkit', _prompt_toolkit_import_started, _prompt_toolkit_imported)
+_ui_build_started = time.perf_counter()
 current_search_results = []
 selected_video_index = 0
 
@@ -157,85 +3562,441 @@ def _(event):
 
 search_buffer = Buffer()
 search_field = TextArea(buffer=search_buffer, multiline=False, wrap_lines=False, prompt='Search: ', height=1)
-results_text_area = FormattedTextControl(text="Enter a search query above and press Enter.")
-results_window = Window(content=results_text_area, wrap_lines=False, allow_scroll_beyond_bottom=False) # wrap_lines=False for better control
+class ResultsControl(UIControl):
+    """ Results pane that only formats what is on screen. The Window asks for the lines in its
+    viewport, each entry's text is formatted once and cached, and the selection is applied
+    when a line is fetched, so moving the selection costs the same with 10 or 10,000 rows. """
+
+    def __init__(self, get_results, get_selected_index, placeholder):
+        self.get_results = get_results
+        self.get_selected_index = get_selected_index
+        self.placeholder = placeholder
+        self._line_cache = {}
+        self._cached_results = None
+
+    def is_focusable(self):
+        return True
+
+    def format_entry(self, index, video):
+        key = (index, video.id)
+        line = self._line_cache.get(key)
+        if line is None:
+            line = self._line_cache[key] = f"{index+1}. {video.display_title} ({video.duration_string}) - {video.uploader}"
+        return line
+
+    def create_content(self, width, height):
+        results = self.get_results()
+        if results is not self._cached_results:
+            self._line_cache = {} # A new search replaced the list
+            self._cached_results = results
+        if not results:
+            return UIContent(get_line=lambda i: [('', self.placeholder)], line_count=1)
+
+        selected = min(self.get_selected_index(), len(results) - 1)
+
+        def get_line(i):
+            if i == selected:
+                return [('class:results.selected', "[SELECTED] " + self.format_entry(i, results[i]))]
+            return [('', "           " + self.format_entry(i, results[i]))] # Fixed width prefix
+
+        # The cursor position makes the Window scroll the selected row into view
+        return UIContent(get_line=get_line, line_count=len(results), cursor_position=Point(x=0, y=selected), show_cursor=False)
+
+result_filter = FuzzyFilter()
+filter_active = False # The '/' filter field is open
+
+def visible_results():
+    """ The rows shown in the results pane: current_search_results narrowed by the filter. """
+    return result_filter.apply(current_search_results)
+
+results_control = ResultsControl(visible_results, lambda: selected_video_index,
+                                 placeholder="Enter a search query above and press Enter.")
+results_window = Window(content=results_control, wrap_lines=False, allow_scroll_beyond_bottom=False) # wrap_lines=False for better control
 
 def update_results_display():
-    global current_search_results, selected_video_index
+    # Rows are formatted lazily by results_control during the next render
     if not current_search_results:
-        results_text_area.text = "No results found, or perform a search."
+        results_control.placeholder = "No results found, or perform a search."
+    elif result_filter.pattern:
+        results_control.placeholder = "No loaded results match the filter."
+
+    frame_scheduler.request_redraw()
+
+# Paging state of the results shown for search_controller.query
+current_search_page = 0
+search_results_exhausted = False
+current_search_result_ids = set()
+
+def append_search_result(result):
+    """ Adds a result to the pane unless a row with the same id is already shown. """
+    if result.id in current_search_result_ids:
+        return False
+    current_search_result_ids.add(result.id)
+    current_search_results.append(result)
+    update_results_display()
+    return True
+
+def update_prefetch_targets():
+    """ Points the stream prefetcher at the highlighted row and the top results. """
+    results = visible_results()
+    if not results:
+        return
+    highlighted = results[selected_video_index].id if selected_video_index < len(results) else None
+    stream_prefetcher.update(highlighted, [result.id for result in results[:stream_prefetcher.top_n]])
+
+def on_highlight_changed():
+    update_prefetch_targets()
+    if thumbnail_previews_available:
+        results = visible_results()
+        if selected_video_index < len(results):
+            neighbours = results[max(0, selected_video_index - THUMBNAIL_NEIGHBOURS):selected_video_index + THUMBNAIL_NEIGHBOURS + 1]
+            thumbnail_preview.show(results[selected_video_index].id, [result.id for result in neighbours])
+        else:
+            thumbnail_preview.show(None)
+
+def reset_search_results():
+    global current_search_results, current_search_result_ids, selected_video_index
+    global current_search_page, search_results_exhausted, filter_active
+    if filter_active or result_filter.pattern: # The filter narrows one result set, not the next
+        filter_field.buffer.reset()
+        result_filter.set_pattern('')
+        filter_active = False
+    current_search_results = []
+    current_search_result_ids = set()
+    selected_video_index = 0
+    current_search_page = 0
+    search_results_exhausted = False
+
+async def search_accept_handler_async(query, generation):
+    global search_results_exhausted
+    cancel_event = search_controller.cancel_event
+
+    def on_result(result):
+        if search_controller.is_current(generation):
+            append_search_result(result)
+
+    if not STREAMING_SEARCH:
+        results = await search_videos_async(query)
+        if not search_controller.is_current(generation):
+            return
+        reset_search_results()
+        for result in results:
+            on_result(result)
     else:
-        formatted_results = []
-        for i, video in enumerate(current_search_results):
-            prefix = "[SELECTED] " if i == selected_video_index else "           " # Fixed width prefix
-            line = f"{prefix}{i+1}. {video['title']} ({video['duration_string']}) - {video['uploader']}"
-            # Truncate long lines if they might cause wrapping issues, or ensure window handles scrolling
-            formatted_results.append(line)
-        results_text_area.text = "\n".join(formatted_results)
+        reset_search_results()
+        update_results_display()
+        results = await search_videos_streaming_async(query, on_result, cancel_event)
+        if results is None or not search_controller.is_current(generation):
+            return
+    search_results_exhausted = len(results) < SEARCH_PAGE_SIZE
+    update_results_display()
+    on_highlight_changed()
 
-    if application_instance:
-        application_instance.invalidate()
+def start_search(query):
+    """ Shows results for query, joining the running search if it is for the same query. """
+    if search_controller.busy() and SearchResultCache.normalize(query) == SearchResultCache.normalize(search_controller.query):
+        return
+    generation = search_controller.begin(query)
+    search_controller.spawn(search_accept_handler_async(query, generation))
 
-async def search_accept_handler_async(buf):
-    global current_search_results, selected_video_index
+def run_live_search(query):
+    if len(query.strip()) >= LIVE_SEARCH_MIN_CHARS:
+        start_search(query)
+
+live_search_debouncer = Debouncer(LIVE_SEARCH_DEBOUNCE, run_live_search)
+
+def on_search_text_changed(buf):
+    if LIVE_SEARCH:
+        live_search_debouncer(buf.text)
+
+def search_accept_handler(buf):
     query = search_buffer.text
     if query:
-        current_search_results = await search_videos_async(query)
-        selected_video_index = 0
-        update_results_display()
+        live_search_debouncer.cancel() # Enter searches right away
+        start_search(query)
     # search_buffer.reset() # Keep query for context or clear it
+    return True # Keep the query in the search field
+
+async def load_next_search_page_async(generation):
+    global current_search_page, search_results_exhausted
+    query, cancel_event = search_controller.query, search_controller.cancel_event
+    page = current_search_page + 1
+    added = 0
+
+    def on_result(result):
+        nonlocal added
+        if search_controller.is_current(generation) and append_search_result(result):
+            added += 1
+
+    if STREAMING_SEARCH:
+        results = await search_videos_streaming_async(query, on_result, cancel_event, page=page)
+    else:
+        results = await search_videos_async(query, page=page)
+        for result in results:
+            on_result(result)
+    if results is None or not search_controller.is_current(generation):
+        return # Superseded by a newer query
+    current_search_page = page
+    # A short page, or one that only repeated rows we already have, means we reached the end
+    search_results_exhausted = len(results) < SEARCH_PAGE_SIZE or added == 0
 
-search_field.accept_handler = lambda buf: asyncio.create_task(search_accept_handler_async(buf))
+def maybe_load_next_search_page():
+    """ Starts loading the next page in the background once the selection nears the end. """
+    if not search_controller.query or search_results_exhausted or search_controller.busy():
+        return
+    if len(visible_results()) - 1 - selected_video_index >= SEARCH_PAGE_PREFETCH_MARGIN:
+        return
+    search_controller.spawn(load_next_search_page_async(search_controller.generation))
+
+search_field.accept_handler = search_accept_handler
+search_buffer.on_text_changed += on_search_text_changed
 
 @kb.add('down')
 def _(event):
-    global selected_video_index, current_search_results
-    if current_search_results:
-        selected_video_index = min(len(current_search_results) - 1, selected_video_index + 1)
+    global selected_video_index
+    results = visible_results()
+    if results:
+        selected_video_index = min(len(results) - 1, selected_video_index + 1)
         update_results_display()
+        on_highlight_changed()
+        maybe_load_next_search_page()
 
 @kb.add('up')
 def _(event):
     global selected_video_index
-    if current_search_results: # Check not just selected_video_index > 0
+    if visible_results(): # Check not just selected_video_index > 0
         selected_video_index = max(0, selected_video_index - 1)
         update_results_display()
+        on_highlight_changed()
+
+@kb.add('tab')
+@kb.add('s-tab')
+def _(event):
+    # Switch between the search field and the results pane (and the filter field when open)
+    event.app.layout.focus_next()
+
+filter_field = TextArea(multiline=False, wrap_lines=False, prompt='/', height=1)
+
+def set_result_filter(pattern):
+    global selected_video_index
+    result_filter.set_pattern(pattern)
+    selected_video_index = 0
+    update_results_display()
+    on_highlight_changed()
+
+def close_result_filter(app, clear):
+    global filter_active
+    if clear:
+        filter_field.buffer.reset()
+        set_result_filter('')
+    filter_active = False
+    app.layout.focus(results_window)
+
+filter_field.buffer.on_text_changed += lambda buf: set_result_filter(buf.text)
+filter_field.accept_handler = lambda buf: close_result_filter(application_instance, clear=False) or True
+
+@kb.add('/', filter=Condition(lambda: application_instance is not None and application_instance.layout.has_focus(results_window)))
+def _(event):
+    global filter_active
+    filter_active = True
+    event.app.layout.focus(filter_field)
+
+@kb.add('escape', filter=Condition(lambda: filter_active or bool(result_filter.pattern)))
+def _(event):
+    close_result_filter(event.app, clear=True)
 
-@kb.add('enter', filter=lambda: application_instance is not None and application_instance.layout.has_focus(search_field) == False) # Only if search is not focused
+@kb.add('enter', filter=lambda: application_instance is not None and application_instance.layout.has_focus(search_field) == False and application_instance.layout.has_focus(filter_field) == False) # Only if search is not focused
 def _(event):
-    global current_search_results, selected_video_index
-    if current_search_results and 0 <= selected_video_index < len(current_search_results):
-        video_to_play = current_search_results[selected_video_index]
-        asyncio.create_task(play_video_in_terminal_async(video_to_play['id']))
+    global selected_video_index
+    results = visible_results()
+    if results and 0 <= selected_video_index < len(results):
+        video_to_play = results[selected_video_index]
+        asyncio.create_task(play_video_in_terminal_async(video_to_play.id))
+
+class ThumbnailControl(UIControl):
+    """ Preview panel. Half-block renderings are drawn as styled text; kitty and sixel images
+    are written straight to the terminal after each render (see draw_thumbnail_graphics),
+    over the blank cells this control reserves. """
+
+    def __init__(self, preview):
+        self.preview = preview
+
+    def create_content(self, width, height):
+        rendering = self.preview.rendered
+        if not thumbnail_previews_available:
+            lines = [[('', "Install Pillow")], [('', "for thumbnails.")]]
+        elif rendering is None:
+            lines = [[('', "Loading..." if self.preview.current_id else "")]]
+        elif isinstance(rendering, str):
+            lines = [[('', "")]] * self.preview.rows
+        else:
+            lines = rendering
+        return UIContent(get_line=lambda i: lines[i], line_count=len(lines))
+
+thumbnail_window = Window(ThumbnailControl(thumbnail_preview), width=THUMBNAIL_COLS, height=THUMBNAIL_ROWS)
+_drawn_thumbnail = None # What draw_thumbnail_graphics last wrote, and where
+
+def draw_thumbnail_graphics(app):
+    """ after_render hook that places kitty/sixel thumbnails over the preview panel. Only
+    rewrites the image when it, its position or the terminal size changed. """
+    global _drawn_thumbnail
+    rendering = thumbnail_preview.rendered
+    info = thumbnail_window.render_info
+    if info is None or not isinstance(rendering, str):
+        if _drawn_thumbnail and thumbnail_preview.protocol == 'kitty':
+            app.output.write_raw("\x1b_Ga=d,q=2\x1b\\") # Remove the previous image
+            app.output.flush()
+        _drawn_thumbnail = None
+        return
+    position = (info._x_offset, info._y_offset)
+    state = (thumbnail_preview.current_id, position, app.output.get_size())
+    if state == _drawn_thumbnail:
+        return
+    _drawn_thumbnail = state
+    clear = "\x1b_Ga=d,q=2\x1b\\" if thumbnail_preview.protocol == 'kitty' else ""
+    app.output.write_raw(f"\x1b7{clear}\x1b[{position[1] + 1};{position[0] + 1}H{rendering}\x1b8")
+    app.output.flush()
+
+thumbnail_preview.on_change = frame_scheduler.request_redraw
 
 # Layout
 status_bar_control = FormattedTextControl(get_default_status_text())
 status_bar = Window(status_bar_control, height=1, style="reverse", align=WindowAlign.LEFT)
 
+status_log_visible = False
+
+def status_log_text():
+    return "\n".join(f"{time.strftime('%H:%M:%S', time.localtime(at))}  {message}"
+                     for at, message in status_manager.log)
+
+# Newest messages at the bottom, right above the status bar
+status_log_window = Window(FormattedTextControl(status_log_text), height=8, wrap_lines=False,
+                           get_vertical_scroll=lambda window: max(0, len(status_manager.log) - 8))
+
+frame_stats_visible = FRAME_STATS_OVERLAY
+
+frame_stats_overlay = ConditionalContainer(
+    Window(FormattedTextControl(lambda: frame_scheduler.summary()), height=1, dont_extend_width=True, style="reverse"),
+    filter=Condition(lambda: frame_stats_visible))
+
+@kb.add('f3')
+def _(event):
+    # Show or hide the frame timing overlay
+    global frame_stats_visible
+    frame_stats_visible = not frame_stats_visible
+
+@kb.add('f2')
+def _(event):
+    # Show or hide the status message log
+    global status_log_visible
+    status_log_visible = not status_log_visible
+
 # Make results window scrollable if content overflows
-results_frame = Frame(results_window, title="Results (Up/Down, Enter to play)")
+results_frame = Frame(HSplit([
+    results_window,
+    ConditionalContainer(filter_field, filter=Condition(lambda: filter_active)),
+]), title="Results (Up/Down, Enter to play, / to filter, Tab to switch)")
+
+preview_frame = ConditionalContainer(Frame(thumbnail_window, title="Preview"), filter=Condition(lambda: THUMBNAIL_PREVIEWS))
 
-body = HSplit([
+body = FloatContainer(HSplit([
     Frame(search_field, title="Search Query"),
-    results_frame,
+    VSplit([results_frame, preview_frame]),
+    ConditionalContainer(Frame(status_log_window, title="Messages (F2 to close)"), filter=Condition(lambda: status_log_visible)),
     status_bar
-])
-
-def main():
-    global application_instance
-    application_instance = Application(
-        layout=Layout(body),
-        key_bindings=kb,
-        full_screen=True,
-        mouse_support=True # Consider making this optional
-    )
+]), floats=[Float(frame_stats_overlay, top=0, right=0)])
+startup_profile.record('build UI widgets', _ui_build_started)
+
+def format_playback_position(seconds):
+    return format_duration(seconds) if seconds is not None else "--:--"
+
+def on_playback_property(name, value):
+    previous_second = int(playback_state['time-pos'] or 0)
+    playback_state[name] = value
+    if name == 'time-pos' and value is not None and int(value) == previous_second:
+        return # Only redraw the status bar once per second of playback
+    if playback_state['time-pos'] is None:
+        return # Idle
+    cache = playback_state['demuxer-cache-state'] or {}
+    cached = f" | cache {cache['cache-duration']:.0f}s" if cache.get('cache-duration') is not None else ""
+    paused = " (paused)" if playback_state['pause'] else ""
+    status_manager.show(f"Playing {format_playback_position(playback_state['time-pos'])}"
+                        f" / {format_playback_position(playback_state['duration'])}{paused}{cached}",
+                        log=False) # Position ticks would flood the message log
+
+def on_playback_end(message):
+    playback_state['time-pos'] = None
+    show_status_message(get_default_status_text())
+
+async def run_application_async(use_daemon=False, extract_processes=0):
+    global daemon_connect_task, daemon_client
+    if use_daemon:
+        # Warms yt-dlp here if it fails
+        daemon_connect_task = asyncio.ensure_future(connect_daemon(extract_processes=extract_processes))
+    else:
+        start_yt_dlp_warmup()
+    mpv_probe.start() # Runs while the UI comes up
+    if MPV_PERSISTENT:
+        # Only used without a daemon; the daemon's playback updates arrive as broadcasts
+        for name in playback_state:
+            await mpv_controller.observe_property(name, on_playback_property)
+        mpv_controller.on_event('end-file', on_playback_end)
+    try:
+        await application_instance.run_async()
+    finally:
+        client, daemon_client = daemon_client, None # Not a disconnect to recover from
+        if client is not None:
+            await client.close()
+        await mpv_controller.close()
+        await stream_proxy.close()
+
+def main(argv=None):
+    global application_instance, frame_stats_visible, playback_target_source
+    args = parse_args(argv)
+    apply_backend_options(args, in_process=not args.daemon)
+    playback_target_source = terminal_playback_target # Streams are chosen for this terminal
+    with startup_profile.phase('create Application'):
+        application_instance = Application(
+            layout=Layout(body),
+            key_bindings=kb,
+            style=Style.from_dict({'results.selected': 'reverse'}),
+            full_screen=True,
+            mouse_support=True # Consider making this optional
+        )
     # Store status_bar_control on app for easy access
     application_instance.status_bar_control = status_bar_control
 
+    application_instance.after_render += draw_thumbnail_graphics
+    frame_scheduler.max_fps = args.max_fps
+    frame_scheduler.attach(application_instance)
+    frame_stats_visible = frame_stats_visible or args.frame_stats
+
+    def on_first_render(app):
+        startup_profile.record('first frame (since process start)', _process_started)
+        application_instance.after_render -= on_first_render
+    application_instance.after_render += on_first_render
+
     # Initial display update
     update_results_display()
     # Run the application using asyncio
-    asyncio.run(application_instance.run_async())
+    try:
+        asyncio.run(run_application_async(args.daemon, args.extract_processes))
+    finally:
+        stream_prefetcher.cancel_all()
+        thumbnail_preview.close()
+        media_cache.close()
+        status_manager.close()
+        job_scheduler.close()
+        if extraction_backend is not None:
+            extraction_backend.close()
+        stream_url_cache.close()
+        search_sessions.close_all()
+        ydl_pool.close_all()
+        search_cache.close()
+        if args.startup_profile:
+            print(startup_profile.report(), file=sys.stderr)
+            if not yt_dlp_ready.done():
+                print("(yt-dlp warm-up still running at exit)", file=sys.stderr)
 
 
 if __name__ == '__main__':